@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from joboffer.cache import read_cached
+from joboffer.instrument import stage
+from NJUI.preprocessing_data import DATA_DIR, ENTRY_FILE_NAME
+
+
+def read_entry_index(entry_file_path):
+    # Case ids of the entry survey in ascending order; every entry column is stored in this order
+    caseid = pd.read_stata(entry_file_path, columns=['caseid'])['caseid'].to_numpy(dtype=np.int64)
+    if len(np.unique(caseid)) != len(caseid):
+        raise ValueError(f"Case ids of {entry_file_path} are not unique")
+    return pd.DataFrame({'caseid': np.sort(caseid).astype(np.int32)})
+
+
+def read_entry_column(entry_file_path, column):
+    # One entry survey column, in the order of read_entry_index
+    df = pd.read_stata(entry_file_path, columns=['caseid', column])
+    return df.sort_values('caseid', kind='stable')[[column]].reset_index(drop=True)
+
+
+# Entry survey covariates (demographics, prior earnings, ...) by case id. The sorted case ids are read once; a column
+# is only read from the file the first time it is asked for. Both are kept as binary columns in the .cache folder, so
+# later runs read neither from entry.dta.
+class EntryCovariates:
+    def __init__(self, entry_file_path=os.path.join(DATA_DIR, ENTRY_FILE_NAME), use_cache=True):
+        self.entry_file_path = entry_file_path
+        self.use_cache = use_cache
+        self.caseid = self.read(read_entry_index)['caseid'].to_numpy()
+        self.columns = {}  # Column name -> values in the order of self.caseid, for the columns read so far
+
+    def read(self, read_function, **read_kwargs):
+        if self.use_cache:
+            return read_cached(read_function, self.entry_file_path, **read_kwargs)
+        return read_function(self.entry_file_path, **read_kwargs)
+
+    def column(self, column):
+        if column not in self.columns:
+            self.columns[column] = self.read(read_entry_column, column=column)[column].array
+        return self.columns[column]
+
+    def positions(self, caseid):
+        # Position of every case id in the entry survey; -1 for cases that did not answer it
+        caseid = np.asarray(caseid, dtype=np.int64)
+        positions = np.searchsorted(self.caseid, caseid)
+        positions[positions == len(self.caseid)] = 0
+        found = len(self.caseid) > 0 and self.caseid[positions] == caseid
+        return np.where(found, positions, -1)
+
+    def attach(self, df, columns, case_column='caseid'):
+        # df with the entry columns of each row's case added (missing for cases without an entry survey)
+        positions = self.positions(df[case_column])
+        values = {column: pd.api.extensions.take(self.column(column), positions, allow_fill=True) for column in columns}
+        return df.assign(**{column: pd.Series(array, index=df.index) for column, array in values.items()})
+
+
+@stage
+def attach_entry_covariates(df, covariates, columns):
+    return covariates.attach(df, columns)
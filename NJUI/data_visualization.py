@@ -1,13 +1,44 @@
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 import os
-import seaborn as sns
-import statsmodels.api as sm
 
+from joboffer.artifacts import (artifact_key, input_fingerprints, load_manifest, manifest_entries, save_manifest,
+                                up_to_date)
+from joboffer.binning import binned_acceptance
+from joboffer.bootstrap import BOOTSTRAP_REPLICATES, bootstrap_acceptance_bands
+from joboffer.cache import code_version
+from joboffer.instrument import filter_rows, stage
+from joboffer.quantiles import QuantileSketch
+from joboffer.runner import run_variants
+from joboffer.schema import csv_dtypes, enforce, read_table
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+RESULT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'result')
+
+# Preprocessed tables and their exclude option (1: exclude don't know, 2: include don't know)
+FILE_NAMES = {'preprocessed_exclude_dk.csv': 1, 'preprocessed_include_dk.csv': 2}
+
+# 'exact': hand-picked bin edges per exclude option and in-memory IQR bounds (the published results)
+# 'sketch': bin edges and IQR bounds computed from a quantile sketch built while the table is read in chunks
+BINNING_OPTIONS = ['exact', 'sketch']
+# Hand-picked quantile bin edges (exclude option -> edges), used by the 'exact' binning
+QUANTILE_BINS = {
+    1: [-0.92, -0.536, -0.36, -0.237, -0.142, 0.0, 0.133, 0.262, 0.7],  # exclude don't know
+    2: [-0.92, -0.549, -0.366, -0.248, -0.154, 0.0, 0.134, 0.287, 0.7],  # include don't know
+}
+QUANTILE_BIN_COUNT = 10  # Quantile bins of the 'sketch' binning, before zero is added as an edge
+REGRESSION_LINE_POINTS = 100  # Points of each fitted line and its confidence band
+CSV_CHUNK_SIZE = 100000  # Rows of the preprocessed table read at a time by the 'sketch' binning
+# Graph title and file name of each exclude option
+GRAPH_NAMES = {1: 'exclude do not know yet (642 offers)', 2: 'include do not know yet (908 offers)'}
+OUTLIER_RULE = '1.5 IQR'  # Rule of process_outliers, recorded with the results
+# Modules whose code makes the graphs and grouped tables; a change to any of them makes them again
+CODE_MODULES = [__name__, 'joboffer.binning', 'joboffer.bootstrap', 'joboffer.quantiles', 'joboffer.schema']
+
+@stage
 def process_outliers(file_path):
     # Read the CSV file into a pandas DataFrame
-    df = pd.read_csv(file_path)
+    df = read_table(file_path, 'njui_offers')
     
     # Create wage_difference column 
     df['wage_difference'] = np.log(df['offered_wage'] / df['previous_wage'])
@@ -22,77 +53,119 @@ def process_outliers(file_path):
     upper_bound = Q3 + 1.5 * IQR    
 
     # Exclude outliers from the DataFrame
-    filtered_df = df[(df['wage_difference'] >= lower_bound) & (df['wage_difference'] <= upper_bound)]
-
-    # Display the length of filtered DataFrame
-    print("Length of data excluding outliers:", len(filtered_df))  # Print the length of final_data
+    filtered_df = filter_rows(df, 'process_outliers', {
+        'wage_difference >= lower_bound': df['wage_difference'] >= lower_bound,
+        'wage_difference <= upper_bound': df['wage_difference'] <= upper_bound,
+    })
     
     return filtered_df
+
+@stage
+def process_outliers_streaming(file_path, n_bins=QUANTILE_BIN_COUNT, chunksize=CSV_CHUNK_SIZE):
+    # Same outlier filter as process_outliers, but the quartiles come from a quantile sketch and the same sketch
+    # gives the quantile bin edges. The table is read in chunks twice: the first pass merges a sketch of every
+    # chunk and drops the chunk, the second keeps the rows of each chunk within the bounds. Only the kept rows are
+    # held in memory. Returns (filtered_df, bins).
+    sketch = QuantileSketch()
+    for chunk in read_offer_chunks(file_path, chunksize):
+        sketch.merge(QuantileSketch().update(chunk['wage_difference']))
+
+    lower_bound, upper_bound = outlier_bounds(sketch)
+    kept = [filter_rows(chunk, 'process_outliers_streaming', {
+        'wage_difference >= lower_bound': chunk['wage_difference'] >= lower_bound,
+        'wage_difference <= upper_bound': chunk['wage_difference'] <= upper_bound,
+    }) for chunk in read_offer_chunks(file_path, chunksize)]
+    filtered_df = enforce(pd.concat(kept), 'njui_offers')
+
+    return filtered_df, sketch_quantile_bins(sketch, lower_bound, upper_bound, n_bins)
+
+def read_offer_chunks(file_path, chunksize=CSV_CHUNK_SIZE):
+    # Chunks of the preprocessed table with their wage differences; row labels continue from chunk to chunk
+    with pd.read_csv(file_path, dtype=csv_dtypes('njui_offers'), chunksize=chunksize) as reader:
+        for chunk in reader:
+            chunk['wage_difference'] = np.log(chunk['offered_wage'] / chunk['previous_wage'])
+            yield chunk
+
+def outlier_bounds(sketch):
+    # 1.5 IQR bounds from the quartiles of the sketch
+    Q1, Q3 = sketch.quantile([0.25, 0.75])
+    IQR = Q3 - Q1
+    return Q1 - 1.5 * IQR, Q3 + 1.5 * IQR
+
+def sketch_quantile_bins(sketch, lower_bound, upper_bound, n_bins=QUANTILE_BIN_COUNT):
+    # Quantile edges of the values kept by the outlier filter. The kept values are the ranks of the sketch
+    # between the two bounds, so their quantiles are read from the sketch of the whole table.
+    lowest_rank = sketch.rank(lower_bound)
+    highest_rank = sketch.rank(upper_bound, inclusive=True) - 1
+    edges = sketch.value_at_rank(lowest_rank + np.linspace(0, 1, n_bins + 1) * (highest_rank - lowest_rank))
+
+    # Zero is always an edge so no bin mixes raises and cuts (zero itself is the special bin).
+    # Repeated values (e.g. many offers at the same wage) give duplicate edges, which are merged.
+    if edges[0] < 0 < edges[-1]:
+        edges = np.append(edges, 0.0)
+    return np.unique(edges).tolist()
     
 # Generate quantile bins
-def group_data_quantile_bins(filtered_df, exclude_option):
-    wage_0 = filtered_df[filtered_df['wage_difference']==0]
-    wage_1 = filtered_df[filtered_df['wage_difference']!=0]
-    
-    # Drop duplicate edges
-    if exclude_option == 1 : # exclude don't know
-        bins = [-0.92, -0.536, -0.36, -0.237, -0.142, 0.0, 0.133, 0.262, 0.7]
-    elif exclude_option == 2 : # include don't know 
-        bins = [-0.92, -0.549, -0.366, -0.248, -0.154, 0.0, 0.134, 0.287, 0.7]
-    
-    # Wage != 0일때 먼저 grouped 
-    # Bin the wage_difference column using the quantile bins
-    wage_1['wage_diff_quantile_bin'] = pd.cut(wage_1['wage_difference'], bins=bins, include_lowest=True)
-
-    # Calculate average offer within each quantile bin
-    grouped_data_not_zero = wage_1.groupby('wage_diff_quantile_bin').agg(
-        avg_offer=('wage_difference', 'mean'),
-        total_count=('acceptance_yn', 'count'),
-        accept_count=('acceptance_yn', lambda x: (x == 'y').sum())
-    ).reset_index()
-
-    grouped_data_not_zero['acceptance_ratio_per_interval'] = grouped_data_not_zero['accept_count'] / grouped_data_not_zero['total_count']
-    
-    
-    # Wage == 0 일때 
-    grouped_data0 = wage_0.groupby('wage_difference').agg(
-        avg_offer=('wage_difference', 'mean'),
-        total_count=('acceptance_yn', 'count'),
-        accept_count=('acceptance_yn', lambda x: (x == 'y').sum())
-    ).reset_index()
-
-    grouped_data0['acceptance_ratio_per_interval'] = grouped_data0['accept_count'] / grouped_data0['total_count']
-    grouped_data0['wage_diff_quantile_bin'] = '[0.0, 0.0]'
-    grouped_zero = grouped_data0.loc[:,['wage_diff_quantile_bin', 'avg_offer', 'total_count', 'accept_count', 'acceptance_ratio_per_interval'
-]]
+@stage
+def group_data_quantile_bins(filtered_df, exclude_option, bootstrap_replicates=BOOTSTRAP_REPLICATES, bins=None):
+    # bins: edges from process_outliers_streaming, or the hand-picked edges of the exclude option
+    if bins is None:
+        bins = QUANTILE_BINS[exclude_option]
+
+    # Wage != 0 rows are counted in the quantile bins and wage == 0 rows in the zero bin after them, in one pass
+    accepted = filtered_df['acceptance_yn'].to_numpy()
+    tables, codes = binned_acceptance(
+        filtered_df['wage_difference'], accepted, {'quantile': bins}, include_lowest=True, zero_bin=True
+    )
+    grouped_data = tables['quantile'].rename(columns={
+        'bin': 'wage_diff_quantile_bin', 'mean_value': 'avg_offer', 'acceptance_ratio': 'acceptance_ratio_per_interval'
+    })
+
+    # Bootstrap band of each bin's acceptance ratio, resampling cases with all their weekly offers.
+    # All bins, including the zero bin, come from the same replicates.
+    if bootstrap_replicates:
+        lower, upper = bootstrap_acceptance_bands(
+            filtered_df['caseid'], codes['quantile'], accepted, len(grouped_data), replicates=bootstrap_replicates
+        )
+        grouped_data = grouped_data.assign(acceptance_ratio_lower=lower, acceptance_ratio_upper=upper)
+
+    # The zero bin is the last row; it is left out when no offer has a zero wage difference
+    grouped_data_not_zero = grouped_data.iloc[:-1]
+    grouped_zero = grouped_data.iloc[-1:][grouped_data['total_count'].iloc[-1:] > 0].reset_index(drop=True)
     return grouped_data_not_zero, grouped_zero
 
 # Graph for quantile bins only 
-def generate_and_save_final_graph(filtered_df, exclude_option):
-    filtered_df['accept_yn'] = np.where(filtered_df['acceptance_yn'] == 'y', 1, 0)
+@stage
+def generate_and_save_final_graph(filtered_df, exclude_option, result_folder=RESULT_DIR, grouped=None, cluster_band=False):
+    # Plotting and model libraries are imported here so the data functions load without them
+    import matplotlib.pyplot as plt
+    import statsmodels.api as sm
+
+    filtered_df['accept_yn'] = np.where(filtered_df['acceptance_yn'], 1, 0)
     positive_intervals = filtered_df[filtered_df['wage_difference'] > 0]
     negative_intervals = filtered_df[filtered_df['wage_difference'] < 0]
 
-    grouped_not_zero, grouped_zero = group_data_quantile_bins(filtered_df, exclude_option)
+    # grouped: (grouped_not_zero, grouped_zero) from group_data_quantile_bins, if already computed
+    grouped_not_zero, grouped_zero = grouped if grouped is not None else group_data_quantile_bins(filtered_df, exclude_option)
 
-    positive_model = sm.OLS(positive_intervals['accept_yn'], sm.add_constant(positive_intervals['wage_difference'])).fit()
-    negative_model = sm.OLS(negative_intervals['accept_yn'], sm.add_constant(negative_intervals['wage_difference'])).fit()
+    # cluster_band: standard errors clustered by caseid (the weekly offers of a case are not independent)
+    positive_model = sm.OLS(positive_intervals['accept_yn'], sm.add_constant(positive_intervals['wage_difference']))
+    negative_model = sm.OLS(negative_intervals['accept_yn'], sm.add_constant(negative_intervals['wage_difference']))
+    if cluster_band:
+        positive_model = positive_model.fit(cov_type='cluster', cov_kwds={'groups': positive_intervals['caseid']})
+        negative_model = negative_model.fit(cov_type='cluster', cov_kwds={'groups': negative_intervals['caseid']})
+    else:
+        positive_model = positive_model.fit()
+        negative_model = negative_model.fit()
 
     plt.figure(figsize=(15, 10))
 
-    sns.regplot(
-        x=positive_intervals['wage_difference'],
-        y=positive_intervals['accept_yn'],
-        scatter=False,
-        color='blue'
-    )
-
-    sns.regplot(
-        x=negative_intervals['wage_difference'],
-        y=negative_intervals['accept_yn'],
-        scatter=False,
-        color='red'
-    )
+    # Fitted lines with 95% confidence bands of the mean, taken from the fitted models
+    for model, intervals, color in [(positive_model, positive_intervals, 'blue'), (negative_model, negative_intervals, 'red')]:
+        x = np.linspace(intervals['wage_difference'].min(), intervals['wage_difference'].max(), REGRESSION_LINE_POINTS)
+        prediction = model.get_prediction(sm.add_constant(x, has_constant='add')).summary_frame(alpha=0.05)
+        plt.plot(x, prediction['mean'], color=color)
+        plt.fill_between(x, prediction['mean_ci_lower'], prediction['mean_ci_upper'], color=color, alpha=0.15)
 
     plt.axvline(x=0, color='black', linestyle='--', label='wage_diff = 0')
 
@@ -104,6 +177,13 @@ def generate_and_save_final_graph(filtered_df, exclude_option):
     y_interval = grouped_not_zero['acceptance_ratio_per_interval']
     plt.scatter(x_interval, y_interval, color='black', label='Interval Average Value')
 
+    # Bootstrap bands of the bin acceptance ratios
+    for grouped, color in [(grouped_zero, 'orange'), (grouped_not_zero, 'black')]:
+        if 'acceptance_ratio_lower' in grouped:
+            y = grouped['acceptance_ratio_per_interval']
+            plt.errorbar(grouped['avg_offer'], y, yerr=[y - grouped['acceptance_ratio_lower'], grouped['acceptance_ratio_upper'] - y],
+                         fmt='none', ecolor=color, capsize=4)
+
     print("Positive Model Summary:")
     print(positive_model.summary())
 
@@ -114,7 +194,7 @@ def generate_and_save_final_graph(filtered_df, exclude_option):
     plt.ylabel('Acceptance (1 or 0)')
     plt.legend()
 
-    filename_prefix = 'exclude do not know yet (642 offers)' if exclude_option == 1 else 'include do not know yet (908 offers)'
+    filename_prefix = GRAPH_NAMES[exclude_option]
     plt.title(f'Acceptance Ratio on Log Wage Difference\n {filename_prefix}')
     plt.grid(True)
     
@@ -122,7 +202,6 @@ def generate_and_save_final_graph(filtered_df, exclude_option):
     
     plot_filename = os.path.join(result_folder, f"{filename_prefix}_graph.jpg")
     plt.savefig(plot_filename, bbox_inches='tight', pad_inches=0.5)
-    plt.show()
     plt.close()
 
     
@@ -141,43 +220,59 @@ def save_table_csv(grouped_data, filename_prefix, result_folder):
     print(f"Saved grouped data as CSV file for {filename_prefix}")
     
 
-# List of file paths
-file_paths = ['data/preprocessed_exclude_dk.csv', 'data/preprocessed_include_dk.csv']
-
-# Folder name for saving results
-result_folder = 'result'
+def visualize_file(file_name, data_dir, result_folder, binning, cluster_band, manifest, force=False):
+    # Returns the manifest entries of the files it saved; nothing if they are up to date
+    exclude_option = FILE_NAMES[file_name]
+    file_path = os.path.join(data_dir, file_name)
+    # Extract filename without extension
+    filename_prefix = os.path.splitext(os.path.basename(file_path))[0]
+    artifact_names = [f"{GRAPH_NAMES[exclude_option]}_graph.jpg", f"{filename_prefix}_grouped_data.csv"]
 
-# Check if the 'result' folder exists, if not, create it
-if not os.path.exists(result_folder):
-    os.makedirs(result_folder)
+    # Skip the file if its inputs, parameters and code are the ones its results were made from
+    inputs = input_fingerprints([file_path])
+    params = {'binning': binning, 'bins': QUANTILE_BINS[exclude_option] if binning == 'exact' else QUANTILE_BIN_COUNT,
+              'cluster_band': cluster_band, 'bootstrap_replicates': BOOTSTRAP_REPLICATES, 'outliers': OUTLIER_RULE}
+    code = code_version(CODE_MODULES)
+    key = artifact_key(inputs, params, code)
+    if not force and up_to_date(manifest, result_folder, artifact_names, key):
+        print(f"Results of {filename_prefix} are up to date")
+        return {}
 
-# Iterate through file paths
-for file_path in file_paths:
-    
     # Load the DataFrame and process outliers
-    df = process_outliers(file_path) 
-    
-    # Setting the exclude option 
-    if file_path == 'data/preprocessed_exclude_dk.csv' :
-        exclude_option = 1 
+    if binning == 'sketch':
+        df, bins = process_outliers_streaming(file_path)
     else:
-        exclude_option = 2
+        df, bins = process_outliers(file_path), QUANTILE_BINS[exclude_option]
         
     # Group the data
-    grouped_not_zero, grouped_zero = group_data_quantile_bins(df, exclude_option)
-    print(len(df), "exclude_option is ",exclude_option)
+    grouped_not_zero, grouped_zero = group_data_quantile_bins(df, exclude_option, bins=bins)
     
     # Total Table 
-    total_table = grouped_not_zero.append(grouped_zero, ignore_index=True)
-
-    
-    # Extract filename without extension
-    filename_prefix = os.path.splitext(os.path.basename(file_path))[0]
+    total_table = pd.concat([grouped_not_zero, grouped_zero], ignore_index=True)
     
     # Save line graph and table CSV in the 'result' folder
-    generate_and_save_final_graph(df, exclude_option)
+    generate_and_save_final_graph(df, exclude_option, result_folder, (grouped_not_zero, grouped_zero), cluster_band)
     save_table_csv(total_table, filename_prefix, result_folder)
+    return manifest_entries(artifact_names, key, inputs, params, code)
 
-    
+
+def main(data_dir=DATA_DIR, result_folder=RESULT_DIR, binning='exact', cluster_band=False, processes=None, force=False):
+    if binning not in BINNING_OPTIONS:
+        raise ValueError(f"Invalid binning option selected: {binning}")
+
+    # Check if the 'result' folder exists, if not, create it
+    if not os.path.exists(result_folder):
+        os.makedirs(result_folder)
+
+    # Every file is read, grouped and plotted in its own worker process (processes=1: one after another).
+    # The manifest is only written here, with the entries the workers return.
+    manifest = load_manifest(result_folder)
+    shared = dict(data_dir=data_dir, result_folder=result_folder, binning=binning, cluster_band=cluster_band,
+                  manifest=manifest, force=force)
+    for entries in run_variants(visualize_file, FILE_NAMES, shared, processes):
+        manifest.update(entries)
+    save_manifest(result_folder, manifest)
 
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from joboffer.cache import load_frame, save_frame
+from joboffer.instrument import filter_rows, stage
+from joboffer.panel import Panel
+from joboffer.schema import read_table, write_table
+from NJUI.preprocessing_data import (ACCEPTANCE_OPTIONS, DATA_DIR, OUTPUT_FILE_NAMES, RESERVATION_HISTORY_COLUMNS,
+                                     concat_chunks, count_accepted_offers, exclude_dual_job, filter_data,
+                                     filter_valid_offers, generate_hourly_wage_columns,
+                                     generate_previous_reservation_wage, load_weekly_releases, transform_acceptance,
+                                     weekly_release_paths)
+
+STATE_FOLDER_NAME = '.weekly_state'  # Kept next to the preprocessed tables it describes
+SORT_COLUMNS = ['caseid', 'curyear', 'curweek']
+
+
+def load_lag_state(state_folder):
+    # Last processed week of each case: (caseid, curyear, curweek, reservation_wage, reservation_unit)
+    # and the number of accepted offers counted by exclude_dual_job so far
+    if not os.path.exists(os.path.join(state_folder, 'meta.json')):
+        return pd.DataFrame({'caseid': pd.Series(dtype=np.int32), 'curyear': pd.Series(dtype=np.int32),
+                             'curweek': pd.Series(dtype=np.int32), 'reservation_wage': pd.Series(dtype=float),
+                             'reservation_unit': pd.Series(dtype='category'), 'yes_count': pd.Series(dtype=np.int32)})
+    return load_frame(state_folder)
+
+
+def save_lag_state(lag_state, state_folder):
+    # Write the new state next to the old one and swap it in
+    temp_folder = tempfile.mkdtemp(dir=os.path.dirname(state_folder), prefix=STATE_FOLDER_NAME, suffix='.tmp')
+    save_frame(lag_state.reset_index(drop=True), temp_folder)
+    shutil.rmtree(state_folder, ignore_errors=True)
+    os.replace(temp_folder, state_folder)
+
+
+@stage
+def select_new_weeks(reservation_history, lag_state):
+    # Rows later than the last processed week of their case (every row of a new case)
+    last_week = reservation_history[['caseid']].merge(lag_state[SORT_COLUMNS], on='caseid', how='left')
+    is_new = (last_week['curyear'].isnull().to_numpy()
+              | (reservation_history['curyear'].to_numpy() > last_week['curyear'].to_numpy())
+              | ((reservation_history['curyear'].to_numpy() == last_week['curyear'].to_numpy())
+                 & (reservation_history['curweek'].to_numpy() > last_week['curweek'].to_numpy())))
+    return filter_rows(reservation_history, 'select_new_weeks', {'newer than the last processed week': is_new})
+
+
+def update_lag_state(lag_state, new_history, new_yes_counts):
+    # Replace the last week of every case seen in the new rows and add up their accepted offers
+    panel = Panel(new_history['caseid'], new_history['curyear'], new_history['curweek'])
+    last_rows = panel.sort(new_history).iloc[panel.offsets[1:] - 1]
+    updated = concat_chunks([lag_state.drop(columns='yes_count'), last_rows[RESERVATION_HISTORY_COLUMNS]])
+    updated = updated.drop_duplicates(subset='caseid', keep='last').sort_values(by='caseid')
+    yes_count = lag_state.set_index('caseid')['yes_count'].add(new_yes_counts, fill_value=0)
+    updated['yes_count'] = yes_count.reindex(updated['caseid']).fillna(0).astype(np.int32).to_numpy()
+    return updated
+
+
+def update_preprocessed_tables(data_dir=DATA_DIR, use_cache=True):
+    # Process only the weeks that arrived since the last run and merge them into the preprocessed tables.
+    # The stored state holds each case's last week, so the previous reservation wage of the first new week
+    # (or the case's own wage for a new case) and the dual acceptance exclusion match a full recompute.
+    state_folder = os.path.join(data_dir, STATE_FOLDER_NAME)
+    lag_state = load_lag_state(state_folder)
+    df_weekly, reservation_history = load_weekly_releases(weekly_release_paths(data_dir), use_cache)
+
+    new_history = select_new_weeks(reservation_history, lag_state)
+    new_offers = df_weekly[df_weekly.index.isin(new_history.index)]
+
+    # The stored last weeks go first in the history (with labels that are not file rows) so the first new
+    # week of a known case takes its previous reservation wage from them
+    state_rows = lag_state[RESERVATION_HISTORY_COLUMNS].set_axis(-1 - np.arange(len(lag_state)))
+    history = concat_chunks([state_rows, new_history])
+    df_weekly_sum = generate_previous_reservation_wage(new_offers, reservation_history=history)
+    df_hourly_wage = generate_hourly_wage_columns(filter_data(df_weekly_sum))
+
+    previous_yes_counts = lag_state.set_index('caseid')['yes_count']
+    exclude_df = exclude_dual_job(df_hourly_wage, previous_yes_counts)
+    new_yes_counts = count_accepted_offers(filter_valid_offers(df_hourly_wage))
+    yes_counts = new_yes_counts.add(previous_yes_counts, fill_value=0)
+    caseids_with_multiple_yes = yes_counts[yes_counts >= 2].index
+
+    for option in ACCEPTANCE_OPTIONS:
+        tables = [transform_acceptance(exclude_df, option)] if len(exclude_df) else []
+        output_file_path = os.path.join(data_dir, OUTPUT_FILE_NAMES[option])
+        if len(lag_state) and os.path.exists(output_file_path):
+            # Cases that now have two accepted offers lose their earlier rows as well
+            table = read_table(output_file_path, 'njui_offers', float_precision='round_trip')
+            tables.insert(0, table[~table['caseid'].isin(caseids_with_multiple_yes)])
+        if tables:
+            new_table = pd.concat(tables, ignore_index=True).sort_values(by=SORT_COLUMNS, kind='stable')
+            write_table(new_table, output_file_path, 'njui_offers')
+
+    save_lag_state(update_lag_state(lag_state, new_history, new_yes_counts), state_folder)
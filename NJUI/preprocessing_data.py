@@ -1,32 +1,121 @@
+import glob
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
 import pandas as pd
 import numpy as np
 
-def load_data(entry_file_path, weekly_file_path):
-    df_entry = pd.read_stata(entry_file_path)
-    df_weekly_rd = pd.read_stata(weekly_file_path)
-    df_weekly = df_weekly_rd.loc[:,['caseid',
-                     'curweek',
-                     'curyear',
-                     'startday',
-                     'starttime',
-                     'stopday',
-                     'stoptime',
-                     'extended_study',
-                     'q7e',
-                     'q7a1',
-                     'q7a2',
-                     'q12_1_a',
-                     'q12_1_b',
-                     'q13_1_a',
-                     'q13_1_b1',
-                     'q13_1_c',
-                     'q14_1',
-                     'q15_1',
-                     'q13_2_a',
-                     'q13_2_b1','q13_2_c']]
-    return df_entry, df_weekly
+from joboffer.cache import read_cached
+from joboffer.instrument import filter_rows, stage
+from joboffer.panel import Panel
+from joboffer.schema import enforce, write_table
+from joboffer.stages import StageGraph
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+ENTRY_FILE_NAME = 'entry.dta'
+WEEKLY_FILE_NAME = 'weekly20150129.dta'
+WEEKLY_FILE_PATTERN = 'weekly*.dta'  # Weekly releases, named weeklyYYYYMMDD.dta after their release date
+# A week (caseid, curyear, curweek) answered in several releases is taken from the newest one
+WEEK_KEY_COLUMNS = ['caseid', 'curyear', 'curweek']
+
+# Weekly survey columns used by the pipeline; no other column is read from the file
+WEEKLY_COLUMNS = ['caseid', 'curweek', 'curyear', 'startday', 'starttime', 'stopday', 'stoptime', 'extended_study',
+                  'q7e', 'q7a1', 'q7a2', 'q12_1_a', 'q12_1_b', 'q13_1_a', 'q13_1_b1', 'q13_1_c', 'q14_1', 'q15_1',
+                  'q13_2_a', 'q13_2_b1', 'q13_2_c']
+# Columns of every weekly row (with or without a job offer) needed for the previous week's reservation wage
+RESERVATION_HISTORY_COLUMNS = ['caseid', 'curyear', 'curweek', 'reservation_wage', 'reservation_unit']
+WEEKLY_CHUNK_SIZE = 100000  # Rows read from the weekly file at a time
+
+# Acceptance options and the final table each one is saved to
+ACCEPTANCE_OPTIONS = ['exclude_dontknow', 'include_dontknow']
+OUTPUT_FILE_NAMES = {
+    'exclude_dontknow': 'preprocessed_exclude_dk.csv',
+    'include_dontknow': 'preprocessed_include_dk.csv',
+}
+
+def read_weekly_data(weekly_file_path, columns=WEEKLY_COLUMNS, chunksize=WEEKLY_CHUNK_SIZE):
+    # Stream the weekly file in chunks of the selected columns. Each chunk is renamed and only rows with a
+    # job offer wage are kept, plus the reservation wage history of every row for the weekly lags.
+    # Row labels are the row numbers in the file, which link the offers to their history rows.
+    offer_chunks = []
+    history_chunks = []
+    with warnings.catch_warnings():
+        # Value labels are reconciled across chunks in concat_chunks
+        warnings.simplefilter('ignore', pd.errors.CategoricalConversionWarning)
+        with pd.read_stata(weekly_file_path, columns=columns, chunksize=chunksize) as reader:
+            for chunk in reader:
+                chunk = rename_columns(chunk)
+                history_chunks.append(chunk[RESERVATION_HISTORY_COLUMNS])
+                offer_chunks.append(filter_data(chunk))
+    return {'offers': enforce(concat_chunks(offer_chunks), 'njui_weekly'),
+            'reservation_history': enforce(concat_chunks(history_chunks), 'njui_weekly')}
+
+
+def concat_chunks(chunks):
+    # Chunks of a partly labeled Stata column get different categories; union them into one categorical
+    df = pd.concat(chunks)
+    for column in df.columns:
+        if all(isinstance(chunk[column].dtype, pd.CategoricalDtype) for chunk in chunks):
+            # Categories of numbers and labels can have different dtypes per chunk; compare them as objects
+            parts = [chunk[column].cat.set_categories(chunk[column].cat.categories.astype(object)) for chunk in chunks]
+            df[column] = pd.api.types.union_categoricals(parts, ignore_order=True)
+    return df
+
+
+def load_weekly_data(weekly_file_path, use_cache=True):
+    # Weekly offers and reservation history are streamed once, then loaded from the binary cache
+    if use_cache:
+        weekly = read_cached(read_weekly_data, weekly_file_path, columns=WEEKLY_COLUMNS)
+    else:
+        weekly = read_weekly_data(weekly_file_path)
+    return weekly['offers'], weekly['reservation_history']
+
+
+def weekly_release_paths(data_dir):
+    # Weekly releases in data_dir, oldest first; the default release if there is none (reading it reports it missing)
+    paths = sorted(glob.glob(os.path.join(data_dir, WEEKLY_FILE_PATTERN)))
+    return paths or [os.path.join(data_dir, WEEKLY_FILE_NAME)]
+
+
+@stage
+def load_weekly_releases(weekly_file_paths, use_cache=True, processes=None):
+    # Read several weekly releases at once (one process per release, up to the number of cores) and union them into
+    # one panel of offers and reservation history. Releases must be given oldest first: every week answered in a newer
+    # release replaces all the rows of that week in the older ones, so conflicting values come from the newest release.
+    # Rows within one release are kept as they are.
+    weekly_file_paths = list(weekly_file_paths)
+    if len(weekly_file_paths) == 1:
+        return load_weekly_data(weekly_file_paths[0], use_cache)
+
+    if processes is None:
+        processes = min(len(weekly_file_paths), os.cpu_count() or 1)
+    read_release = partial(load_weekly_data, use_cache=use_cache)
+    if processes > 1:
+        with ProcessPoolExecutor(processes) as pool:
+            releases = list(pool.map(read_release, weekly_file_paths))
+    else:
+        releases = [read_release(path) for path in weekly_file_paths]
 
+    # Row labels are shifted past the previous releases, so they stay unique and still link offers to history rows
+    offer_frames, history_frames, release_numbers = [], [], []
+    offset = 0
+    for release_number, (offers, history) in enumerate(releases):
+        offer_frames.append(offers.set_axis(offers.index + offset))
+        history_frames.append(history.set_axis(history.index + offset))
+        release_numbers.append(np.full(len(history), release_number))
+        offset += int(history.index.max()) + 1 if len(history) else 0
+    offers, history = concat_chunks(offer_frames), concat_chunks(history_frames)
 
+    release_numbers = pd.Series(np.concatenate(release_numbers), index=history.index)
+    newest_release = release_numbers.groupby([history[column] for column in WEEK_KEY_COLUMNS]).transform('max')
+    history = filter_rows(history, 'load_weekly_releases', {'week not in a newer release': release_numbers == newest_release})
+    offers = filter_rows(offers, 'load_weekly_releases', {'week not in a newer release': offers.index.isin(history.index)})
+    return enforce(offers, 'njui_weekly'), enforce(history, 'njui_weekly')
+
+
+@stage
 def rename_columns(df):
     new_column_names = {
         'caseid':'caseid' ,
@@ -55,74 +144,102 @@ def rename_columns(df):
     return df
 
 # Filter data with valid job offer wage only
+@stage
 def filter_data(df):
-    df_filtered = df[(df['job_offer_wage'].notnull())]
+    df_filtered = filter_rows(df, 'filter_data', {'job_offer_wage not null': df['job_offer_wage'].notnull()})
     return df_filtered
 
 
-def generate_previous_reservation_wage(df):
-    # Sort the DataFrame by 'caseid', 'curyear', and 'curweek'
-    df.sort_values(by=['caseid', 'curyear', 'curweek'], inplace=True)
+@stage
+def generate_previous_reservation_wage(df, reservation_history=None):
+    if reservation_history is not None:
+        # df holds only some of the weekly rows: compute the lags over every row's history and keep df's rows,
+        # in the same order as computing them over the full weekly table
+        history = generate_previous_reservation_wage(reservation_history)
+        rows = history.index[history.index.isin(df.index)]
+        return df.loc[rows].assign(prev_reservation_wage=history.loc[rows, 'prev_reservation_wage'],
+                                   prev_reservation_unit=history.loc[rows, 'prev_reservation_unit'])
 
-    # Get previous week's reservation_wage and reservation_unit for each caseid
-    df['prev_reservation_wage'] = df.groupby('caseid')['reservation_wage'].shift()
-    df['prev_reservation_unit'] = df.groupby('caseid')['reservation_unit'].shift()
+    # Sort the DataFrame by 'caseid', 'curyear', and 'curweek' once (into a new frame, the input is shared)
+    panel = Panel(df['caseid'], df['curyear'], df['curweek'])
+    df = panel.sort(df)
 
+    # Get previous week's reservation_wage and reservation_unit for each caseid.
     # For the first row of each caseid, use its own reservation_wage
-    first_rows_mask1 = df['prev_reservation_wage'].isnull()
-    first_rows_mask2 = df['prev_reservation_unit'].isnull()
-    df.loc[first_rows_mask1, 'prev_reservation_wage'] = df.loc[first_rows_mask1, 'reservation_wage']
-    df.loc[first_rows_mask2, 'prev_reservation_unit'] = df.loc[first_rows_mask2, 'reservation_unit']
+    df = df.assign(prev_reservation_wage=panel.lag(df['reservation_wage']).fillna(df['reservation_wage']),
+                   prev_reservation_unit=panel.lag(df['reservation_unit']).fillna(df['reservation_unit']))
 
-    df_weekly_sum = df[(df['prev_reservation_wage'].notnull())]
+    df_weekly_sum = filter_rows(df, 'generate_previous_reservation_wage', {
+        'prev_reservation_wage not null': df['prev_reservation_wage'].notnull()
+    })
     
     return df_weekly_sum
 
 
+# Canonical codes of the messy unit labels and numeric codes used by the reservation, offer and accepted wages
+WAGE_UNITS = ['hour', 'week', 'two_weeks', 'month', 'year']
+WAGE_UNIT_CODES = {
+    4: 'hour', 'Hour': 'hour', 'hour': 'hour',
+    3: 'week', 'Week': 'week', 'week': 'week', ' Week': 'week',
+    'every two weeks': 'two_weeks', 'Every two week': 'two_weeks',
+    2: 'month', 'Month': 'month', 'month': 'month',
+    1: 'year', 'Year': 'year', 'year': 'year',
+}
+
+# Weeks paid by one wage of each unit (hourly wages are used as they are)
+WEEKS_PER_WAGE_UNIT = {'hour': None, 'week': 1, 'two_weeks': 2, 'month': 4, 'year': 52}
+DEFAULT_WEEKLY_HOURS = 40  # Used when weekly working hours are null or zero
+
+# (hours column, wage column, unit column, output column) of each hourly wage
+HOURLY_WAGE_COLUMNS = [
+    ('how_many_hours_prefer_to_work_weekly', 'prev_reservation_wage', 'prev_reservation_unit', 'previous_wage_hourly'),
+    ('weekly_working_hour', 'job_offer_wage', 'job_offer_unit', 'job_offer_wage_hourly'),
+    ('accepted_weekly_working_hour', 'accepted_job_wage', 'accepted_job_unit', 'accepted_job_wage_hourly'),
+]
+
+
+def normalize_wage_unit(units):
+    # Map every distinct label once and return a canonical unit code per row (-1 if not recognized)
+    codes, uniques = pd.factorize(pd.Series(units))
+    unique_codes = [WAGE_UNITS.index(WAGE_UNIT_CODES[unit]) if unit in WAGE_UNIT_CODES else -1 for unit in uniques]
+    return np.array(unique_codes + [-1], dtype=np.int8)[codes]
+
+
+def hourly_wage(hours_worked_weekly, wage, unit_codes, weeks_per_wage_unit=WEEKS_PER_WAGE_UNIT,
+                default_weekly_hours=DEFAULT_WEEKLY_HOURS):
+    # The default hours and the weeks of a unit can also be arrays of alternatives (e.g. a grid of assumptions);
+    # the result then gets a leading axis with one set of hourly wages per alternative.
+    grid_shape = np.broadcast_shapes(np.shape(default_weekly_hours),
+                                     *[np.shape(weeks) for weeks in weeks_per_wage_unit.values() if weeks is not None])
+
+    # Set hours_worked_weekly as the default if it's null or zero
+    hours_worked_weekly = np.asarray(hours_worked_weekly, dtype=float)
+    default_weekly_hours = np.reshape(default_weekly_hours, np.shape(default_weekly_hours) + (1,) * hours_worked_weekly.ndim)
+    hours_worked_weekly = np.where(np.isnan(hours_worked_weekly) | (hours_worked_weekly == 0),
+                                   default_weekly_hours, hours_worked_weekly)
+
+    # Weeks multiplier per unit code; the extra last entry makes unknown units (-1) null
+    is_hourly = np.array([weeks_per_wage_unit[unit] is None for unit in WAGE_UNITS] + [False])
+    weeks = np.stack([np.broadcast_to(np.nan if hourly else weeks_per_wage_unit[unit], grid_shape).astype(float)
+                      for unit, hourly in zip(WAGE_UNITS, is_hourly)] + [np.full(grid_shape, np.nan)], axis=-1)
+
+    wage = np.asarray(wage, dtype=float)
+    return np.where(is_hourly[unit_codes], wage, wage / (hours_worked_weekly * weeks[..., unit_codes]))
+
+
+@stage
 def calculate_hourly_wage(df, hours_column, wage_column, unit_column, output_column):
-    def calculate(row):
-        hours_worked_weekly = row[hours_column]
-        reservation_wage = row[wage_column]
-        reservation_unit = row[unit_column]
-        
-        if pd.isnull(hours_worked_weekly):
-            # Set hours_worked_weekly as 40 if it's null
-            hours_worked_weekly = 40
-        
-        
-        if hours_worked_weekly == 0:
-            # Set hours_worked_weekly as 40 if it's zero 
-            hours_worked_weekly = 40 
-        
-        if reservation_unit == 4 or reservation_unit == 'Hour' or reservation_unit == 'hour':  # Hourly or 'hour'
-            hourly_wage = reservation_wage
-            
-        if reservation_unit in [1, 'Year', 'year']:  # Yearly or 'year'
-            hourly_wage = reservation_wage / (hours_worked_weekly * 52)  # Assuming 52 weeks in a year
-        elif reservation_unit in [2, 'Month', 'month']:  # Monthly
-            hourly_wage = reservation_wage / (hours_worked_weekly * 4)  # Assuming 4 weeks in a month
-        elif reservation_unit in [3, 'Week', 'week', ' Week'] or reservation_unit in ['every two weeks', 'Every two week']:  # Weekly or 'every two weeks'
-            if reservation_unit in ['every two weeks', 'Every two week']:
-                hours_worked_weekly *= 2  # Doubling the hours for 'every two weeks' scenario
-            hourly_wage = reservation_wage / hours_worked_weekly
-        elif reservation_unit == 4 or reservation_unit == 'Hour' or reservation_unit == 'hour':  # Hourly or 'hour'
-            hourly_wage = reservation_wage
-        else:
-            # Handle unrecognized reservation_unit values
-            return None
-
-        return hourly_wage
-
-    df[output_column] = df.apply(calculate, axis=1)
-    return df
+    return df.assign(**{output_column: hourly_wage(df[hours_column], df[wage_column], normalize_wage_unit(df[unit_column]))})
 
 
+@stage
 def generate_hourly_wage_columns(df):
-    # Previous_wage_hourly using Reservation Wage 
-    df1= calculate_hourly_wage(df, 'how_many_hours_prefer_to_work_weekly', 'prev_reservation_wage', 'prev_reservation_unit', 'previous_wage_hourly')
-    df2 = calculate_hourly_wage(df1, 'weekly_working_hour', 'job_offer_wage', 'job_offer_unit', 'job_offer_wage_hourly')
-    df3 = calculate_hourly_wage(df2, 'accepted_weekly_working_hour', 'accepted_job_wage', 'accepted_job_unit', 'accepted_job_wage_hourly')
-    return df3
+    # Previous wage (reservation wage), job offer wage and accepted job wage computed together
+    hours_columns, wage_columns, unit_columns, output_columns = zip(*HOURLY_WAGE_COLUMNS)
+    unit_codes = np.column_stack([normalize_wage_unit(df[column]) for column in unit_columns])
+    hourly_wages = hourly_wage(df[list(hours_columns)].to_numpy(dtype=float),
+                               df[list(wage_columns)].to_numpy(dtype=float), unit_codes)
+    return df.assign(**{output_column: hourly_wages[:, i] for i, output_column in enumerate(output_columns)})
 
 # 사용 안함 
 # def data_filtering_option(df, option):
@@ -146,6 +263,7 @@ def generate_hourly_wage_columns(df):
 
 
 
+@stage
 def transform_acceptance(df, option):
     # Create an initial final_df DataFrame with basic columns
     basic_columns = ['caseid','curweek','curyear','received_job_offers', 'how_many_job_offers']
@@ -175,21 +293,40 @@ def transform_acceptance(df, option):
         print("Invalid option! Please provide 'option_1' or 'option_2'")
         
     
-    final_df = final_df[final_df['acceptance_yn'].notna()]
-    return final_df
+    final_df = filter_rows(final_df, 'transform_acceptance', {'acceptance_yn mapped': final_df['acceptance_yn'].notna()})
+    return enforce(final_df, 'njui_offers')
 
         
 # edit for last modified code 
-def exclude_dual_job(df_hourly_wage): 
-    filtered_df = df_hourly_wage[df_hourly_wage['previous_wage_hourly'].notnull() & df_hourly_wage['job_offer_wage_hourly'].notnull()& df_hourly_wage['acceptance_yn'].notnull()]
-    # Grouping by 'caseid' and counting occurrences of 'yes' in 'acceptance_yn'
-    yes_counts = filtered_df[filtered_df['acceptance_yn'] == 'Yes'].groupby('caseid')['acceptance_yn'].count()
-
-    # Filtering caseids with two or more 'yes' occurrences
-    caseids_with_multiple_yes = yes_counts[yes_counts >= 2].index.tolist()
-    exclude_df = filtered_df[~filtered_df['caseid'].isin(caseids_with_multiple_yes)]
+@stage
+def exclude_dual_job(df_hourly_wage, previous_yes_counts=None): 
+    filtered_df = filter_valid_offers(df_hourly_wage)
+    # Counting occurrences of 'yes' in 'acceptance_yn' over each caseid's rows (already grouped by the lag stage)
+    panel = Panel(filtered_df['caseid'])
+    yes_counts = panel.count(panel.sort((filtered_df['acceptance_yn'] == 'Yes').to_numpy()))
+    if previous_yes_counts is not None:
+        # Add the 'yes' occurrences of weeks processed in earlier runs
+        yes_counts = yes_counts + previous_yes_counts.reindex(panel.case_ids).fillna(0).to_numpy()
+
+    # Excluding caseids with two or more 'yes' occurrences
+    exclude_df = filter_rows(filtered_df, 'exclude_dual_job', {'fewer than 2 accepted offers': panel.unsort(panel.broadcast(yes_counts < 2))})
     return exclude_df 
 
+
+def filter_valid_offers(df_hourly_wage):
+    return filter_rows(df_hourly_wage, 'filter_valid_offers', {
+        'previous_wage_hourly not null': df_hourly_wage['previous_wage_hourly'].notnull(),
+        'job_offer_wage_hourly not null': df_hourly_wage['job_offer_wage_hourly'].notnull(),
+        'acceptance_yn not null': df_hourly_wage['acceptance_yn'].notnull(),
+    })
+
+
+def count_accepted_offers(filtered_df):
+    # Number of 'yes' occurrences of each caseid that has any
+    panel = Panel(filtered_df['caseid'])
+    yes_counts = pd.Series(panel.count(panel.sort((filtered_df['acceptance_yn'] == 'Yes').to_numpy())), index=panel.case_ids)
+    return yes_counts[yes_counts > 0]
+
 # 사용 안함
 # def generate_final_four_tables(df_hourly_wage): 
 #     options = [('entire_data', 'exclude_dontknow'), ('entire_data', 'include_dontknow'), ('until_first_accept', 'exclude_dontknow'), ('until_first_accept', 'include_dontknow')]
@@ -206,25 +343,33 @@ def exclude_dual_job(df_hourly_wage):
 #         df.to_csv(f'data/{file_name}', index=False)
 #         print(f'Final table {i} saved as {file_name}')
 
+# final_dfs = generate_final_four_tables(df_hourly_wage)
+# save_dataframes_as_csv(final_dfs)
+
 
 # Preprocessing the data with functions above. 
-entry_file_path = 'data/entry.dta'
-weekly_file_path = 'data/weekly20150129.dta'
-df_entry, df_weekly = load_data(entry_file_path, weekly_file_path)
-df_weekly = rename_columns(df_weekly)
-df_weekly_sum = generate_previous_reservation_wage(df_weekly)
-df_weekly_filtered = filter_data(df_weekly_sum)
-df_hourly_wage = generate_hourly_wage_columns(df_weekly_filtered)
-exclude_df = exclude_dual_job(df_hourly_wage)
+def main(data_dir=DATA_DIR, use_cache=True, incremental=False, entry_columns=()):
+    if incremental:
+        # Only weeks newer than the stored per-case state are processed and appended
+        from NJUI.incremental import update_preprocessed_tables
+        return update_preprocessed_tables(data_dir, use_cache)
 
+    # Every weekly release of the data folder, read concurrently and merged into one panel
+    df_weekly, reservation_history = load_weekly_releases(weekly_release_paths(data_dir), use_cache)
 
-# Generate final preprocessed tables 
-exclude_dk = transform_acceptance(exclude_df, 'exclude_dontknow')
-include_dk = transform_acceptance(exclude_df, 'include_dontknow')
+    # Generate and save the final preprocessed tables; the weekly stages run once and are shared by both options
+    weekly_stages = [partial(generate_previous_reservation_wage, reservation_history=reservation_history),
+                     filter_data, generate_hourly_wage_columns, exclude_dual_job]
+    stage_graph = StageGraph(df_weekly)
+    if entry_columns:
+        # Entry survey covariates of each offer's case, looked up by case id; only these columns are read
+        from NJUI.covariates import EntryCovariates, attach_entry_covariates
+        covariates = EntryCovariates(os.path.join(data_dir, ENTRY_FILE_NAME), use_cache)
+    for (option,), final_df in stage_graph.fan_out(weekly_stages + [(transform_acceptance, ACCEPTANCE_OPTIONS)]):
+        if entry_columns:
+            final_df = attach_entry_covariates(final_df, covariates, entry_columns)
+        write_table(final_df, os.path.join(data_dir, OUTPUT_FILE_NAMES[option]), 'njui_offers')
 
-# Save the final tables 
-include_dk.to_csv('data/preprocessed_include_dk.csv', index=False)
-exclude_dk.to_csv('data/preprocessed_exclude_dk.csv', index=False)
 
-# final_dfs = generate_final_four_tables(df_hourly_wage)
-# save_dataframes_as_csv(final_dfs)
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+import os
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from joboffer.sensitivity import SENSITIVITY_FILE_NAME, assumption_grid, sweep_acceptance
+from joboffer.stages import StageGraph
+from NJUI.data_visualization import FILE_NAMES, QUANTILE_BINS, RESULT_DIR
+from NJUI.preprocessing_data import (ACCEPTANCE_OPTIONS, DATA_DIR, HOURLY_WAGE_COLUMNS, OUTPUT_FILE_NAMES,
+                                     WEEKS_PER_WAGE_UNIT, exclude_dual_job, filter_data, generate_hourly_wage_columns,
+                                     generate_previous_reservation_wage, hourly_wage, load_weekly_releases,
+                                     normalize_wage_unit, transform_acceptance, weekly_release_paths)
+
+# Values of each assumption tried by the sweep; 40 hours, 4 weeks and 52 weeks are the ones of the preprocessing
+ASSUMPTION_GRID = {
+    'default_weekly_hours': [30, 35, 40, 45, 50],
+    'weeks_per_month': [4, 4.33],
+    'weeks_per_year': [50, 52],
+}
+
+
+def hourly_wage_grid(df, points):
+    # Previous (reservation) and offered hourly wages of every row under every grid point: (grid points, rows, 2)
+    weeks_per_wage_unit = dict(WEEKS_PER_WAGE_UNIT, month=points['weeks_per_month'].to_numpy(dtype=float),
+                               year=points['weeks_per_year'].to_numpy(dtype=float))
+    hours_columns, wage_columns, unit_columns, _ = zip(*HOURLY_WAGE_COLUMNS[:2])
+    unit_codes = np.column_stack([normalize_wage_unit(df[column]) for column in unit_columns])
+    return hourly_wage(df[list(hours_columns)].to_numpy(dtype=float), df[list(wage_columns)].to_numpy(dtype=float),
+                       unit_codes, weeks_per_wage_unit, points['default_weekly_hours'].to_numpy(dtype=float))
+
+
+def sweep(df_weekly, reservation_history, grid=ASSUMPTION_GRID):
+    # Binned acceptance of both acceptance options under every grid point. Which offers are kept does not depend on
+    # the assumptions (a wage is missing under all of them or under none), so the weekly stages run once and only the
+    # hourly wages of the kept offers are recomputed, for the whole grid at once.
+    points = assumption_grid(grid)
+    weekly_stages = [partial(generate_previous_reservation_wage, reservation_history=reservation_history),
+                     filter_data, generate_hourly_wage_columns, exclude_dual_job]
+    exclude_df = StageGraph(df_weekly).run(weekly_stages)
+
+    tables = []
+    for option in ACCEPTANCE_OPTIONS:
+        final_df = transform_acceptance(exclude_df, option)
+        hourly_wages = hourly_wage_grid(exclude_df.loc[final_df.index], points)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            wage_difference = np.log(hourly_wages[:, :, 1] / hourly_wages[:, :, 0])
+        # The hand-picked quantile bins of the option, so every grid point is binned the same way
+        edges = QUANTILE_BINS[FILE_NAMES[OUTPUT_FILE_NAMES[option]]]
+        tables.append(sweep_acceptance(points, option, wage_difference, final_df['acceptance_yn'].to_numpy(),
+                                       edges, include_lowest=True, zero_bin=True))
+    return tables
+
+
+def main(data_dir=DATA_DIR, result_folder=RESULT_DIR, use_cache=True):
+    if not os.path.exists(result_folder):
+        os.makedirs(result_folder)
+
+    df_weekly, reservation_history = load_weekly_releases(weekly_release_paths(data_dir), use_cache)
+    results = pd.concat(sweep(df_weekly, reservation_history), ignore_index=True)
+    output_filename = os.path.join(result_folder, SENSITIVITY_FILE_NAME)
+    results.to_csv(output_filename, index=False)
+    print(f"Saved {len(results)} rows of the assumption sweep to '{output_filename}'")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,46 @@
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 import os
 
+from joboffer.artifacts import (artifact_key, input_fingerprints, load_manifest, manifest_entries, save_manifest,
+                                up_to_date)
+from joboffer.binning import binned_acceptance
+from joboffer.bootstrap import BOOTSTRAP_REPLICATES, bootstrap_acceptance_bands
+from joboffer.cache import code_version
+from joboffer.cube import MARGIN, STRATA_COLUMNS, AcceptanceCube
+from joboffer.instrument import filter_rows, stage
+from joboffer.runner import run_variants
+from joboffer.schema import read_table
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+RESULT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'result')
+
+# Preprocessed tables of every prev_wage/offered_wage option combination
+FILE_NAMES = [
+    'preprocessed_job2_wage_per_hr_only.csv', 
+    'preprocessed_job2_wage_convert_to_hr.csv',
+    'preprocessed_prev_cps_wage_per_hr_only.csv',
+    'preprocessed_prev_cps_wage_convert_to_hr.csv'
+]
+INTERVAL_SIZE = 0.25
+INTERVAL_SIZE_SWEEP = [0.05, 0.1, 0.2, 0.25, 0.4, 0.5]  # Interval sizes of the interval sweep table of every file
+OUTLIER_RULE = '1.5 IQR'  # Rule of process_outliers, recorded with the results
+OUTLIER_SCOPE = 'pooled'  # Outlier bounds of the whole table ('pooled') or of each race and sex ('stratum')
+# Modules whose code makes the graphs and grouped tables; a change to any of them makes them again
+CODE_MODULES = [__name__, 'joboffer.binning', 'joboffer.bootstrap', 'joboffer.cube', 'joboffer.schema']
 
-def process_outliers(file_path):
+
+def read_offers(file_path):
     # Read the CSV file into a pandas DataFrame
-    df = pd.read_csv(file_path)
-    
+    df = read_table(file_path, 'nlsy79_offers')
+
     # Create wage_difference column 
     df['wage_difference'] = np.log(df['offered_wage'] / df['previous_wage'])
+    return df
+
+@stage
+def process_outliers(file_path):
+    df = read_offers(file_path)
 
     # Calculate the IQR (Interquartile Range)
     Q1 = df['wage_difference'].quantile(0.25)
@@ -21,33 +52,67 @@ def process_outliers(file_path):
     upper_bound = Q3 + 1.5 * IQR    
 
     # Exclude outliers from the DataFrame
-    filtered_df = df[(df['wage_difference'] >= lower_bound) & (df['wage_difference'] <= upper_bound)]
-
-    # Display the length of filtered DataFrame
-    print("Length of data excluding outliers:", len(filtered_df))  # Print the length of final_data
+    filtered_df = filter_rows(df, 'process_outliers', {
+        'wage_difference >= lower_bound': df['wage_difference'] >= lower_bound,
+        'wage_difference <= upper_bound': df['wage_difference'] <= upper_bound,
+    })
     
     return filtered_df
 
-def group_data(filtered_df, interval_size):
+def interval_bins(interval_size):
     num_intervals = round(2 / interval_size)
-    bins = [-1 + i * interval_size for i in range(num_intervals + 1)]
-
-    filtered_df['wage_diff_interval'] = pd.cut(filtered_df['wage_difference'], bins=bins, right=False)
-
-    grouped_data = filtered_df.groupby('wage_diff_interval')['acceptance_yn'].agg(
-        total_count='count', accept_count=lambda x: (x == 'y').sum()
-    ).reset_index()
-    grouped_data['acceptance_ratio_per_interval'] = grouped_data['accept_count'] / grouped_data['total_count']
-
+    return [-1 + i * interval_size for i in range(num_intervals + 1)]
+
+@stage
+def group_data_sweep(filtered_df, interval_sizes=INTERVAL_SIZE_SWEEP):
+    # Grouped data of every interval size as one long table, all sizes counted in one pass over the rows
+    tables, _ = binned_acceptance(
+        filtered_df['wage_difference'], filtered_df['acceptance_yn'].to_numpy(),
+        {size: interval_bins(size) for size in interval_sizes}, right=False
+    )
+    sweep = pd.concat([table.assign(interval_size=size) for size, table in tables.items()], ignore_index=True)
+    sweep['bin'] = sweep['bin'].astype(str)
+    sweep = sweep.rename(columns={'bin': 'wage_diff_interval', 'mean_value': 'mean_wage_difference',
+                                  'acceptance_ratio': 'acceptance_ratio_per_interval'})
+    return sweep[['interval_size', 'wage_diff_interval', 'total_count', 'accept_count', 'mean_wage_difference',
+                  'acceptance_ratio_per_interval']]
+
+@stage
+def build_cube(data_dir, file_names, interval_size, outlier_scope=OUTLIER_SCOPE):
+    # Binned acceptance of every file, race, sex and interval (with the totals over race and sex) in one cube
+    variants = {os.path.splitext(file_name)[0]: (read_offers(os.path.join(data_dir, file_name)), 'case_id')
+                for file_name in file_names}
+    return AcceptanceCube(variants, interval_bins(interval_size), STRATA_COLUMNS, right=False, outlier_scope=outlier_scope)
+
+def cube_grouped_data(cube, variant, bootstrap_replicates=BOOTSTRAP_REPLICATES, **stratum):
+    # Grouped table of one file and stratum (the whole file by default), read from the cube: counts and acceptance
+    # ratio of every interval, with their bootstrap bands
+    grouped_data = cube.slice(variant, **stratum).rename(columns={'bin': 'wage_diff_interval', 'acceptance_ratio': 'acceptance_ratio_per_interval'})
+    grouped_data = grouped_data[['wage_diff_interval', 'total_count', 'accept_count', 'acceptance_ratio_per_interval']]
+
+    # Bootstrap band of each interval's acceptance ratio, resampling respondents of the stratum
+    if bootstrap_replicates:
+        rows = cube.stratum_rows(variant, **stratum)
+        lower, upper = bootstrap_acceptance_bands(
+            rows['case_id'], rows['bin'], rows['acceptance_yn'], len(grouped_data), replicates=bootstrap_replicates
+        )
+        grouped_data = grouped_data.assign(acceptance_ratio_lower=lower, acceptance_ratio_upper=upper)
     return grouped_data
 
+@stage
 def save_line_graph(grouped_data, filename_prefix, result_folder):
+    import matplotlib.pyplot as plt  # Imported here so the data functions load without matplotlib
+
     plt.figure(figsize=(12, 8))  # Larger figure size
 
     # Plotting the line graph with larger dimensions
     x_values = grouped_data['wage_diff_interval'].astype(str)
     y_values = grouped_data['acceptance_ratio_per_interval'].values
     plt.plot(x_values, y_values, marker='o', linestyle='-', color='skyblue', markersize=8)
+    if 'acceptance_ratio_lower' in grouped_data:
+        plt.fill_between(x_values, grouped_data['acceptance_ratio_lower'], grouped_data['acceptance_ratio_upper'],
+                         color='skyblue', alpha=0.3, label='95% bootstrap band')
+        plt.legend()
     plt.xlabel('Wage Difference Intervals')
     plt.ylabel('Acceptance Ratio')
     plt.title(f'Acceptance Ratio within Wage Difference Intervals\nFile: {filename_prefix}')
@@ -60,6 +125,42 @@ def save_line_graph(grouped_data, filename_prefix, result_folder):
     plt.close()  # Close the plot to avoid display in the notebook
     print(f"Saved line graph for {filename_prefix}")
     
+@stage
+def save_strata_graph(cube, filename_prefix, result_folder):
+    import matplotlib.pyplot as plt
+
+    # One panel per stratum column: a line for each of its values, summed over the other columns
+    fig, axes = plt.subplots(1, len(cube.strata_columns), figsize=(12 * len(cube.strata_columns), 8), squeeze=False)
+    for ax, column in zip(axes[0], cube.strata_columns):
+        for value in cube.values[column] + [MARGIN]:
+            grouped_data = cube.slice(filename_prefix, **{column: value})
+            ax.plot(grouped_data['bin'].astype(str), grouped_data['acceptance_ratio'], marker='o', linestyle='-',
+                    color='gray' if value == MARGIN else None, label=f'{column} = {value}')
+        ax.set_xlabel('Wage Difference Intervals')
+        ax.set_ylabel('Acceptance Ratio')
+        ax.set_title(f'Acceptance Ratio by {column}\nFile: {filename_prefix}')
+        ax.tick_params(axis='x', rotation=45)
+        ax.legend()
+    fig.tight_layout()
+
+    plot_filename = os.path.join(result_folder, f"{filename_prefix}_strata_graph.jpg")
+    fig.savefig(plot_filename, bbox_inches='tight', pad_inches=0.5)
+    plt.close(fig)
+    print(f"Saved strata graph for {filename_prefix}")
+
+def save_strata_csv(cube, filename_prefix, result_folder):
+    # Every race and sex of the file, the totals over each of them included (value 'all'), one row per interval
+    table = cube.table(filename_prefix)
+    table['bin'] = table['bin'].astype(str)
+    csv_filename = os.path.join(result_folder, f"{filename_prefix}_strata_grouped_data.csv")
+    table.rename(columns={'bin': 'wage_diff_interval'}).to_csv(csv_filename, index=False)
+    print(f"Saved strata grouped data as CSV file for {filename_prefix}")
+
+def save_sweep_csv(sweep, filename_prefix, result_folder):
+    csv_filename = os.path.join(result_folder, f"{filename_prefix}_interval_sweep.csv")
+    sweep.to_csv(csv_filename, index=False)
+    print(f"Saved interval size sweep as CSV file for {filename_prefix}")
+
 def interval_array_to_string(interval_array):
     # Convert IntervalArray to string representation
     interval_str = interval_array.astype(str)
@@ -74,32 +175,59 @@ def save_table_csv(grouped_data, filename_prefix, result_folder):
     grouped_data_str.to_csv(csv_filename, index=False)
     print(f"Saved grouped data as CSV file for {filename_prefix}")
 
-# List of file paths
-file_paths = [
-    'data/preprocessed_job2_wage_per_hr_only.csv', 
-    'data/preprocessed_job2_wage_convert_to_hr.csv',
-    'data/preprocessed_prev_cps_wage_per_hr_only.csv',
-    'data/preprocessed_prev_cps_wage_convert_to_hr.csv'
-]
+def artifact_names(filename_prefix):
+    return [f"{filename_prefix}_graph.jpg", f"{filename_prefix}_grouped_data.csv",
+            f"{filename_prefix}_strata_graph.jpg", f"{filename_prefix}_strata_grouped_data.csv",
+            f"{filename_prefix}_interval_sweep.csv"]
 
-# Folder name for saving results
-result_folder = 'result'
-
-# Check if the 'result' folder exists, if not, create it
-if not os.path.exists(result_folder):
-    os.makedirs(result_folder)
+def visualize_file(file_name, cube, result_folder, interval_sizes=INTERVAL_SIZE_SWEEP):
+    # Extract filename without extension
+    filename_prefix = os.path.splitext(file_name)[0]
 
-# Iterate through file paths
-for file_path in file_paths:
-    # Load the DataFrame and process outliers
-    df = process_outliers(file_path) 
-    interval_size = 0.25  # Set your interval size here
-    # Group the data
-    grouped_data = group_data(df, interval_size)
+    # The whole file's grouped data, then every race and sex, all read from the cube
+    grouped_data = cube_grouped_data(cube, filename_prefix)
 
-    # Extract filename without extension
-    filename_prefix = os.path.splitext(os.path.basename(file_path))[0]
-    
     # Save line graph and table CSV in the 'result' folder
     save_line_graph(grouped_data, filename_prefix, result_folder)
     save_table_csv(grouped_data, filename_prefix, result_folder)
+    save_strata_graph(cube, filename_prefix, result_folder)
+    save_strata_csv(cube, filename_prefix, result_folder)
+
+    # The whole file's acceptance under every interval size of the sweep, from the same outlier-filtered rows
+    save_sweep_csv(group_data_sweep(cube.stratum_rows(filename_prefix), interval_sizes), filename_prefix, result_folder)
+
+def main(data_dir=DATA_DIR, result_folder=RESULT_DIR, interval_size=INTERVAL_SIZE, outlier_scope=OUTLIER_SCOPE,
+         interval_sizes=INTERVAL_SIZE_SWEEP, processes=None, force=False):
+    # Check if the 'result' folder exists, if not, create it
+    if not os.path.exists(result_folder):
+        os.makedirs(result_folder)
+
+    # Skip the files whose inputs, parameters and code are the ones their results were made from
+    manifest = load_manifest(result_folder)
+    params = {'interval_size': interval_size, 'bootstrap_replicates': BOOTSTRAP_REPLICATES, 'outliers': OUTLIER_RULE,
+              'outlier_scope': outlier_scope, 'interval_sizes': interval_sizes}
+    code = code_version(CODE_MODULES)
+    file_names, entries = [], {}
+    for file_name in FILE_NAMES:
+        filename_prefix = os.path.splitext(file_name)[0]
+        inputs = input_fingerprints([os.path.join(data_dir, file_name)])
+        key = artifact_key(inputs, params, code)
+        if not force and up_to_date(manifest, result_folder, artifact_names(filename_prefix), key):
+            print(f"Results of {filename_prefix} are up to date")
+            continue
+        file_names.append(file_name)
+        entries.update(manifest_entries(artifact_names(filename_prefix), key, inputs, params, code))
+    if not file_names:
+        return
+
+    # The remaining files are counted into one cube here; every file is then plotted and saved from its slices
+    # in its own worker process (processes=1: one after another)
+    cube = build_cube(data_dir, file_names, interval_size, outlier_scope)
+    run_variants(visualize_file, file_names, dict(cube=cube, result_folder=result_folder, interval_sizes=interval_sizes),
+                 processes)
+    manifest.update(entries)
+    save_manifest(result_folder, manifest)
+
+
+if __name__ == '__main__':
+    main()
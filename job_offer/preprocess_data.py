@@ -1,133 +1,188 @@
+import os
+
 import numpy as np 
 import pandas as pd
 
-# Read the CSV file into a pandas DataFrame
-file_path = 'data/raw_data.csv'  # File path (change if needed)
-df = pd.read_csv(file_path)
-
-# New column names
-new_columns = [
-    'case_id', 'sample_id', 'sample_race', 'sample_sex', '1980_cps_wage',
-    '1981_cps_wage', '1982_cps_wage', 'working_when_offered', 'looking_for_job',
-    'any_job_offers_did_not_take', 'num_of_job_offers_did_not_take',
-    'best_wage_rejected', 'time_unit_of_rejected_wage', 'reason_for_rejection',
-    'month_began_working_1982_cps', 'year_began_working_1982_cps', 'is_job1_cps',
-    'hourly_wage_of_job1', 'hourly_wage_of_job2', 'employed_status'
-]
-
-# Change column names
-if len(df.columns) == len(new_columns):
-    df.columns = new_columns
-    print("Column names changed successfully!")
-else:
-    print("Number of new column names doesn't match the number of existing columns.")
-
-# Common filtering operations
-df_pro = df[(df["num_of_job_offers_did_not_take"] == 1) & (df["looking_for_job"] == 1) & (df["any_job_offers_did_not_take"] == 1)]
-df_processed = df_pro[(df_pro['1982_cps_wage'] > 0) & (df_pro['best_wage_rejected'] > 0) & (df_pro['is_job1_cps'] == 1)]
-
-
-def preprocess_data(data, prev_wage_option, offered_wage_option):
+from joboffer.cache import read_cached
+from joboffer.instrument import filter_rows, stage
+from joboffer.schema import enforce, write_table
+from joboffer.stages import StageGraph
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# NLSY79 reference number -> (column name, dtype), see the Codebook in README.md.
+# Add reference numbers here to read more survey years; other columns of the extract are not read.
+CODEBOOK = {
+    'R0000100': ('case_id', 'Int32'),
+    'R0173600': ('sample_id', 'Int8'),
+    'R0214700': ('sample_race', 'Int8'),
+    'R0214800': ('sample_sex', 'Int8'),
+    'R0263710': ('1980_cps_wage', 'Int32'),
+    'R0446810': ('1981_cps_wage', 'Int32'),
+    'R0702510': ('1982_cps_wage', 'Int32'),
+    'R0709400': ('working_when_offered', 'Int8'),
+    'R0709500': ('looking_for_job', 'Int8'),
+    'R0712100': ('any_job_offers_did_not_take', 'Int8'),
+    'R0712200': ('num_of_job_offers_did_not_take', 'Int16'),
+    'R0712300': ('best_wage_rejected', 'Int32'),
+    'R0712400': ('time_unit_of_rejected_wage', 'Int8'),
+    'R0712500': ('reason_for_rejection', 'Int16'),
+    'R0833200': ('month_began_working_1982_cps', 'Int8'),
+    'R0833400': ('year_began_working_1982_cps', 'Int8'),
+    'R0840100': ('is_job1_cps', 'Int8'),
+    'R0841010': ('hourly_wage_of_job1', 'Int32'),
+    'R0854110': ('hourly_wage_of_job2', 'Int32'),
+    'R0896711': ('employed_status', 'Int8'),
+}
+# NLSY reserved codes (-1 refusal, -2 don't know, -3 invalid skip, -4 valid skip, -5 non-interview) are read as missing
+NLSY_MISSING_CODES = [-1, -2, -3, -4, -5]
+RAW_CHUNK_SIZE = 100000  # Rows read from the raw CSV at a time
+
+PREV_WAGE_OPTIONS = ['job2_wage', 'prev_cps_wage']
+OFFERED_WAGE_OPTIONS = ['per_hr_only', 'convert_to_hr']
+
+
+@stage
+def read_raw_data(file_path, codebook=CODEBOOK, chunksize=RAW_CHUNK_SIZE):
+    # Read the CSV file in chunks with compact dtypes, renaming the codebook columns as they are parsed.
+    # Only respondents passing filter_respondents are kept from each chunk.
+    column_names = {reference: name for reference, (name, _) in codebook.items()}
+    dtypes = {reference: dtype for reference, (_, dtype) in codebook.items()}
+    chunks = []
+    with pd.read_csv(file_path, usecols=list(codebook), chunksize=chunksize) as reader:
+        for chunk in reader:
+            # Parsed as plain numbers first: parsing straight into the nullable dtypes is several times slower
+            chunk = chunk.mask(chunk.isin(NLSY_MISSING_CODES)).astype(dtypes)
+            chunk = chunk.rename(columns=column_names)[list(column_names.values())]
+            chunks.append(filter_respondents(chunk))
+    return pd.concat(chunks)
+
+
+def load_raw_data(file_path, use_cache=True):
+    # Filtered respondents are read once, then loaded from the binary cache
+    return read_cached(read_raw_data, file_path, codebook=CODEBOOK) if use_cache else read_raw_data(file_path)
+
+
+@stage
+def filter_respondents(df):
+    # Common filtering operations
+    df_processed = filter_rows(df, 'filter_respondents', {
+        'num_of_job_offers_did_not_take == 1': df["num_of_job_offers_did_not_take"] == 1,
+        'looking_for_job == 1': df["looking_for_job"] == 1,
+        'any_job_offers_did_not_take == 1': df["any_job_offers_did_not_take"] == 1,
+        '1982_cps_wage > 0': df['1982_cps_wage'] > 0,
+        'best_wage_rejected > 0': df['best_wage_rejected'] > 0,
+        'is_job1_cps == 1': df['is_job1_cps'] == 1,
+    })
+    return df_processed
+
+
+# Hours worked in each time unit of 'time_unit_of_rejected_wage' (change to test other assumptions)
+HOURS_PER_TIME_UNIT = {
+    1: 1,            # Per hour
+    2: 8,            # Per day: assuming 8 hours per day
+    3: 8 * 5,        # Per week: assuming 8 hours per day and 5 days per week
+    5: 8 * 5 * 4,    # Per month: assuming 8 hours per day, 5 days per week, and 4 weeks per month
+    6: 8 * 5 * 52,   # Per year: assuming 8 hours per day, 5 days per week, and 52 weeks per year
+}
+INVALID_HOURLY_WAGE = -100  # If time unit is not recognized, use the minus value (not valid)
+
+
+def preprocess_data(data, prev_wage_option, offered_wage_option, hours_per_time_unit=HOURS_PER_TIME_UNIT):
     processed_stage_1 = prev_wage_processing(data, prev_wage_option)
-    processed_stage_2 = offered_wage_processing(processed_stage_1, offered_wage_option)
+    processed_stage_2 = offered_wage_processing(processed_stage_1, offered_wage_option, hours_per_time_unit)
     final_data = create_final_data(processed_stage_2)
     return final_data
 
 
+@stage
 def prev_wage_processing(data, prev_wage_option):
     if prev_wage_option == 'job2_wage':
-        processed_data = data[data['hourly_wage_of_job2'] > 0]
-        processed_data.loc[:, 'previous_wage'] = processed_data['hourly_wage_of_job2']
+        processed_data = filter_rows(data, 'prev_wage_processing', {'hourly_wage_of_job2 > 0': data['hourly_wage_of_job2'] > 0})
+        processed_data = processed_data.assign(previous_wage=processed_data['hourly_wage_of_job2'])
     elif prev_wage_option == 'prev_cps_wage':
-        data['previous_wage'] = data.apply(
-            lambda x: x['1981_cps_wage'] if x['year_began_working_1982_cps'] == 82
-            else (x['1980_cps_wage'] if x['year_began_working_1982_cps'] == 81 else np.nan),
-            axis=1
-        )
-        processed_data = data[data['previous_wage'] > 0]
+        # 1981 CPS wage if the 1982 CPS job began in 82, 1980 CPS wage if it began in 81
+        year_began = data['year_began_working_1982_cps']
+        previous_wage = np.select([year_began.eq(82).fillna(False), year_began.eq(81).fillna(False)],
+                                  [data['1981_cps_wage'].astype(float), data['1980_cps_wage'].astype(float)], np.nan)
+        processed_data = data.assign(previous_wage=previous_wage)
+        processed_data = filter_rows(processed_data, 'prev_wage_processing', {'previous_wage > 0': processed_data['previous_wage'] > 0})
     else:
         raise ValueError("Invalid stage 1 option selected.")
     return processed_data
 
 
-def offered_wage_processing(data, offered_wage_option):
+@stage
+def offered_wage_processing(data, offered_wage_option, hours_per_time_unit=HOURS_PER_TIME_UNIT):
     if offered_wage_option == 'per_hr_only':
-        processed_data = data[data['time_unit_of_rejected_wage'] == 1]
-        processed_data.loc[:, 'best_wage_rejected_hr'] = processed_data['best_wage_rejected']
+        processed_data = filter_rows(data, 'offered_wage_processing', {
+            'time_unit_of_rejected_wage == 1': data['time_unit_of_rejected_wage'] == 1
+        })
+        processed_data = processed_data.assign(best_wage_rejected_hr=processed_data['best_wage_rejected'])
     elif offered_wage_option == 'convert_to_hr':
-        data['best_wage_rejected_hr'] = data.apply(adjust_to_hourly, axis=1)
-        processed_data = data
+        processed_data = data.assign(best_wage_rejected_hr=adjust_to_hourly(
+            data['best_wage_rejected'], data['time_unit_of_rejected_wage'], hours_per_time_unit
+        ))
     else:
         raise ValueError("Invalid stage 2 option selected.")
     return processed_data
 
 
-def adjust_to_hourly(row):
-    wage = row['best_wage_rejected']
-    time_unit = row['time_unit_of_rejected_wage']
-    if time_unit == 1:  # Per hour
-        return wage
-    elif time_unit == 2:  # Per day
-        return wage / 8  # Assuming 8 hours per day
-    elif time_unit == 3:  # Per week
-        return wage / (8 * 5)  # Assuming 8 hours per day and 5 days per week
-    elif time_unit == 5:  # Per month
-        return wage / (8 * 5 * 4)  # Assuming 8 hours per day, 5 days per week, and 4 weeks per month
-    elif time_unit == 6:  # Per year
-        return wage / (8 * 5 * 52)  # Assuming 8 hours per day, 5 days per week, and 52 weeks per year
-    else:
-        return -100  # If time unit is not recognized, return the minus value (not valid)
+def adjust_to_hourly(wage, time_unit, hours_per_time_unit=HOURS_PER_TIME_UNIT):
+    # Look up the hours of every time unit code at once instead of calling a function per row.
+    # The hours of a unit can also be an array of alternatives (e.g. a grid of assumptions); the result then
+    # has one row of hourly wages per alternative.
+    units = np.array(sorted(hours_per_time_unit), dtype=float)
+    hours = np.array([hours_per_time_unit[unit] for unit in units], dtype=float)
+    time_unit = np.asarray(time_unit, dtype=float)
+
+    position = np.searchsorted(units, time_unit).clip(max=len(units) - 1)
+    known_unit = units[position] == time_unit
+    return np.where(known_unit, np.asarray(wage, dtype=float) / np.moveaxis(hours[position], 0, -1), INVALID_HOURLY_WAGE)
 
 
+# Columns copied to both the accepted and the rejected row of each case
+CASE_COLUMNS = ['case_id', 'sample_id', 'sample_race', 'sample_sex']
+
+
+@stage
 def create_final_data(processed_stage_2):
-    new_data = []
-    for index, row in processed_stage_2.iterrows():
-        case_id = row['case_id']
-        sample_id = row['sample_id']
-        sample_race = row['sample_race']
-        sample_sex = row['sample_sex']
-        offered_wage = row['1982_cps_wage']
-        previous_wage = row['previous_wage']
-        
-        # For 'acceptance_yn = y' row  -> 1982 CPS is the accepted job offer 
-        new_data.append({
-            'case_id': case_id,
-            'sample_id': sample_id,
-            'sample_race': sample_race,
-            'sample_sex': sample_sex,
-            'offered_wage': offered_wage,
-            'previous_wage': previous_wage,
-            'acceptance_yn': 'y'
-        })
-        
-        # For 'acceptance_yn = n' row -> In the 1982 survey, they offer the rejected job offer when they are looking for CPS job at that time.
-        new_data.append({
-            'case_id': case_id,
-            'sample_id': sample_id,
-            'sample_race': sample_race,
-            'sample_sex': sample_sex,
-            'offered_wage': row['best_wage_rejected_hr'],
-            'previous_wage': previous_wage,
-            'acceptance_yn': 'n'
-        })
+    n_cases = len(processed_stage_2)
 
-    final_data = pd.DataFrame(new_data)
-    return final_data
+    final_data = {}
+    for column in CASE_COLUMNS:
+        final_data[column] = np.repeat(processed_stage_2[column].to_numpy(), 2)
+    final_data['previous_wage'] = np.repeat(processed_stage_2['previous_wage'].to_numpy(dtype=float), 2)
+
+    # Interleave the offers of each case
+    # For 'acceptance_yn = y' row  -> 1982 CPS is the accepted job offer
+    # For 'acceptance_yn = n' row -> In the 1982 survey, they offer the rejected job offer when they are looking for CPS job at that time.
+    offered_wage = np.empty(2 * n_cases)
+    offered_wage[0::2] = processed_stage_2['1982_cps_wage'].to_numpy(dtype=float)
+    offered_wage[1::2] = processed_stage_2['best_wage_rejected_hr'].to_numpy(dtype=float)
+    final_data['offered_wage'] = offered_wage
+    final_data['acceptance_yn'] = np.tile([True, False], n_cases)
 
+    final_data = pd.DataFrame(final_data, columns=CASE_COLUMNS + ['offered_wage', 'previous_wage', 'acceptance_yn'])
+    return enforce(final_data, 'nlsy79_offers')
 
-def save_final_data(final_data, prev_wage_option, offered_wage_option):
-    output_folder = 'data/'  # Folder path
-    output_filename = f"{output_folder}preprocessed_{prev_wage_option}_{offered_wage_option}.csv"
-    final_data.to_csv(output_filename, index=False)
-    print("Length of final_data:", len(final_data))  # Print the length of final_data
+
+def save_final_data(final_data, prev_wage_option, offered_wage_option, output_folder=DATA_DIR):
+    output_filename = os.path.join(output_folder, f"preprocessed_{prev_wage_option}_{offered_wage_option}.csv")
+    write_table(final_data, output_filename, 'nlsy79_offers')
     return output_filename
 
 
-prev_wage_options = ['job2_wage', 'prev_cps_wage']
-offered_wage_options = ['per_hr_only', 'convert_to_hr']
+def main(data_dir=DATA_DIR, use_cache=True):
+    df_processed = load_raw_data(os.path.join(data_dir, 'raw_data.csv'), use_cache)
+
+    # Each stage runs once per option and its output is shared by every downstream combination
+    stage_graph = StageGraph(df_processed)
+    option_stages = [(prev_wage_processing, PREV_WAGE_OPTIONS), (offered_wage_processing, OFFERED_WAGE_OPTIONS), create_final_data]
+    for (opt_1, opt_2), processed_data in stage_graph.fan_out(option_stages):
+        saved_file = save_final_data(processed_data, opt_1, opt_2, data_dir)
+        print(f"File '{saved_file}' created for options '{opt_1}' and '{opt_2}'")
+
 
-for opt_1 in prev_wage_options:
-    for opt_2 in offered_wage_options:
-        processed_data = preprocess_data(df_processed, opt_1, opt_2)
-        saved_file = save_final_data(processed_data, opt_1, opt_2)
-        print(f"File '{saved_file}' created for options '{opt_1}' and '{opt_2}'")
\ No newline at end of file
+if __name__ == '__main__':
+    main()
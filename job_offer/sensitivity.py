@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from joboffer.sensitivity import SENSITIVITY_FILE_NAME, assumption_grid, sweep_acceptance
+from job_offer.data_visualization import INTERVAL_SIZE, RESULT_DIR, interval_bins
+from job_offer.preprocess_data import DATA_DIR, PREV_WAGE_OPTIONS, adjust_to_hourly, load_raw_data, prev_wage_processing
+
+# Values of each working time assumption tried by the sweep; 8 hours, 5 days, 4 weeks and 52 weeks give HOURS_PER_TIME_UNIT
+ASSUMPTION_GRID = {
+    'hours_per_day': [6, 7, 8, 9, 10],
+    'days_per_week': [4, 5, 6],
+    'weeks_per_month': [4, 4.33],
+    'weeks_per_year': [48, 50, 52],
+}
+
+
+def hours_per_time_unit_grid(points):
+    # Hours of each time unit code (as in HOURS_PER_TIME_UNIT) under every grid point
+    hours_per_day = points['hours_per_day'].to_numpy(dtype=float)
+    hours_per_week = hours_per_day * points['days_per_week'].to_numpy(dtype=float)
+    return {
+        1: np.ones(len(points)),
+        2: hours_per_day,
+        3: hours_per_week,
+        5: hours_per_week * points['weeks_per_month'].to_numpy(dtype=float),
+        6: hours_per_week * points['weeks_per_year'].to_numpy(dtype=float),
+    }
+
+
+def wage_difference_grid(processed_stage_1, hours_per_time_unit):
+    # Log wage differences of the final rows (accepted row, then rejected row of each case, as in create_final_data)
+    # under every grid point: (grid points, 2 * cases). Only the rejected wage depends on the assumptions.
+    rejected_hourly = adjust_to_hourly(processed_stage_1['best_wage_rejected'],
+                                       processed_stage_1['time_unit_of_rejected_wage'], hours_per_time_unit)
+    offered_wage = np.empty((rejected_hourly.shape[0], 2 * len(processed_stage_1)))
+    offered_wage[:, 0::2] = processed_stage_1['1982_cps_wage'].to_numpy(dtype=float)
+    offered_wage[:, 1::2] = rejected_hourly
+    previous_wage = np.repeat(processed_stage_1['previous_wage'].to_numpy(dtype=float), 2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.log(offered_wage / previous_wage)
+
+
+def sweep(df_processed, grid=ASSUMPTION_GRID, interval_size=INTERVAL_SIZE):
+    # Binned acceptance of every 'convert_to_hr' table under every grid point ('per_hr_only' does not depend on them)
+    points = assumption_grid(grid)
+    hours_per_time_unit = hours_per_time_unit_grid(points)
+    tables = []
+    for prev_wage_option in PREV_WAGE_OPTIONS:
+        processed_stage_1 = prev_wage_processing(df_processed, prev_wage_option)
+        wage_difference = wage_difference_grid(processed_stage_1, hours_per_time_unit)
+        accepted = np.tile([True, False], len(processed_stage_1))
+        tables.append(sweep_acceptance(points, f'{prev_wage_option}_convert_to_hr', wage_difference, accepted,
+                                       interval_bins(interval_size), right=False))
+    return tables
+
+
+def main(data_dir=DATA_DIR, result_folder=RESULT_DIR, use_cache=True):
+    if not os.path.exists(result_folder):
+        os.makedirs(result_folder)
+
+    df_processed = load_raw_data(os.path.join(data_dir, 'raw_data.csv'), use_cache)
+    results = pd.concat(sweep(df_processed), ignore_index=True)
+    output_filename = os.path.join(result_folder, SENSITIVITY_FILE_NAME)
+    results.to_csv(output_filename, index=False)
+    print(f"Saved {len(results)} rows of the assumption sweep to '{output_filename}'")
+
+
+if __name__ == '__main__':
+    main()
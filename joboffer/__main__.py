@@ -0,0 +1,3 @@
+from joboffer.cli import main
+
+main()
@@ -0,0 +1,52 @@
+import hashlib
+import json
+import os
+import time
+
+from joboffer.cache import CACHE_FOLDER_NAME, file_fingerprint, write_json
+
+MANIFEST_FILE_NAME = 'manifest.json'  # In the result folder: artifact file name -> the inputs that produced it
+
+
+# Result files (figures, grouped tables) are keyed by the contents of their input files, their parameters and the
+# source of the code that makes them. A run skips the files whose key is unchanged and records the key, inputs and
+# parameters of every file it writes in the manifest of the result folder.
+
+def input_fingerprints(file_paths):
+    # Content hash of every input file (remembered in the .cache folder next to it, like read_cached does)
+    fingerprints = {}
+    for file_path in file_paths:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(file_path)), CACHE_FOLDER_NAME)
+        os.makedirs(cache_dir, exist_ok=True)
+        fingerprints[os.path.abspath(file_path)] = file_fingerprint(file_path, cache_dir)
+    return fingerprints
+
+
+def artifact_key(inputs, params, code):
+    # inputs: file path -> content hash. The paths are not part of the key, so moved inputs are not rendered again.
+    description = {'inputs': sorted(inputs.values()), 'params': params, 'code': code}
+    return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def load_manifest(result_folder):
+    manifest_path = os.path.join(result_folder, MANIFEST_FILE_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_manifest(result_folder, manifest):
+    write_json(os.path.join(result_folder, MANIFEST_FILE_NAME), manifest)
+
+
+def up_to_date(manifest, result_folder, artifact_names, key):
+    # True if every artifact exists and was made from the same key
+    return all(manifest.get(name, {}).get('key') == key and os.path.exists(os.path.join(result_folder, name))
+               for name in artifact_names)
+
+
+def manifest_entries(artifact_names, key, inputs, params, code):
+    created = time.strftime('%Y-%m-%dT%H:%M:%S')
+    return {name: {'key': key, 'inputs': inputs, 'params': params, 'code': code, 'created': created}
+            for name in artifact_names}
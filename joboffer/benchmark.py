@@ -0,0 +1,160 @@
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from joboffer.runner import use_offscreen_backend
+from joboffer.schema import write_table
+from joboffer.synthetic import synthetic_njui_weekly, synthetic_nlsy79, write_njui_weekly
+
+BENCHMARK_FILE_NAME = 'benchmark.json'
+SCALES = [1, 10]  # Multiples of the scale 1 synthetic inputs; up to 1000 is supported (needs several GB of memory)
+DATASETS = ['nlsy79', 'njui']
+REPEAT = 3
+BENCHMARK_BOOTSTRAP_REPLICATES = 1000  # Replicates of the bootstrap bands in the grouping stages
+REGRESSION_TOLERANCE = 0.25  # A stage is reported as a regression when its best time grows by more than this
+REGRESSION_MIN_SECONDS = 0.01  # Stages faster than this in the baseline are too noisy to compare
+
+
+def run_stage(results, dataset, scale, stage, function, *args, repeat=REPEAT, trace_memory=True, **kwargs):
+    # Time function(*args, **kwargs) repeat times, then measure its peak traced memory in one more (untimed) run.
+    # Stages return new frames, so running them again gives the same output.
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = function(*args, **kwargs)
+        seconds.append(time.perf_counter() - start)
+
+    peak_memory = None
+    if trace_memory:
+        tracemalloc.start()
+        function(*args, **kwargs)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    results.append({
+        'dataset': dataset, 'scale': scale, 'stage': stage,
+        'rows_in': len(args[0]) if args and hasattr(args[0], '__len__') and not isinstance(args[0], str) else None,
+        'rows_out': len(output) if isinstance(output, (pd.DataFrame, pd.Series)) else None,
+        'seconds': seconds, 'best_seconds': min(seconds), 'median_seconds': float(np.median(seconds)),
+        'peak_memory_bytes': peak_memory,
+    })
+    print(f"{dataset} x{scale} {stage}: {min(seconds):.4f} s")
+    return output
+
+
+def benchmark_nlsy79(results, scale, seed, work_dir, bootstrap_replicates, **options):
+    use_offscreen_backend()
+    from job_offer import data_visualization, preprocess_data
+
+    raw_path = os.path.join(work_dir, f'nlsy79_raw_{scale}.csv')
+    synthetic_nlsy79(scale, seed).to_csv(raw_path, index=False)
+    stage = partial(run_stage, results, 'nlsy79', scale, **options)
+
+    df_processed = stage('read_raw_data', preprocess_data.read_raw_data, raw_path)
+    processed_stage_1 = stage('prev_wage_processing', preprocess_data.prev_wage_processing, df_processed, 'prev_cps_wage')
+    processed_stage_2 = stage('offered_wage_processing', preprocess_data.offered_wage_processing, processed_stage_1, 'convert_to_hr')
+    final_data = stage('create_final_data', preprocess_data.create_final_data, processed_stage_2)
+
+    final_file_name = f'nlsy79_final_{scale}.csv'
+    write_table(final_data, os.path.join(work_dir, final_file_name), 'nlsy79_offers')
+    variant = os.path.splitext(final_file_name)[0]
+    # process_outliers filters the tables of estimate and serve; visualize builds one cube of every race, sex and
+    # interval and reads its graphs and tables from it
+    stage('process_outliers', data_visualization.process_outliers, os.path.join(work_dir, final_file_name))
+    cube = stage('build_cube', data_visualization.build_cube, work_dir, [final_file_name], data_visualization.INTERVAL_SIZE)
+    grouped_data = stage('cube_grouped_data', data_visualization.cube_grouped_data, cube, variant, bootstrap_replicates)
+    stage('group_data_sweep', data_visualization.group_data_sweep, cube.stratum_rows(variant))
+    stage('save_line_graph', data_visualization.save_line_graph, grouped_data, f'nlsy79_{scale}', work_dir)
+    stage('save_strata_graph', data_visualization.save_strata_graph, cube, variant, work_dir)
+
+
+def benchmark_njui(results, scale, seed, work_dir, bootstrap_replicates, **options):
+    use_offscreen_backend()
+    from NJUI import data_visualization
+    from NJUI import preprocessing_data as preprocessing
+
+    weekly_path = os.path.join(work_dir, f'njui_weekly_{scale}.dta')
+    write_njui_weekly(synthetic_njui_weekly(scale, seed), weekly_path)
+    stage = partial(run_stage, results, 'njui', scale, **options)
+
+    # The weekly file is streamed from Stata as preprocess does it (without the cache): read, renamed and filtered
+    weekly = stage('read_weekly_data', preprocessing.read_weekly_data, weekly_path)
+    df_weekly, reservation_history = weekly['offers'], weekly['reservation_history']
+    df_weekly_sum = stage('generate_previous_reservation_wage', preprocessing.generate_previous_reservation_wage,
+                          df_weekly, reservation_history=reservation_history)
+    df_hourly_wage = stage('generate_hourly_wage_columns', preprocessing.generate_hourly_wage_columns, df_weekly_sum)
+    stage('calculate_hourly_wage', preprocessing.calculate_hourly_wage, df_weekly_sum,
+          'weekly_working_hour', 'job_offer_wage', 'job_offer_unit', 'job_offer_wage_hourly')
+    exclude_df = stage('exclude_dual_job', preprocessing.exclude_dual_job, df_hourly_wage)
+    final_df = stage('transform_acceptance', preprocessing.transform_acceptance, exclude_df, 'include_dontknow')
+
+    final_path = os.path.join(work_dir, f'njui_final_{scale}.csv')
+    write_table(final_df, final_path, 'njui_offers')
+    filtered_df = stage('process_outliers', data_visualization.process_outliers, final_path)
+    grouped = stage('group_data_quantile_bins', data_visualization.group_data_quantile_bins, filtered_df, 2,
+                    bootstrap_replicates)
+    stage('generate_and_save_final_graph', data_visualization.generate_and_save_final_graph, filtered_df, 2,
+          work_dir, grouped)
+
+
+BENCHMARKS = {'nlsy79': benchmark_nlsy79, 'njui': benchmark_njui}
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(scales=SCALES, datasets=DATASETS, seed=0, repeat=REPEAT, trace_memory=True,
+                   bootstrap_replicates=BENCHMARK_BOOTSTRAP_REPLICATES):
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for scale in scales:
+            scale = int(scale) if float(scale).is_integer() else scale
+            for dataset in datasets:
+                BENCHMARKS[dataset](results, scale, seed, work_dir, bootstrap_replicates,
+                                    repeat=repeat, trace_memory=trace_memory)
+    return {
+        'commit': current_commit(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+        'seed': seed, 'repeat': repeat, 'bootstrap_replicates': bootstrap_replicates,
+        'results': results,
+    }
+
+
+def find_regressions(baseline, current, tolerance=REGRESSION_TOLERANCE):
+    # Stages (matched by dataset, scale and stage) whose best time grew by more than the tolerance
+    baseline_seconds = {(r['dataset'], r['scale'], r['stage']): r['best_seconds'] for r in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        before = baseline_seconds.get((result['dataset'], result['scale'], result['stage']))
+        if before and before >= REGRESSION_MIN_SECONDS and result['best_seconds'] > before * (1 + tolerance):
+            regressions.append(dict(result, baseline_seconds=before, ratio=result['best_seconds'] / before))
+    return regressions
+
+
+def main(output=BENCHMARK_FILE_NAME, baseline=None, **benchmark_options):
+    report = run_benchmarks(**benchmark_options)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f"Saved {len(report['results'])} stage results to '{output}'")
+
+    if baseline:
+        with open(baseline) as f:
+            regressions = find_regressions(json.load(f), report)
+        for r in regressions:
+            print(f"Regression: {r['dataset']} x{r['scale']} {r['stage']} {r['baseline_seconds']:.4f} s -> {r['best_seconds']:.4f} s")
+        if regressions:
+            raise SystemExit(1)
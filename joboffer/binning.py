@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+ZERO_BIN_LABEL = '[0.0, 0.0]'
+
+
+def bin_codes(values, edges, right=True, include_lowest=False):
+    # Bin of every value with the interval rules of pd.cut; -1 for values outside every bin (and missing values)
+    edges = np.asarray(edges, dtype=float)
+    codes = np.searchsorted(edges, values, side='left' if right else 'right') - 1
+    if right and include_lowest:
+        codes[values == edges[0]] = 0
+    codes[(codes < 0) | (codes >= len(edges) - 1)] = -1
+    return codes
+
+
+def bin_labels(edges, right=True, include_lowest=False):
+    # The intervals pd.cut would label the bins with (they only depend on the edges)
+    return pd.cut(pd.Series([], dtype=float), bins=edges, right=right, include_lowest=include_lowest).cat.categories
+
+
+def binned_acceptance(values, accepted, schemes, right=True, include_lowest=False, zero_bin=False):
+    # Offers, accepted offers, mean value and acceptance ratio of every bin of every bin scheme.
+    # schemes: name -> bin edges. With zero_bin, values exactly 0 are not put in the regular bins but in
+    # an extra bin after them (labelled ZERO_BIN_LABEL).
+    # The bins of all schemes are numbered into one range so a single bincount per statistic covers every scheme.
+    # Returns (tables, codes): name -> table with one row per bin, name -> bin code of every row.
+    values = np.asarray(values, dtype=float)
+    accepted = np.asarray(accepted, dtype=bool)
+
+    codes, offsets = {}, [0]
+    for name, edges in schemes.items():
+        n_bins = len(edges) - 1
+        codes[name] = bin_codes(values, edges, right, include_lowest)
+        if zero_bin:
+            codes[name][values == 0] = n_bins
+            n_bins += 1
+        offsets.append(offsets[-1] + n_bins)
+
+    cells = np.concatenate([scheme_codes + offset for scheme_codes, offset in zip(codes.values(), offsets)])
+    in_bin = np.concatenate(list(codes.values())) >= 0
+    cells = cells[in_bin]
+    total_count = np.bincount(cells, minlength=offsets[-1])
+    accept_count = np.bincount(cells, weights=np.tile(accepted, len(schemes))[in_bin], minlength=offsets[-1])
+    value_sum = np.bincount(cells, weights=np.tile(values, len(schemes))[in_bin], minlength=offsets[-1])
+
+    tables = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for (name, edges), start, stop in zip(schemes.items(), offsets[:-1], offsets[1:]):
+            labels = list(bin_labels(edges, right, include_lowest)) + ([ZERO_BIN_LABEL] if zero_bin else [])
+            tables[name] = pd.DataFrame({
+                'bin': labels,
+                'mean_value': value_sum[start:stop] / total_count[start:stop],
+                'total_count': total_count[start:stop],
+                'accept_count': accept_count[start:stop].astype(np.int64),
+                'acceptance_ratio': accept_count[start:stop] / total_count[start:stop],
+            })
+    return tables, codes
@@ -0,0 +1,61 @@
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+
+BOOTSTRAP_REPLICATES = 10000
+BOOTSTRAP_SEED = 0
+CONFIDENCE = 0.95
+BATCH_ELEMENTS = 1 << 22  # Resampled case draws held in memory at a time (replicates x cases)
+
+
+def case_bin_counts(case_codes, bin_codes, accepted, n_cases, n_bins):
+    # Offers and accepted offers of every (case, bin); rows outside every bin (bin code -1) are left out
+    in_bin = bin_codes >= 0
+    cells = case_codes[in_bin].astype(np.int64) * n_bins + bin_codes[in_bin]
+    totals = np.bincount(cells, minlength=n_cases * n_bins).reshape(n_cases, n_bins)
+    accepts = np.bincount(cells, weights=accepted[in_bin], minlength=n_cases * n_bins).reshape(n_cases, n_bins)
+    return totals.astype(float), accepts
+
+
+def replicate_ratios(seed, n_replicates, totals, accepts):
+    # Acceptance ratio per bin for a batch of replicates. Each replicate draws cases with replacement; the
+    # number of times each case is drawn weights its (case, bin) counts, so a batch is two matrix products.
+    rng = np.random.default_rng(seed)
+    n_cases = totals.shape[0]
+    draws = rng.integers(0, n_cases, size=(n_replicates, n_cases))
+    draws += n_cases * np.arange(n_replicates)[:, None]
+    weights = np.bincount(draws.ravel(), minlength=n_replicates * n_cases).reshape(n_replicates, n_cases)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (weights @ accepts) / (weights @ totals)
+
+
+def bootstrap_acceptance_bands(case_ids, bin_codes, accepted, n_bins, replicates=BOOTSTRAP_REPLICATES,
+                               confidence=CONFIDENCE, seed=BOOTSTRAP_SEED, processes=None):
+    # Percentile confidence band of the acceptance ratio of every bin, resampling whole cases (all rows of a
+    # case stay together, e.g. the accepted and rejected row of an NLSY79 respondent).
+    # bin_codes: bin of each row (0..n_bins-1, -1 for none); accepted: boolean per row.
+    # Returns (lower, upper) arrays of length n_bins; bins never observed get NaN.
+    case_codes, case_index = pd.factorize(pd.Series(case_ids))
+    bin_codes = np.asarray(bin_codes, dtype=np.int64)
+    accepted = np.asarray(accepted, dtype=float)
+    totals, accepts = case_bin_counts(case_codes, bin_codes, accepted, len(case_index), n_bins)
+
+    # Replicates are split into batches with their own seed, so results do not depend on the process pool
+    batch_size = max(1, BATCH_ELEMENTS // max(len(case_index), 1))
+    batch_sizes = [min(batch_size, replicates - start) for start in range(0, replicates, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(batch_sizes))
+    if processes:
+        with ProcessPoolExecutor(processes) as pool:
+            batches = list(pool.map(replicate_ratios, seeds, batch_sizes, repeat(totals), repeat(accepts)))
+    else:
+        batches = [replicate_ratios(*args) for args in zip(seeds, batch_sizes, repeat(totals), repeat(accepts))]
+
+    tail = (1 - confidence) / 2 * 100
+    with warnings.catch_warnings():
+        # A bin can be empty in every replicate
+        warnings.simplefilter('ignore', RuntimeWarning)
+        lower, upper = np.nanpercentile(np.vstack(batches), [tail, 100 - tail], axis=0)
+    return lower, upper
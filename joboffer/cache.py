@@ -0,0 +1,168 @@
+import hashlib
+import importlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from joboffer.instrument import recorded_filters, replay_filters
+
+CACHE_FOLDER_NAME = '.cache'  # Created next to the source file unless a cache folder is given
+FINGERPRINTS_FILE_NAME = 'fingerprints.json'
+# Modules that shape every cached entry besides the reader's own (the dtypes readers cast to, the entry format);
+# part of every entry key
+SHARED_READER_MODULES = ['joboffer.schema', __name__]
+# Nullable pandas arrays by numpy kind, saved as their numpy values and missing mask
+MASKED_ARRAYS = {'b': pd.arrays.BooleanArray, 'f': pd.arrays.FloatingArray,
+                 'i': pd.arrays.IntegerArray, 'u': pd.arrays.IntegerArray}
+
+
+def file_fingerprint(file_path, cache_dir):
+    # SHA-256 of the file contents. The hash is remembered with the file size and modification time,
+    # so an unchanged file is not read again on warm runs.
+    file_path = os.path.abspath(file_path)
+    stat = os.stat(file_path)
+    fingerprints_path = os.path.join(cache_dir, FINGERPRINTS_FILE_NAME)
+    fingerprints = {}
+    if os.path.exists(fingerprints_path):
+        with open(fingerprints_path) as f:
+            fingerprints = json.load(f)
+
+    known = fingerprints.get(file_path)
+    if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+        return known['sha256']
+
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(block)
+    fingerprints[file_path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256.hexdigest()}
+    write_json(fingerprints_path, fingerprints)
+    return sha256.hexdigest()
+
+
+def code_version(module_names):
+    # SHA-256 of the source files of the modules, so any code change invalidates what was made from them
+    sha256 = hashlib.sha256()
+    for module_name in module_names:
+        with open(importlib.import_module(module_name).__file__, 'rb') as f:
+            sha256.update(f.read())
+    return sha256.hexdigest()
+
+
+def write_json(path, data):
+    # Write through a temporary file so concurrent readers never see a partial file
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+def save_frame(df, folder):
+    # One .npy file per column; nullable numbers are stored as values plus a missing mask, text and categorical
+    # columns as integer codes plus categories
+    columns = []
+    for i, column in enumerate(df.columns):
+        values = df[column]
+        entry = {'name': column, 'file': f'{i}.npy', 'dtype': str(values.dtype)}
+        if values.dtype.kind in 'biufcmM' and isinstance(values.dtype, np.dtype):
+            np.save(os.path.join(folder, entry['file']), values.to_numpy())
+        elif isinstance(values.array, tuple(MASKED_ARRAYS.values())):
+            entry['mask_file'] = f'{i}.mask.npy'
+            np.save(os.path.join(folder, entry['file']), values.to_numpy(dtype=values.dtype.numpy_dtype, na_value=0))
+            np.save(os.path.join(folder, entry['mask_file']), values.isna().to_numpy())
+        else:
+            categorical = pd.Categorical(values)
+            entry['ordered'] = bool(categorical.ordered)
+            entry['categories_file'] = f'{i}.categories.npy'
+            np.save(os.path.join(folder, entry['file']), categorical.codes)
+            np.save(os.path.join(folder, entry['categories_file']),
+                    np.asarray(categorical.categories, dtype=object), allow_pickle=True)
+        columns.append(entry)
+
+    meta = {'columns': columns, 'rows': len(df)}
+    if not df.index.equals(pd.RangeIndex(len(df))):
+        meta['index_file'] = 'index.npy'
+        np.save(os.path.join(folder, meta['index_file']), df.index.to_numpy())
+    write_json(os.path.join(folder, 'meta.json'), meta)
+
+
+def load_frame(folder):
+    # Columns are memory-mapped; only categories are read eagerly
+    with open(os.path.join(folder, 'meta.json')) as f:
+        meta = json.load(f)
+
+    data = {}
+    for entry in meta['columns']:
+        values = np.load(os.path.join(folder, entry['file']), mmap_mode='r')
+        if 'mask_file' in entry:
+            mask = np.load(os.path.join(folder, entry['mask_file']))
+            values = MASKED_ARRAYS[values.dtype.kind](values, mask)
+        elif 'categories_file' in entry:
+            categories = np.load(os.path.join(folder, entry['categories_file']), allow_pickle=True)
+            values = pd.Categorical.from_codes(values, categories=categories, ordered=entry['ordered'])
+            if entry['dtype'] != 'category':
+                values = pd.Series(values).astype(entry['dtype']).array
+        data[entry['name']] = values
+
+    index = pd.RangeIndex(meta['rows'])
+    if 'index_file' in meta:
+        index = pd.Index(np.load(os.path.join(folder, meta['index_file'])))
+    return pd.DataFrame(data, index=index, columns=[entry['name'] for entry in meta['columns']])
+
+
+def save_entry(result, folder, filters=()):
+    # A reader returns one frame or a dict of named frames; each frame gets its own subfolder. The filter records
+    # of the read (rows each predicate dropped) are kept with them.
+    frames = result if isinstance(result, dict) else {'frame': result}
+    for name, df in frames.items():
+        os.makedirs(os.path.join(folder, name))
+        save_frame(df, os.path.join(folder, name))
+    write_json(os.path.join(folder, 'entry.json'),
+               {'frames': list(frames), 'dict': isinstance(result, dict), 'filters': list(filters)})
+
+
+def load_entry(folder, replay=False):
+    # replay: emit the stored filter records, as if the reader had run (shown by --instrument on warm runs)
+    with open(os.path.join(folder, 'entry.json')) as f:
+        entry = json.load(f)
+    if replay:
+        replay_filters(entry['filters'])
+    frames = {name: load_frame(os.path.join(folder, name)) for name in entry['frames']}
+    return frames if entry['dict'] else frames['frame']
+
+
+def read_cached(read_function, file_path, cache_dir=None, **read_kwargs):
+    # Read file_path with read_function(file_path, **read_kwargs) once and keep the parsed frame (or dict of
+    # frames) as binary columns. Entries are keyed by the source contents, the reader and its arguments (e.g. the column
+    # selection) and the source of the reader's module and SHARED_READER_MODULES, so a changed source file,
+    # selection, reader (its filters, renames, codebook) or schema is parsed again and the stale entry is removed.
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(file_path)), CACHE_FOLDER_NAME)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    selection = f'{read_function.__module__}.{read_function.__name__}({sorted(read_kwargs.items())!r})'
+    selection_hash = hashlib.sha256(selection.encode()).hexdigest()[:12]
+    entry_prefix = f'{os.path.basename(file_path)}.{selection_hash}.'
+    version = hashlib.sha256((file_fingerprint(file_path, cache_dir) + code_version([read_function.__module__] + SHARED_READER_MODULES)).encode())
+    entry_folder = os.path.join(cache_dir, entry_prefix + version.hexdigest()[:16])
+    if os.path.exists(os.path.join(entry_folder, 'entry.json')):
+        return load_entry(entry_folder, replay=True)
+
+    with recorded_filters() as filters:
+        result = read_function(file_path, **read_kwargs)
+
+    temp_folder = tempfile.mkdtemp(dir=cache_dir, prefix=entry_prefix, suffix='.tmp')
+    save_entry(result, temp_folder, filters)
+    for name in os.listdir(cache_dir):
+        if name.startswith(entry_prefix) and not name.endswith('.tmp'):
+            shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+    try:
+        os.replace(temp_folder, entry_folder)
+    except OSError:
+        # Another process stored the same entry first
+        shutil.rmtree(temp_folder, ignore_errors=True)
+    return load_entry(entry_folder)
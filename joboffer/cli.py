@@ -0,0 +1,136 @@
+import argparse
+import importlib
+
+# Module run by each (command, dataset); imported only when the command runs
+COMMAND_MODULES = {
+    ('preprocess', 'nlsy79'): 'job_offer.preprocess_data',
+    ('visualize', 'nlsy79'): 'job_offer.data_visualization',
+    ('preprocess', 'njui'): 'NJUI.preprocessing_data',
+    ('visualize', 'njui'): 'NJUI.data_visualization',
+    ('sweep', 'nlsy79'): 'job_offer.sensitivity',
+    ('sweep', 'njui'): 'NJUI.sensitivity',
+    ('estimate', None): 'joboffer.estimation',  # Fits every variant of both datasets
+    ('benchmark', None): 'joboffer.benchmark',  # Runs on synthetic data of both datasets
+    ('serve', None): 'joboffer.query',  # Acceptance queries over the preprocessed tables of both datasets
+}
+DATASETS = ['nlsy79', 'njui']
+
+
+def add_instrument_arguments(subparser):
+    subparser.add_argument('--instrument', nargs='?', const='', metavar='FILE',
+                           help='Record time, rows and filtered rows of every stage and print a summary; '
+                                'with FILE, also append the records to FILE as JSON lines.')
+    subparser.add_argument('--trace-memory', action='store_true',
+                           help='With --instrument: also record the peak traced memory of every stage (slower).')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='joboffer', description='Job offer acceptance pipelines.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    preprocess = subparsers.add_parser('preprocess', help='Build the preprocessed tables from the raw survey data.')
+    preprocess.add_argument('--dataset', choices=DATASETS, required=True)
+    preprocess.add_argument('--data-dir', help="Folder with the input and output data (default: the dataset's data folder).")
+    preprocess.add_argument('--no-cache', action='store_true', help='Parse the raw files instead of using the binary cache.')
+    preprocess.add_argument('--incremental', action='store_true',
+                            help='NJUI only: process the weeks that arrived since the last run and append them.')
+    preprocess.add_argument('--entry-columns', nargs='+', metavar='COLUMN',
+                            help='NJUI only: entry survey columns (e.g. female age b3) to add to every offer by case id.')
+    add_instrument_arguments(preprocess)
+
+    visualize = subparsers.add_parser('visualize', help='Group the preprocessed tables and save graphs and CSVs.')
+    visualize.add_argument('--dataset', choices=DATASETS, required=True)
+    visualize.add_argument('--data-dir', help="Folder with the preprocessed tables (default: the dataset's data folder).")
+    visualize.add_argument('--result-dir', help="Folder for graphs and grouped CSVs (default: the dataset's result folder).")
+    visualize.add_argument('--binning', choices=['exact', 'sketch'],
+                           help="NJUI only: hand-picked quantile bins ('exact', default) or bins from a streaming quantile sketch.")
+    visualize.add_argument('--cluster-band', action='store_true',
+                           help='NJUI only: draw the regression confidence bands with standard errors clustered by case.')
+    visualize.add_argument('--outlier-scope', choices=['pooled', 'stratum'],
+                           help="NLSY79 only: outlier bounds of the whole table ('pooled', default) or of each race and sex.")
+    visualize.add_argument('--force', action='store_true',
+                           help='Make every graph and grouped table again, even those whose inputs and code are unchanged.')
+    visualize.add_argument('--processes', type=int,
+                           help='Worker processes for the tables (default: one per table, up to the number of cores; 1 runs them in turn).')
+    add_instrument_arguments(visualize)
+
+    sweep = subparsers.add_parser('sweep', help='Binned acceptance under a grid of working time assumptions, in one table.')
+    sweep.add_argument('--dataset', choices=DATASETS, required=True)
+    sweep.add_argument('--data-dir', help="Folder with the raw data (default: the dataset's data folder).")
+    sweep.add_argument('--result-dir', help="Folder for the sweep table (default: the dataset's result folder).")
+    sweep.add_argument('--no-cache', action='store_true', help='Parse the raw files instead of using the binary cache.')
+    add_instrument_arguments(sweep)
+
+    estimate = subparsers.add_parser('estimate', help='Fit the acceptance models of every variant and subgroup into one table.')
+    estimate.add_argument('--result-dir', help='Folder for the coefficients table (default: the result folder of the repository).')
+    add_instrument_arguments(estimate)
+
+    benchmark = subparsers.add_parser('benchmark', help='Time every pipeline stage on seeded synthetic data and save JSON.')
+    benchmark.add_argument('--scales', type=float, nargs='+', help='Multiples of the scale 1 synthetic inputs (default: 1 10).')
+    benchmark.add_argument('--datasets', choices=DATASETS, nargs='+', help='Datasets to benchmark (default: both).')
+    benchmark.add_argument('--repeat', type=int, help='Timed runs of every stage (default: 3).')
+    benchmark.add_argument('--bootstrap-replicates', type=int, help='Bootstrap replicates of the grouping stages.')
+    benchmark.add_argument('--no-memory', action='store_true', help='Skip the peak memory measurement runs.')
+    benchmark.add_argument('--output', help='JSON file for the results (default: benchmark.json).')
+    benchmark.add_argument('--baseline', help='JSON results of an earlier version; exit with status 1 if a stage got slower.')
+
+    serve = subparsers.add_parser('serve', help='Answer acceptance ratio queries of any wage difference range over local HTTP.')
+    serve.add_argument('--port', type=int, help='Port on 127.0.0.1 (default: 8765).')
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    args.dataset = getattr(args, 'dataset', None)
+    if getattr(args, 'incremental', False) and args.dataset != 'njui':
+        parser.error('--incremental is only available for --dataset njui')
+    if getattr(args, 'entry_columns', None) and (args.dataset != 'njui' or args.incremental):
+        parser.error('--entry-columns is only available for --dataset njui without --incremental')
+    if getattr(args, 'binning', None) and args.dataset != 'njui':
+        parser.error('--binning is only available for --dataset njui')
+    if getattr(args, 'cluster_band', False) and args.dataset != 'njui':
+        parser.error('--cluster-band is only available for --dataset njui')
+    if getattr(args, 'outlier_scope', None) and args.dataset != 'nlsy79':
+        parser.error('--outlier-scope is only available for --dataset nlsy79')
+    if getattr(args, 'trace_memory', False) and getattr(args, 'instrument', None) is None:
+        parser.error('--trace-memory needs --instrument')
+    module = importlib.import_module(COMMAND_MODULES[(args.command, args.dataset)])
+
+    kwargs = {}
+    if getattr(args, 'data_dir', None):
+        kwargs['data_dir'] = args.data_dir
+    if getattr(args, 'result_dir', None):
+        kwargs['result_folder'] = args.result_dir
+    if getattr(args, 'no_cache', False):
+        kwargs['use_cache'] = False
+    if getattr(args, 'incremental', False):
+        kwargs['incremental'] = True
+    if getattr(args, 'entry_columns', None):
+        kwargs['entry_columns'] = args.entry_columns
+    if getattr(args, 'binning', None):
+        kwargs['binning'] = args.binning
+    if getattr(args, 'cluster_band', False):
+        kwargs['cluster_band'] = True
+    if getattr(args, 'outlier_scope', None):
+        kwargs['outlier_scope'] = args.outlier_scope
+    if getattr(args, 'force', False):
+        kwargs['force'] = True
+    if getattr(args, 'processes', None) is not None:
+        kwargs['processes'] = args.processes
+    elif args.command == 'visualize' and getattr(args, 'instrument', None) is not None:
+        kwargs['processes'] = 1  # Stages are only recorded in this process
+    for option in ['scales', 'datasets', 'repeat', 'bootstrap_replicates', 'output', 'baseline', 'port']:
+        if getattr(args, option, None) is not None:
+            kwargs[option] = getattr(args, option)
+    if getattr(args, 'no_memory', False):
+        kwargs['trace_memory'] = False
+
+    if getattr(args, 'instrument', None) is None:
+        return module.main(**kwargs)
+    from joboffer import instrument
+    instrument.enable(args.instrument or None, args.trace_memory)
+    try:
+        module.main(**kwargs)
+    finally:
+        instrument.print_summary(instrument.disable())
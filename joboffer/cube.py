@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+
+from joboffer.binning import bin_codes, bin_labels
+from joboffer.instrument import filter_rows
+
+STRATA_COLUMNS = ['sample_race', 'sample_sex']
+OUTLIER_SCOPES = ['pooled', 'stratum']  # 1.5 IQR bounds of each variant, or of each (variant, stratum)
+MARGIN = 'all'  # Stratum value of the rollup over every value of a stratum column
+CUBE_COLUMNS = ['total_count', 'accept_count', 'mean_wage_difference', 'mean_offered_wage', 'acceptance_ratio']
+
+
+def lerp(a, b, t):
+    # Linear interpolation as np.quantile does it, so the bounds equal those of Series.quantile to the last bit
+    diff = b - a
+    return np.where(t >= 0.5, b - diff * (1 - t), a + diff * t)
+
+
+def grouped_quantiles(values, groups, n_groups, quantiles):
+    # Linearly interpolated quantiles of the values of every group (codes 0..n_groups-1), missing values left out.
+    # One sort of all rows by group and value. Returns an array (n_groups, len(quantiles)); NaN for empty groups.
+    valid = ~np.isnan(values)
+    values, groups = values[valid], groups[valid]
+    order = np.lexsort((values, groups))
+    values = values[order]
+    counts = np.bincount(groups, minlength=n_groups)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    positions = (counts[:, None] - 1) * np.asarray(quantiles, dtype=float)[None, :]
+    below = np.floor(positions).astype(np.int64)
+    above = np.minimum(below + 1, counts[:, None] - 1)
+    result = np.full(positions.shape, np.nan)
+    found = counts > 0
+    if len(values):
+        low = values[np.clip(starts[:, None] + below, 0, len(values) - 1)]
+        high = values[np.clip(starts[:, None] + above, 0, len(values) - 1)]
+        result[found] = lerp(low, high, positions - below)[found]
+    return result
+
+
+# Binned acceptance of every (variant, stratum, bin), with the rollups over each stratum column. The rows of all
+# variants are stacked into one table and counted with a single bincount per statistic into the cube of the finest
+# cells (variant x stratum values x bin); the margins are sums over its stratum axes. Curves and tables of any
+# variant and subgroup are slices of the cube.
+class AcceptanceCube:
+    def __init__(self, variants, edges, strata_columns=STRATA_COLUMNS, right=False, outlier_scope='pooled'):
+        # variants: variant name -> (frame with wage_difference, offered_wage, acceptance_yn and the strata
+        # columns, case id column). outlier_scope: one of OUTLIER_SCOPES.
+        if outlier_scope not in OUTLIER_SCOPES:
+            raise ValueError(f"Invalid outlier_scope: {outlier_scope}. Valid options are {OUTLIER_SCOPES}")
+        self.variants = list(variants)
+        self.edges = np.asarray(edges, dtype=float)
+        self.strata_columns = list(strata_columns)
+        self.outlier_scope = outlier_scope
+        self.labels = bin_labels(self.edges, right)
+
+        # Stacked rows of every variant, with the codes of their variant and stratum values
+        rows = pd.concat([pd.DataFrame({
+            'variant': np.full(len(df), variant_code),
+            'case_id': df[case_column].to_numpy(),
+            'wage_difference': df['wage_difference'].to_numpy(dtype=float),
+            'offered_wage': df['offered_wage'].to_numpy(dtype=float),
+            'acceptance_yn': df['acceptance_yn'].to_numpy(dtype=bool),
+            **{column: df[column].to_numpy() for column in self.strata_columns},
+        }) for variant_code, (df, case_column) in enumerate(variants.values())], ignore_index=True)
+        self.values = {}  # Stratum column -> its values in the order of the cube axis (the margin comes last)
+        shape = [len(self.variants)]
+        for column in self.strata_columns:
+            codes, values = pd.factorize(rows[column], sort=True)
+            rows[column] = codes
+            self.values[column] = values.tolist()
+            shape.append(len(values))
+        n_bins = len(self.edges) - 1
+
+        # Outlier bounds of every variant (pooled) or every finest stratum of a variant
+        groups = rows['variant'].to_numpy()
+        n_groups = len(self.variants)
+        if outlier_scope == 'stratum':
+            groups = np.ravel_multi_index([rows[column].to_numpy() for column in ['variant'] + self.strata_columns], shape)
+            n_groups = int(np.prod(shape))
+        wage_difference = rows['wage_difference'].to_numpy()
+        Q1, Q3 = grouped_quantiles(wage_difference, groups, n_groups, [0.25, 0.75]).T
+        IQR = Q3 - Q1
+        lower_bound = (Q1 - 1.5 * IQR)[groups]
+        upper_bound = (Q3 + 1.5 * IQR)[groups]
+        rows = filter_rows(rows, 'AcceptanceCube', {
+            'wage_difference >= lower_bound': wage_difference >= lower_bound,
+            'wage_difference <= upper_bound': wage_difference <= upper_bound,
+        }).reset_index(drop=True)
+        rows['bin'] = bin_codes(rows['wage_difference'].to_numpy(), self.edges, right)
+        self.rows = rows
+
+        # One count of the finest cells, then the rollups: index -1 of a stratum axis is its margin
+        in_bin = rows['bin'].to_numpy() >= 0
+        cells = np.ravel_multi_index([rows[column].to_numpy()[in_bin] for column in ['variant'] + self.strata_columns + ['bin']],
+                                     shape + [n_bins])
+        size = int(np.prod(shape)) * n_bins
+        sums = {
+            'total_count': np.bincount(cells, minlength=size),
+            'accept_count': np.bincount(cells, weights=rows['acceptance_yn'].to_numpy()[in_bin], minlength=size),
+            'wage_difference_sum': np.bincount(cells, weights=rows['wage_difference'].to_numpy()[in_bin], minlength=size),
+            'offered_wage_sum': np.bincount(cells, weights=rows['offered_wage'].to_numpy()[in_bin], minlength=size),
+        }
+        self.sums = {}
+        for name, cube in sums.items():
+            cube = cube.reshape(shape + [n_bins])
+            for axis in range(1, len(shape)):
+                cube = np.concatenate([cube, cube.sum(axis=axis, keepdims=True)], axis=axis)
+            self.sums[name] = cube
+
+    def stratum_index(self, stratum):
+        # Cube index of a stratum {column: value}; columns left out (or given as MARGIN) are rolled up
+        unknown = set(stratum) - set(self.strata_columns)
+        if unknown:
+            raise ValueError(f"Unknown strata columns: {sorted(unknown)}. Valid options are {self.strata_columns}")
+        index = []
+        for column in self.strata_columns:
+            value = stratum.get(column, MARGIN)
+            if value == MARGIN:
+                index.append(-1)
+            elif value in self.values[column]:
+                index.append(self.values[column].index(value))
+            else:
+                raise ValueError(f"Invalid {column}: {value}. Valid options are {self.values[column]}")
+        return tuple(index)
+
+    def slice(self, variant, **stratum):
+        # Binned acceptance of one variant and stratum, one row per bin
+        index = (self.variants.index(variant),) + self.stratum_index(stratum)
+        total_count, accept_count, wage_difference_sum, offered_wage_sum = (
+            self.sums[name][index] for name in ['total_count', 'accept_count', 'wage_difference_sum', 'offered_wage_sum'])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return pd.DataFrame({
+                'bin': self.labels,
+                'total_count': total_count,
+                'accept_count': accept_count.astype(np.int64),
+                'mean_wage_difference': wage_difference_sum / total_count,
+                'mean_offered_wage': offered_wage_sum / total_count,
+                'acceptance_ratio': accept_count / total_count,
+            })
+
+    def table(self, variant):
+        # Long table of every stratum of a variant, margins included, one row per (stratum, bin)
+        tables = []
+        for index in np.ndindex(*[len(self.values[column]) + 1 for column in self.strata_columns]):
+            stratum = {column: self.values[column][i] if i < len(self.values[column]) else MARGIN
+                       for column, i in zip(self.strata_columns, index)}
+            tables.append(self.slice(variant, **stratum).assign(**stratum))
+        table = pd.concat(tables, ignore_index=True)
+        return table[self.strata_columns + ['bin'] + CUBE_COLUMNS]
+
+    def stratum_rows(self, variant, **stratum):
+        # The outlier-filtered rows of one variant and stratum (e.g. for bootstrap bands), in their stacked order
+        index = self.stratum_index(stratum)
+        mask = self.rows['variant'].to_numpy() == self.variants.index(variant)
+        for column, i in zip(self.strata_columns, index):
+            if i >= 0:
+                mask &= self.rows[column].to_numpy() == i
+        return self.rows[mask]
@@ -0,0 +1,197 @@
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+RESULT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'result')
+COEFFICIENTS_FILE_NAME = 'coefficients.csv'
+
+# Subgroups fitted for every variant: all rows, then every value (combination) of these columns.
+# Columns a dataset does not have are skipped for it (e.g. NJUI has no race or sex in the weekly tables).
+SUBGROUP_COLUMNS = [(), ('sample_race',), ('sample_sex',), ('sample_race', 'sample_sex')]
+# Rows of each side of a zero wage difference; the kinked model uses both sides together
+SIDES = ['negative', 'positive', 'both']
+# model -> (terms, sides it is fitted on)
+MODELS = {
+    'lpm': (['const', 'wage_difference'], ['negative', 'positive']),
+    'logit': (['const', 'wage_difference'], ['negative', 'positive']),
+    'kinked': (['const', 'wage_difference', 'wage_difference_above_zero'], ['both']),  # Slope changes at zero
+}
+COEFFICIENT_COLUMNS = ['variant', 'subgroup', 'side', 'model', 'term', 'estimate', 'std_error', 'z_value', 'p_value',
+                       'n_obs', 'n_clusters', 'converged']
+LOGIT_MAX_ITERATIONS = 50
+LOGIT_TOLERANCE = 1e-10
+
+
+def load_variants():
+    # Outlier-filtered preprocessed tables of both datasets: variant name -> (frame, case id column)
+    from job_offer import data_visualization as nlsy79
+    from NJUI import data_visualization as njui
+
+    variants = {}
+    for file_name in nlsy79.FILE_NAMES:
+        df = nlsy79.process_outliers(os.path.join(nlsy79.DATA_DIR, file_name))
+        variants[f'nlsy79/{os.path.splitext(file_name)[0]}'] = (df, 'case_id')
+    for file_name in njui.FILE_NAMES:
+        df = njui.process_outliers(os.path.join(njui.DATA_DIR, file_name))
+        variants[f'njui/{os.path.splitext(file_name)[0]}'] = (df, 'caseid')
+    return variants
+
+
+def stack_cells(variants, subgroup_columns=SUBGROUP_COLUMNS):
+    # One stacked set of rows for every (variant, subgroup, side) cell; a row appears once in every cell it belongs to.
+    # Returns the stacked wage differences, acceptance, cell of every row, cluster (case within cell) of every row
+    # and the cell table.
+    x, y, cells, cases, cell_rows = [], [], [], [], []
+    for variant, (df, case_column) in variants.items():
+        wage_difference = df['wage_difference'].to_numpy(dtype=float)
+        accepted = df['acceptance_yn'].to_numpy(dtype=float)
+        case_codes = pd.factorize(df[case_column])[0]
+        side_masks = {'negative': wage_difference < 0, 'positive': wage_difference > 0, 'both': np.ones(len(df), dtype=bool)}
+
+        for columns in subgroup_columns:
+            if not set(columns) <= set(df.columns):
+                continue
+            if columns:
+                # Codes are integers, even in tables where they were saved as floats
+                subgroup_codes, subgroups = pd.factorize(pd.MultiIndex.from_frame(df[list(columns)].astype('Int64')))
+            else:
+                subgroup_codes, subgroups = np.zeros(len(df), dtype=np.int64), [()]
+            for code, values in enumerate(subgroups):
+                values = values if isinstance(values, tuple) else (values,)
+                subgroup = ', '.join(f'{column}={value}' for column, value in zip(columns, values)) or 'all'
+                for side in SIDES:
+                    rows = np.flatnonzero((subgroup_codes == code) & side_masks[side])
+                    x.append(wage_difference[rows])
+                    y.append(accepted[rows])
+                    cases.append(case_codes[rows])
+                    cells.append(np.full(len(rows), len(cell_rows)))
+                    cell_rows.append((variant, subgroup, side))
+
+    cells = np.concatenate(cells)
+    cases = np.concatenate(cases)
+    # Clusters are cases within a cell, numbered over all cells
+    clusters = pd.factorize(cells.astype(np.int64) * (cases.max(initial=0) + 1) + cases)[0]
+    cell_table = pd.DataFrame(cell_rows, columns=['variant', 'subgroup', 'side'])
+    return np.concatenate(x), np.concatenate(y), cells, clusters, cell_table
+
+
+def design_matrix(x, terms):
+    columns = {'const': np.ones(len(x)), 'wage_difference': x, 'wage_difference_above_zero': np.maximum(x, 0)}
+    return np.column_stack([columns[term] for term in terms])
+
+
+def cross_products(a, b, groups, n_groups):
+    # Per-group a'b for row-stacked a (n x p) and b (n x q) with one bincount per column pair: (n_groups, p, q)
+    result = np.empty((n_groups, a.shape[1], b.shape[1]))
+    for i in range(a.shape[1]):
+        for j in range(b.shape[1]):
+            result[:, i, j] = np.bincount(groups, weights=a[:, i] * b[:, j], minlength=n_groups)
+    return result
+
+
+def batched_inverse(matrices):
+    # Inverse of every full-rank matrix; NaN for cells that cannot be estimated (too few rows or no variation in x)
+    full_rank = np.linalg.matrix_rank(matrices) == matrices.shape[-1]
+    inverses = np.full(matrices.shape, np.nan)
+    if full_rank.any():
+        inverses[full_rank] = np.linalg.inv(matrices[full_rank])
+    return inverses
+
+
+def sandwich_covariance(X, scores, bread, cells, n_cells, clusters):
+    # Cluster-robust covariance bread (sum_g s_g s_g') bread, with the CR1 small-sample factor of statsmodels and Stata
+    n_clusters_total = clusters.max(initial=-1) + 1
+    cluster_scores = np.column_stack([np.bincount(clusters, weights=scores[:, i], minlength=n_clusters_total)
+                                      for i in range(scores.shape[1])])
+    cluster_cells = np.zeros(n_clusters_total, dtype=np.int64)
+    cluster_cells[clusters] = cells
+    meat = cross_products(cluster_scores, cluster_scores, cluster_cells, n_cells)
+
+    n_obs = np.bincount(cells, minlength=n_cells)
+    n_clusters = np.bincount(cluster_cells, minlength=n_cells)
+    k = X.shape[1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        correction = n_clusters / (n_clusters - 1) * (n_obs - 1) / (n_obs - k)
+    return bread @ meat @ bread * correction[:, None, None], n_obs, n_clusters
+
+
+def fit_linear(X, y, cells, n_cells, clusters):
+    # Least squares of every cell at once from the per-cell sufficient statistics X'X and X'y
+    bread = batched_inverse(cross_products(X, X, cells, n_cells))
+    params = (bread @ cross_products(X, y[:, None], cells, n_cells))[:, :, 0]
+    residuals = y - (X * params[cells]).sum(axis=1)
+    cov, n_obs, n_clusters = sandwich_covariance(X, X * residuals[:, None], bread, cells, n_cells, clusters)
+    return params, cov, n_obs, n_clusters, np.isfinite(params).all(axis=1)
+
+
+def fit_logit(X, y, cells, n_cells, clusters):
+    # Newton-Raphson for every cell at once; a cell stops updating once its step is below LOGIT_TOLERANCE.
+    # Cells that do not converge (e.g. perfect separation) are reported with converged=False.
+    params = np.zeros((n_cells, X.shape[1]))
+    converged = np.zeros(n_cells, dtype=bool)
+    for _ in range(LOGIT_MAX_ITERATIONS):
+        probabilities = 1 / (1 + np.exp(-(X * params[cells]).sum(axis=1)))
+        hessian_inverse = batched_inverse(cross_products(X, X * (probabilities * (1 - probabilities))[:, None], cells, n_cells))
+        gradient = cross_products(X, (y - probabilities)[:, None], cells, n_cells)
+        step = (hessian_inverse @ gradient)[:, :, 0]
+        step[converged] = 0
+        params += np.nan_to_num(step)
+        converged |= np.abs(step).max(axis=1) < LOGIT_TOLERANCE
+        if converged.all():
+            break
+
+    probabilities = 1 / (1 + np.exp(-(X * params[cells]).sum(axis=1)))
+    hessian_inverse = batched_inverse(cross_products(X, X * (probabilities * (1 - probabilities))[:, None], cells, n_cells))
+    cov, n_obs, n_clusters = sandwich_covariance(X, X * (y - probabilities)[:, None], hessian_inverse, cells, n_cells, clusters)
+    params[~np.isfinite(hessian_inverse).all(axis=(1, 2))] = np.nan
+    return params, cov, n_obs, n_clusters, converged
+
+
+def estimate_models(x, y, cells, clusters, cell_table, models=MODELS):
+    # Tidy coefficient table: one row per (variant, subgroup, side, model, term)
+    tables = []
+    for model, (terms, sides) in models.items():
+        # Cells of the model's sides, renumbered so the batched fit only sees them
+        model_cells = np.flatnonzero(cell_table['side'].isin(sides))
+        cell_numbers = np.full(len(cell_table), -1)
+        cell_numbers[model_cells] = np.arange(len(model_cells))
+        rows = cell_numbers[cells] >= 0
+        model_clusters = pd.factorize(clusters[rows])[0]
+
+        fit = fit_logit if model == 'logit' else fit_linear
+        params, cov, n_obs, n_clusters, converged = fit(design_matrix(x[rows], terms), y[rows], cell_numbers[cells][rows],
+                                                        len(model_cells), model_clusters)
+        with np.errstate(invalid='ignore'):
+            std_errors = np.sqrt(np.diagonal(cov, axis1=1, axis2=2))
+
+        table = cell_table.iloc[np.repeat(model_cells, len(terms))].reset_index(drop=True)
+        table['model'] = model
+        table['term'] = np.tile(terms, len(model_cells))
+        table['estimate'] = params.ravel()
+        table['std_error'] = std_errors.ravel()
+        table['n_obs'] = np.repeat(n_obs, len(terms))
+        table['n_clusters'] = np.repeat(n_clusters, len(terms))
+        table['converged'] = np.repeat(converged, len(terms))
+        tables.append(table)
+
+    coefficients = pd.concat(tables, ignore_index=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        coefficients['z_value'] = coefficients['estimate'] / coefficients['std_error']
+    coefficients['p_value'] = [math.erfc(abs(z) / math.sqrt(2)) for z in coefficients['z_value']]
+    return coefficients[COEFFICIENT_COLUMNS]
+
+
+def main(result_folder=RESULT_DIR):
+    if not os.path.exists(result_folder):
+        os.makedirs(result_folder)
+
+    coefficients = estimate_models(*stack_cells(load_variants()))
+    output_filename = os.path.join(result_folder, COEFFICIENTS_FILE_NAME)
+    coefficients.to_csv(output_filename, index=False)
+    print(f"Saved {len(coefficients)} coefficients of {coefficients.groupby(['variant', 'subgroup', 'side', 'model']).ngroups} fits to '{output_filename}'")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import json
+import resource
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+
+import numpy as np
+import pandas as pd
+
+# Recorder of the running pipeline; None while instrumentation is off (the default), so an instrumented stage
+# only costs one check
+_recorder = None
+
+
+# Collects one record per stage call (wall and CPU time, rows in and out, memory) and one per filter predicate
+# (rows dropped). Records are kept in memory and, with a path, appended to a JSON lines file as they happen.
+class Recorder:
+    def __init__(self, path=None, trace_memory=False):
+        self.path = path
+        self.trace_memory = trace_memory
+        self.records = []
+        self.peaks = []  # Traced memory peaks of the stages currently running, outermost first
+
+    def emit(self, record):
+        self.records.append(record)
+        if self.path:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record, default=str) + '\n')
+
+    def summary(self):
+        # Stage totals and rows dropped by every filter predicate, as printable tables
+        records = pd.DataFrame(self.records, columns=['event', 'stage', 'predicate', 'wall_seconds', 'cpu_seconds',
+                                                      'rows_in', 'rows_out', 'rows_dropped'])
+        records[['rows_in', 'rows_out', 'rows_dropped']] = records[['rows_in', 'rows_out', 'rows_dropped']].astype('Int64')
+        stages = records[records['event'] == 'stage'].groupby('stage', sort=False).agg(
+            calls=('stage', 'size'), wall_seconds=('wall_seconds', 'sum'), cpu_seconds=('cpu_seconds', 'sum'),
+            rows_in=('rows_in', lambda rows: rows.sum(min_count=1)), rows_out=('rows_out', lambda rows: rows.sum(min_count=1)))
+        filters = records[records['event'] == 'filter'].groupby(['stage', 'predicate'], sort=False)['rows_dropped'].sum()
+        return stages, filters
+
+
+def enable(path=None, trace_memory=False):
+    # Start recording stages; trace_memory also measures each stage's peak Python/NumPy allocations (slower)
+    global _recorder
+    _recorder = Recorder(path, trace_memory)
+    if trace_memory:
+        tracemalloc.start()
+    return _recorder
+
+
+def disable():
+    global _recorder
+    recorder, _recorder = _recorder, None
+    if recorder is not None and recorder.trace_memory:
+        tracemalloc.stop()
+    return recorder
+
+
+@contextmanager
+def recorded_filters():
+    # Collects the filter records emitted inside the block into the yielded list (filled when the block ends), also
+    # while instrumentation is off, e.g. to keep the drops of a reader with its cached result
+    global _recorder
+    recorder = _recorder
+    if recorder is None:
+        _recorder = Recorder()
+    start = len(_recorder.records)
+    filters = []
+    try:
+        yield filters
+    finally:
+        filters.extend(record for record in _recorder.records[start:] if record['event'] == 'filter')
+        if recorder is None:
+            _recorder = None
+
+
+def replay_filters(filters):
+    # Emit filter records kept from an earlier run (e.g. those of a result loaded from the cache), marked as cached
+    if _recorder is not None:
+        for record in filters:
+            _recorder.emit(dict(record, cached=True))
+
+
+def row_count(data):
+    if isinstance(data, tuple) and data:
+        data = data[0]
+    return len(data) if isinstance(data, (pd.DataFrame, pd.Series)) else None
+
+
+def stage(function):
+    # Decorator recording every call of a pipeline stage while instrumentation is on
+    @wraps(function)
+    def instrumented(*args, **kwargs):
+        recorder = _recorder
+        if recorder is None:
+            return function(*args, **kwargs)
+
+        if recorder.trace_memory:
+            # A nested stage resets the peak, so the running stages keep the highest peak seen so far
+            if recorder.peaks:
+                recorder.peaks[-1] = max(recorder.peaks[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            recorder.peaks.append(0)
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            output = function(*args, **kwargs)
+        finally:
+            wall_seconds, cpu_seconds = time.perf_counter() - wall_start, time.process_time() - cpu_start
+            peak = None
+            if recorder.trace_memory:
+                peak = max(recorder.peaks.pop(), tracemalloc.get_traced_memory()[1])
+                if recorder.peaks:
+                    recorder.peaks[-1] = max(recorder.peaks[-1], peak)
+
+        recorder.emit({
+            'event': 'stage', 'stage': function.__name__, 'wall_seconds': wall_seconds, 'cpu_seconds': cpu_seconds,
+            'rows_in': row_count(args[0]) if args else None, 'rows_out': row_count(output),
+            'peak_traced_bytes': peak, 'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        })
+        return output
+    return instrumented
+
+
+def filter_rows(df, stage_name, predicates):
+    # Rows of df passing every predicate (name -> boolean mask; missing values fail). While instrumentation is on,
+    # the rows each predicate drops from the rows kept by the predicates before it are recorded.
+    keep = np.ones(len(df), dtype=bool)
+    for predicate, mask in predicates.items():
+        mask = mask.fillna(False).to_numpy(dtype=bool) if isinstance(mask, pd.Series) else np.asarray(mask, dtype=bool)
+        if _recorder is not None:
+            _recorder.emit({'event': 'filter', 'stage': stage_name, 'predicate': predicate,
+                            'rows_in': int(keep.sum()), 'rows_dropped': int((keep & ~mask).sum())})
+        keep &= mask
+    return df[keep]
+
+
+def print_summary(recorder):
+    stages, filters = recorder.summary()
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(stages.to_string(float_format='{:.4f}'.format))
+        if len(filters):
+            print(filters.to_string())
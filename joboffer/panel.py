@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+
+# Rows of a case panel put in (case, time keys...) order once. The rows of each case then form one contiguous
+# segment, described by offsets into the sorted rows, so lags, first-row masks, per-case counts and per-case
+# masks are array operations over the segments instead of hash groupbys.
+# Methods take and return values in panel order; sort() and unsort() convert from and to the input row order.
+class Panel:
+    def __init__(self, case_ids, *time_keys):
+        case_ids = np.asarray(case_ids)
+        if not time_keys and np.all(case_ids[1:] >= case_ids[:-1]):
+            # Rows are already grouped by case (e.g. they come from an earlier panel stage): no sort needed
+            self.order = None
+        else:
+            # np.lexsort sorts by the last key first and keeps the input order of ties, like sort_values
+            keys = [np.asarray(key) for key in reversed(time_keys)]
+            self.order = np.lexsort(keys + [case_ids])
+
+        sorted_ids = self.sort(case_ids)
+        boundaries = np.flatnonzero(sorted_ids[1:] != sorted_ids[:-1]) + 1
+        self.offsets = np.concatenate([[0], boundaries, [len(sorted_ids)]]).astype(np.int64)
+        if len(sorted_ids) == 0:
+            self.offsets = np.zeros(1, dtype=np.int64)
+        self.case_ids = sorted_ids[self.offsets[:-1]].astype(np.int32)
+        self.sizes = np.diff(self.offsets)
+        self.segments = np.repeat(np.arange(len(self.case_ids), dtype=np.int32), self.sizes)
+
+    def sort(self, data):
+        # Put a frame, series or array in panel order
+        if self.order is None:
+            return data
+        return data.iloc[self.order] if isinstance(data, (pd.DataFrame, pd.Series)) else np.asarray(data)[self.order]
+
+    def unsort(self, values):
+        # Put an array in panel order back in the input row order
+        if self.order is None:
+            return values
+        unsorted = np.empty_like(values)
+        unsorted[self.order] = values
+        return unsorted
+
+    def first_rows(self):
+        first = np.zeros(self.offsets[-1], dtype=bool)
+        first[self.offsets[:-1]] = True
+        return first
+
+    def lag(self, values):
+        # Value of the previous row of the same case; missing on the first row of each case
+        values = pd.Series(values)
+        return values.shift().mask(self.first_rows())
+
+    def count(self, mask):
+        # Number of True rows per case
+        return np.bincount(self.segments, weights=np.asarray(mask, dtype=bool), minlength=len(self.case_ids)).astype(np.int64)
+
+    def broadcast(self, per_case):
+        # Repeat one value per case over the rows of the case
+        return np.repeat(np.asarray(per_case), self.sizes)
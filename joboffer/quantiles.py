@@ -0,0 +1,90 @@
+import numpy as np
+
+SKETCH_SIZE = 1024  # Values kept by the lowest sketch level; smaller inputs are summarized exactly
+SKETCH_SEED = 0
+
+
+# Mergeable quantile sketch (KLL compactors). Values are added chunk by chunk, and sketches of separate chunks or
+# partitions can be merged, so quantiles and ranks of a whole file come from one pass over it in bounded memory.
+# Level h keeps values that each stand for 2**h input values; a full level is sorted and every second value
+# moves up one level. Until the lowest level fills up the sketch holds every value and its answers are exact.
+class QuantileSketch:
+    def __init__(self, size=SKETCH_SIZE, seed=SKETCH_SEED):
+        self.size = size
+        self.rng = np.random.default_rng(seed)
+        self.levels = [np.empty(0)]
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        # Missing and infinite values (e.g. log of a zero wage) are not counted
+        values = np.asarray(values, dtype=float)
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return self
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.count += len(values)
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.compress()
+        return self
+
+    def merge(self, other):
+        # Adds the values summarized by another sketch; levels of the same weight are joined, then compacted
+        for level, values in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[level] = np.concatenate([self.levels[level], values])
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.compress()
+        return self
+
+    def capacity(self, level):
+        # Lower levels get geometrically smaller capacities, as in KLL
+        return max(2, int(self.size * (2 / 3) ** (len(self.levels) - 1 - level)))
+
+    def compress(self):
+        level = 0
+        while level < len(self.levels):
+            values = self.levels[level]
+            if len(values) > self.capacity(level):
+                values = np.sort(values)
+                # An odd value stays on its level; a random offset keeps the rank error unbiased
+                kept, values = values[:len(values) % 2], values[len(values) % 2:]
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], values[self.rng.integers(2)::2]])
+                self.levels[level] = kept
+            level += 1
+
+    def weighted_values(self):
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(values), 2 ** level) for level, values in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        return values[order], weights[order]
+
+    def rank(self, x, inclusive=False):
+        # Number of values below x (at or below x if inclusive)
+        values, weights = self.weighted_values()
+        position = np.searchsorted(values, x, side='right' if inclusive else 'left')
+        cumulative = np.concatenate([[0], np.cumsum(weights)])
+        # Compaction changes the total weight by a little; scale it back to the true count
+        return cumulative[position] * self.count / max(cumulative[-1], 1)
+
+    def value_at_rank(self, rank):
+        # Value at a (fractional) 0-based rank in sorted order, interpolating linearly like pandas quantile
+        values, weights = self.weighted_values()
+        if len(values) == 0:
+            return np.full(np.shape(rank), np.nan)
+        cumulative = np.cumsum(weights) * self.count / weights.sum()
+        centers = cumulative - (weights * self.count / weights.sum() + 1) / 2
+        # The exact minimum and maximum anchor the first and last rank
+        centers = np.concatenate([[0], centers.clip(0, self.count - 1), [self.count - 1]])
+        values = np.concatenate([[self.min], values, [self.max]])
+        return np.interp(rank, centers, values)
+
+    def quantile(self, q):
+        return self.value_at_rank(np.asarray(q, dtype=float) * (self.count - 1))
@@ -0,0 +1,153 @@
+import json
+import math
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+from joboffer.estimation import SUBGROUP_COLUMNS, load_variants
+
+QUERY_HOST = '127.0.0.1'  # Only served to this machine
+QUERY_PORT = 8765
+RANGE_COLUMNS = ['lower', 'upper', 'total_count', 'accept_count', 'acceptance_ratio']
+
+
+# Acceptance counts of any wage difference range, for every variant and subgroup. The rows of each subgroup are
+# sorted by wage difference once and kept with their cumulative accept counts, so a range is counted with two
+# binary searches instead of a pass over the rows.
+class AcceptanceIndex:
+    def __init__(self, variants, subgroup_columns=SUBGROUP_COLUMNS):
+        # variants: variant name -> (outlier-filtered frame, case id column), as given by load_variants
+        self.subgroup_columns = subgroup_columns
+        self.curves = {}  # (variant, subgroup columns, subgroup values) -> (sorted wage differences, cumulative accepts)
+        self.subgroups = {}  # variant -> {subgroup column: values}
+        for variant, (df, _) in variants.items():
+            order = np.argsort(df['wage_difference'].to_numpy(dtype=float), kind='stable')
+            df = df.iloc[order]
+            wage_difference = df['wage_difference'].to_numpy(dtype=float)
+            accepted = df['acceptance_yn'].to_numpy(dtype=bool)
+            self.subgroups[variant] = {}
+            for columns in subgroup_columns:
+                if not set(columns) <= set(df.columns):
+                    continue
+                groups = df.groupby(list(columns)).indices if columns else {(): np.arange(len(df))}
+                for values, rows in groups.items():
+                    values = values if isinstance(values, tuple) else (values,)
+                    values = tuple(value.item() if hasattr(value, 'item') else value for value in values)
+                    cumulative_accepts = np.concatenate([[0], np.cumsum(accepted[rows])])
+                    self.curves[(variant, columns, values)] = (wage_difference[rows], cumulative_accepts)
+                for column in columns:
+                    self.subgroups[variant][column] = sorted(df[column].unique().tolist())
+
+    def describe(self):
+        # Variants with the subgroup columns and values they can be queried by
+        return {variant: {'rows': len(self.curves[(variant, (), ())][0]), 'subgroups': subgroups}
+                for variant, subgroups in self.subgroups.items()}
+
+    def curve(self, variant, subgroup=None):
+        subgroup = subgroup or {}
+        if variant not in self.subgroups:
+            raise ValueError(f"Unknown variant: {variant}")
+        columns = next((columns for columns in self.subgroup_columns if set(columns) == set(subgroup)), None)
+        if columns is None or not set(columns) <= set(self.subgroups[variant]):
+            raise ValueError(f"Variant {variant} has no subgroups by {sorted(subgroup)}")
+        # A subgroup value that has no rows gives an empty curve
+        return self.curves.get((variant, columns, tuple(subgroup[column] for column in columns)),
+                               (np.empty(0), np.zeros(1, dtype=np.int64)))
+
+    def acceptance_counts(self, variant, edges, subgroup=None, right=False):
+        # Total and accepted offers of the ranges between consecutive edges: [lower, upper), or (lower, upper]
+        # with right=True. Edges can be -inf and inf for open ranges; subgroup: {column: value}, e.g. {'sample_sex': 2}.
+        # Returns {column of RANGE_COLUMNS: array with one value per range}.
+        edges = np.asarray(edges, dtype=float)
+        if edges.ndim != 1 or len(edges) < 2 or (np.diff(edges) < 0).any():
+            raise ValueError("Edges must be at least two increasing values")
+        wage_difference, cumulative_accepts = self.curve(variant, subgroup)
+        positions = np.searchsorted(wage_difference, edges, side='right' if right else 'left')
+        total_count = np.diff(positions)
+        accept_count = np.diff(cumulative_accepts[positions])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            acceptance_ratio = accept_count / total_count
+        return {'lower': edges[:-1], 'upper': edges[1:], 'total_count': total_count, 'accept_count': accept_count,
+                'acceptance_ratio': acceptance_ratio}
+
+    def acceptance(self, variant, edges, subgroup=None, right=False):
+        # The ranges of acceptance_counts as a table
+        return pd.DataFrame(self.acceptance_counts(variant, edges, subgroup, right), columns=RANGE_COLUMNS)
+
+    def acceptance_range(self, variant, lower=-np.inf, upper=np.inf, subgroup=None, right=False):
+        # One range, as a dict of the acceptance columns
+        return range_records(self.acceptance_counts(variant, [lower, upper], subgroup, right))[0]
+
+
+def parse_value(text):
+    # Subgroup values are integer codes in both datasets; other values are kept as text
+    try:
+        return int(text)
+    except ValueError:
+        return text
+
+
+def range_records(counts):
+    # One dict of Python numbers per range; NaN ratios (empty ranges) become None, which is null in JSON
+    rows = zip(*[counts[column].tolist() for column in RANGE_COLUMNS])
+    return [{column: None if isinstance(value, float) and math.isnan(value) else value for column, value in zip(RANGE_COLUMNS, row)}
+            for row in rows]
+
+
+# GET /variants: the variants and their subgroups
+# GET /acceptance?variant=...&lower=-0.3&upper=-0.1[&right=1][&sample_sex=2]: one range (lower and upper default to
+# -inf and inf); use edges=-1,-0.5,0,0.5,1 instead of lower and upper for consecutive ranges
+class QueryHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        index = self.server.index
+        try:
+            if url.path == '/variants':
+                self.send_json(200, index.describe())
+            elif url.path == '/acceptance':
+                variant = params.pop('variant', None)
+                right = params.pop('right', '0').lower() in ('1', 'true')
+                if 'edges' in params:
+                    edges = [float(edge) for edge in params.pop('edges').split(',')]
+                else:
+                    edges = [float(params.pop('lower', '-inf')), float(params.pop('upper', 'inf'))]
+                subgroup = {column: parse_value(value) for column, value in params.items()}
+                self.send_json(200, range_records(index.acceptance_counts(variant, edges, subgroup, right)))
+            else:
+                self.send_json(404, {'error': f"Unknown path: {url.path}"})
+        except ValueError as error:
+            self.send_json(400, {'error': str(error)})
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_server(index, host=QUERY_HOST, port=QUERY_PORT):
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.index = index
+    return server
+
+
+def main(port=QUERY_PORT):
+    # The preprocessed tables are loaded and indexed once, then every query is answered from the index
+    index = AcceptanceIndex(load_variants())
+    server = make_server(index, port=port)
+    print(f"Serving acceptance queries of {len(index.subgroups)} variants on http://{QUERY_HOST}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+# Inputs shared by every variant of a run, set once in each worker process
+_shared = {}
+
+
+def use_offscreen_backend():
+    # Figures are only saved to files, never shown, so no window system is needed
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def init_worker(shared):
+    global _shared
+    _shared = shared
+    use_offscreen_backend()
+
+
+def run_shared(function, variant):
+    return function(variant, **_shared)
+
+
+def run_variants(function, variants, shared=None, processes=None):
+    # Call function(variant, **shared) for every variant and return the results in the order of variants.
+    # Variants run in a pool of processes (one per variant, up to the number of cores by default); each worker
+    # gets the shared inputs once when it starts. processes=1 runs them one after another in this process.
+    # function must be defined at module level so the workers can import it.
+    variants = list(variants)
+    shared = shared or {}
+    if processes is None:
+        processes = min(len(variants), os.cpu_count() or 1)
+
+    if processes <= 1:
+        init_worker(shared)
+        return [run_shared(function, variant) for variant in variants]
+    with ProcessPoolExecutor(processes, initializer=init_worker, initargs=(shared,)) as pool:
+        return list(pool.map(partial(run_shared, function), variants))
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+# Dtypes of the tables handed between the stages of both pipelines. Ids are int32, survey codes small ints
+# (nullable where the survey has missing answers) or categoricals, and acceptance is a bool. Wages and hours stay
+# float64: in float32 the log wage ratios move enough to put offers on the other side of a bin edge.
+SCHEMAS = {
+    # Final NLSY79 table of create_final_data, an accepted and a rejected offer per respondent
+    'nlsy79_offers': {
+        'case_id': 'int32', 'sample_id': 'int8', 'sample_race': 'int8', 'sample_sex': 'int8',
+        'offered_wage': 'float64', 'previous_wage': 'float64', 'acceptance_yn': 'bool',
+    },
+    # Renamed NJUI weekly rows of read_weekly_data (offers and reservation history)
+    'njui_weekly': {
+        'caseid': 'int32', 'curweek': 'int8', 'curyear': 'int16',
+        'how_many_hours_prefer_to_work_weekly': 'float64', 'reservation_wage': 'float64', 'reservation_unit': 'category',
+        'received_job_offers': 'category', 'how_many_job_offers': 'Int8',
+        'job_offer_wage': 'float64', 'job_offer_unit': 'category', 'weekly_working_hour': 'float64',
+        'acceptance_yn': 'category', 'reject_reason': 'category',
+        'accepted_job_wage': 'float64', 'accepted_job_unit': 'category', 'accepted_weekly_working_hour': 'float64',
+    },
+    # Final NJUI table of transform_acceptance, one row per weekly offer
+    'njui_offers': {
+        'caseid': 'int32', 'curweek': 'int8', 'curyear': 'int16', 'received_job_offers': 'category',
+        'how_many_job_offers': 'Int8', 'offered_wage': 'float64', 'previous_wage': 'float64', 'acceptance_yn': 'bool',
+    },
+}
+ACCEPTANCE_LABELS = {True: 'y', False: 'n'}  # How bool columns are written in the CSV files
+
+
+def enforce(df, table):
+    # Cast the columns of df to the schema of table; columns outside the schema are kept as they are.
+    # Raises ValueError when a value does not fit its dtype (a missing id, a code out of range, an unknown label).
+    dtypes = {column: pd.api.types.pandas_dtype(dtype) for column, dtype in SCHEMAS[table].items()
+              if column in df.columns and df[column].dtype != dtype}
+    if not dtypes:
+        return df
+
+    columns = {}
+    for column, dtype in dtypes.items():
+        values = df[column]
+        if dtype == bool and not pd.api.types.is_numeric_dtype(values.dtype):
+            values = values.map({label: flag for flag, label in ACCEPTANCE_LABELS.items()}).astype(object)
+            if values.isna().any():
+                raise ValueError(f"Column '{column}' of {table} has values other than {list(ACCEPTANCE_LABELS.values())}")
+        elif dtype.kind in 'iu' and len(values):
+            # Integer casts wrap around silently; check the range and that nothing is cut off
+            numbers = values.dropna().to_numpy(dtype=float)
+            info = np.iinfo(getattr(dtype, 'numpy_dtype', dtype))
+            if len(numbers) and (numbers.min() < info.min or numbers.max() > info.max or (numbers % 1).any()):
+                raise ValueError(f"Column '{column}' of {table} does not fit {dtype}")
+        columns[column] = values.astype(dtype)
+    return df.assign(**columns)
+
+
+def csv_dtypes(table):
+    # read_csv dtypes of the columns of table; bool columns are read as labels and converted by enforce
+    return {column: 'category' if dtype == 'bool' else dtype for column, dtype in SCHEMAS[table].items()}
+
+
+def read_table(file_path, table, **read_kwargs):
+    # Parse a CSV written by write_table straight into the dtypes of table
+    return enforce(pd.read_csv(file_path, dtype=csv_dtypes(table), **read_kwargs), table)
+
+
+def write_table(df, file_path, table):
+    # Save df as CSV in the dtypes of table, with bool columns written as their labels
+    df = enforce(df, table)
+    labels = {column: np.where(df[column], ACCEPTANCE_LABELS[True], ACCEPTANCE_LABELS[False])
+              for column, dtype in SCHEMAS[table].items() if dtype == 'bool' and column in df.columns}
+    df.assign(**labels).to_csv(file_path, index=False)
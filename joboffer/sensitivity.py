@@ -0,0 +1,60 @@
+import itertools
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from joboffer.binning import ZERO_BIN_LABEL, bin_codes, bin_labels
+
+SENSITIVITY_FILE_NAME = 'sensitivity_sweep.csv'
+
+
+def assumption_grid(grid):
+    # Every combination of the assumption values: grid maps an assumption name to the values to try
+    return pd.DataFrame(list(itertools.product(*grid.values())), columns=list(grid))
+
+
+def outlier_mask(wage_difference):
+    # The 1.5 IQR filter of process_outliers applied to every grid point (row) at once; missing values are dropped
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # A grid point can have no valid row
+        Q1, Q3 = np.nanquantile(wage_difference, [0.25, 0.75], axis=1)
+    IQR = Q3 - Q1
+    lower_bound = (Q1 - 1.5 * IQR)[:, None]
+    upper_bound = (Q3 + 1.5 * IQR)[:, None]
+    return (wage_difference >= lower_bound) & (wage_difference <= upper_bound)
+
+
+def sweep_acceptance(points, variant, wage_difference, accepted, edges, right=True, include_lowest=False, zero_bin=False):
+    # Long table of the binned acceptance of every grid point (rows of points) for one variant.
+    # wage_difference: (grid points, rows) log wage differences; accepted: boolean per row.
+    # Outlier filtering, binning and counting are array operations over the whole grid.
+    n_points, n_rows = wage_difference.shape
+    kept = outlier_mask(wage_difference)
+    codes = bin_codes(wage_difference, edges, right, include_lowest)
+    n_bins = len(edges) - 1
+    if zero_bin:
+        codes[wage_difference == 0] = n_bins
+        n_bins += 1
+    codes[~kept] = -1
+
+    in_bin = codes >= 0
+    cells = (np.arange(n_points)[:, None] * n_bins + codes)[in_bin]
+    total_count = np.bincount(cells, minlength=n_points * n_bins)
+    accept_count = np.bincount(cells, weights=np.broadcast_to(accepted, codes.shape)[in_bin], minlength=n_points * n_bins)
+    value_sum = np.bincount(cells, weights=wage_difference[in_bin], minlength=n_points * n_bins)
+
+    labels = [str(label) for label in bin_labels(edges, right, include_lowest)] + ([ZERO_BIN_LABEL] if zero_bin else [])
+    table = points.iloc[np.repeat(np.arange(n_points), n_bins)].reset_index(drop=True)
+    table['variant'] = variant
+    table['rows_kept'] = np.repeat(kept.sum(axis=1), n_bins)
+    table['bin'] = np.tile(labels, n_points)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        table['avg_wage_difference'] = value_sum / total_count
+        table['total_count'] = total_count
+        table['accept_count'] = accept_count.astype(np.int64)
+        table['acceptance_ratio'] = accept_count / total_count
+    if zero_bin:
+        # As in the grouped tables, the zero bin is left out of grid points where no offer has a zero wage difference
+        table = table[(table['bin'] != ZERO_BIN_LABEL) | (table['total_count'] > 0)].reset_index(drop=True)
+    return table
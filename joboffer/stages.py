@@ -0,0 +1,33 @@
+import itertools
+
+
+# Runs chains of pipeline stages and keeps every stage output, keyed by the stages that produced it.
+# A stage is either a function called as function(data) or a (function, option) pair called as
+# function(data, option). Stages must return new frames instead of changing their input in place,
+# because the same output is handed to every downstream combination.
+class StageGraph:
+    def __init__(self, source):
+        self.source = source
+        self.outputs = {}
+
+    def run(self, stages):
+        data = self.source
+        key = ()
+        for stage in stages:
+            function, option = stage if isinstance(stage, tuple) else (stage, None)
+            key = key + ((function, option),)
+            if key not in self.outputs:
+                self.outputs[key] = function(data) if option is None else function(data, option)
+            data = self.outputs[key]
+        return data
+
+    def fan_out(self, stage_options):
+        # stage_options: functions without options, or (function, list of options) pairs.
+        # Yields (chosen options, final output) for every combination; a stage output is computed
+        # once per distinct upstream chain and shared by all combinations below it.
+        stage_options = [entry if isinstance(entry, tuple) else (entry, [None]) for entry in stage_options]
+        functions = [function for function, _ in stage_options]
+        has_options = [options != [None] for _, options in stage_options]
+        for options in itertools.product(*[options for _, options in stage_options]):
+            output = self.run(list(zip(functions, options)))
+            yield tuple(option for option, chosen in zip(options, has_options) if chosen), output
@@ -0,0 +1,147 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+# Rows of the synthetic inputs at scale 1: about the size of the checked-in NLSY79 extract and of a small NJUI wave
+NLSY79_RESPONDENTS = 12686
+NJUI_CASES = 2000
+NJUI_MAX_WEEKS = 12  # Weeks answered by a case are drawn from 1..NJUI_MAX_WEEKS
+
+# Messy unit labels of the NJUI weekly file: numeric codes, case and spacing variants, and units the pipeline
+# does not recognize ('Day')
+NJUI_UNIT_LABELS = ['Hour', 'hour', 4, 'Week', 'week', ' Week', 3, 'every two weeks', 'Every two week',
+                    'Month', 'month', 2, 'Year', 'year', 1, 'Day']
+# Hours paid by one wage of each unit label, to draw wages around the same hourly level
+NJUI_UNIT_HOURS = {'hour': 1, 'week': 40, 'every two weeks': 80, 'every two week': 80, 'month': 170, 'year': 2080, 'day': 8,
+                   4: 1, 3: 40, 2: 170, 1: 2080}
+
+
+def choice(rng, values, probabilities, size):
+    return rng.choice(np.asarray(values), size=size, p=np.asarray(probabilities) / np.sum(probabilities))
+
+
+def cents(rng, median, size, sigma=0.45):
+    # Wages in cents, log-normally spread around the median
+    return np.round(median * np.exp(rng.normal(0, sigma, size))).astype(np.int64)
+
+
+def missing_codes(rng, values, probabilities, size):
+    # Replace values by NLSY reserved codes: probabilities of (-4 valid skip, -3 invalid skip, -2 don't know, -1 refusal)
+    codes = choice(rng, [0, -4, -3, -2, -1], [1 - sum(probabilities)] + list(probabilities), size)
+    return np.where(codes == 0, values, codes)
+
+
+def synthetic_nlsy79(scale=1, seed=0):
+    # Raw NLSY79 extract with the reference number columns of the README codebook, as in raw_data.csv:
+    # integer answers with the negative reserved codes, and -5 on every answer of non-interviewed respondents.
+    # About 5% of the respondents pass filter_respondents, like the real extract.
+    rng = np.random.default_rng(seed)
+    n = round(NLSY79_RESPONDENTS * scale)
+    interviewed = rng.random(n) >= 0.044
+
+    looking_for_job = missing_codes(rng, choice(rng, [1, 0], [0.74, 0.26], n), [0.22, 0.005, 0.0002, 0.0004], n)
+    offered = (looking_for_job == 1) & (rng.random(n) < 0.3) | (rng.random(n) < 0.02)
+    any_offers = np.where(offered, 1, choice(rng, [0, -4, -3], [0.6, 0.39, 0.01], n))
+    num_offers = np.where(offered, choice(rng, [1, 2, 3, 4, 5], [0.55, 0.27, 0.08, 0.05, 0.05], n), -4)
+    time_unit = np.where(offered, choice(rng, [1, 6, 3, 5, 2, -2, -3], [0.6, 0.08, 0.08, 0.06, 0.02, 0.08, 0.08], n), -4)
+    unit_hours = np.select([time_unit == 2, time_unit == 3, time_unit == 5, time_unit == 6], [8, 40, 160, 2080], 1)
+    best_wage_rejected = np.where(time_unit > 0, cents(rng, 350, n) * unit_hours, time_unit)
+    working = rng.random(n) < 0.78
+    wage_1982 = missing_codes(rng, cents(rng, 350, n), [0.25, 0, 0, 0], n)
+
+    columns = {
+        'R0000100': np.arange(1, n + 1),
+        'R0173600': rng.integers(1, 21, n),
+        'R0214700': choice(rng, [1, 2, 3], [0.158, 0.25, 0.592], n),
+        'R0214800': choice(rng, [1, 2], [0.505, 0.495], n),
+        'R0263710': missing_codes(rng, cents(rng, 300, n), [0.52, 0, 0, 0], n),
+        'R0446810': missing_codes(rng, cents(rng, 330, n), [0.48, 0, 0, 0], n),
+        'R0702510': wage_1982,
+        'R0709400': missing_codes(rng, choice(rng, [0, 1], [0.72, 0.28], n), [0.22, 0.005, 0.0002, 0.0004], n),
+        'R0709500': looking_for_job,
+        'R0712100': any_offers,
+        'R0712200': num_offers,
+        'R0712300': best_wage_rejected,
+        'R0712400': time_unit,
+        'R0712500': np.where(offered, rng.integers(1, 13, n), -4),
+        'R0833200': np.where(working, rng.integers(1, 13, n), -4),
+        'R0833400': np.where(working, choice(rng, [81, 82, 80, 79], [0.87, 0.12, 0.005, 0.005], n), -4),
+        'R0840100': np.where(working, choice(rng, [1, 0], [0.97, 0.03], n), -4),
+        'R0841010': np.where(working, wage_1982, -4),
+        'R0854110': missing_codes(rng, cents(rng, 350, n), [0.82, 0, 0, 0], n),
+        'R0896711': missing_codes(rng, choice(rng, [1, 0], [0.61, 0.39], n), [0, 0.007, 0, 0], n),
+    }
+    raw = pd.DataFrame(columns)
+    raw.iloc[~interviewed, 4:] = -5
+    return raw
+
+
+def njui_unit_column(rng, size, missing=0.1):
+    labels = np.array(NJUI_UNIT_LABELS + [None], dtype=object)
+    probabilities = [0.2, 0.15, 0.05, 0.08, 0.05, 0.02, 0.02, 0.03, 0.02, 0.05, 0.04, 0.02, 0.07, 0.05, 0.03, 0.02, missing]
+    units = choice(rng, labels, probabilities, size)
+    hours = np.array([NJUI_UNIT_HOURS.get(unit.strip().lower() if isinstance(unit, str) else unit, np.nan) for unit in labels])
+    return units, hours[pd.Index(labels).get_indexer(units)]
+
+
+def njui_wages(rng, size, missing):
+    # Wages of random units around $12 an hour; returns (wages, unit labels as a categorical like read_stata gives)
+    units, hours = njui_unit_column(rng, size)
+    wages = np.round(12 * np.exp(rng.normal(0, 0.4, size)) * hours, 2)
+    wages[np.isnan(hours) | (rng.random(size) < missing)] = np.nan
+    return wages, pd.Categorical(units, categories=pd.Index(NJUI_UNIT_LABELS, dtype=object))
+
+
+def synthetic_njui_weekly(scale=1, seed=0):
+    # NJUI weekly file with the WEEKLY_COLUMNS of the pipeline: several weeks per case (possibly across a year
+    # change), rows in no particular order, messy unit labels and missing answers
+    rng = np.random.default_rng(seed)
+    n_cases = round(NJUI_CASES * scale)
+    case_ids = rng.choice(np.arange(100000000, 100000000 + 10 * n_cases), n_cases, replace=False).astype(np.int32)
+    weeks = rng.integers(1, NJUI_MAX_WEEKS + 1, n_cases)
+    n = int(weeks.sum())
+
+    case_rows = np.repeat(np.arange(n_cases), weeks)
+    week_number = np.arange(n) - np.repeat(np.cumsum(weeks) - weeks, weeks) + np.repeat(rng.integers(0, 52, n_cases), weeks)
+    received = rng.random(n) < 0.15
+    acceptance = np.where(received, choice(rng, np.array(['Yes', 'No', 'Do not know yet', None], dtype=object),
+                                           [0.3, 0.4, 0.2, 0.1], n), None)
+    reservation_wage, reservation_unit = njui_wages(rng, n, missing=0.3)
+    offer_wage, offer_unit = njui_wages(rng, n, missing=0.1)
+    accepted_wage, accepted_unit = njui_wages(rng, n, missing=0.2)
+    offer_wage[~received] = np.nan
+    accepted_wage[acceptance != 'Yes'] = np.nan
+
+    weekly = pd.DataFrame({
+        'caseid': case_ids[case_rows],
+        'curweek': (week_number % 52 + 1).astype(np.int16),
+        'curyear': (2009 + week_number // 52).astype(np.int16),
+        'startday': rng.integers(1, 8, n).astype(np.int8),
+        'starttime': rng.integers(0, 2400, n).astype(np.int16),
+        'stopday': rng.integers(1, 8, n).astype(np.int8),
+        'stoptime': rng.integers(0, 2400, n).astype(np.int16),
+        'extended_study': (rng.random(n) < 0.2).astype(np.int8),
+        'q7e': choice(rng, [np.nan, 0, 20, 30, 40, 50], [0.2, 0.05, 0.15, 0.2, 0.3, 0.1], n),
+        'q7a1': reservation_wage,
+        'q7a2': reservation_unit,
+        'q12_1_a': pd.Categorical(np.where(received, 'Yes', 'No')),
+        'q12_1_b': np.where(received, rng.integers(1, 4, n), np.nan),
+        'q13_1_a': offer_wage,
+        'q13_1_b1': offer_unit,
+        'q13_1_c': choice(rng, [np.nan, 0, 20, 30, 40], [0.3, 0.05, 0.15, 0.2, 0.3], n),
+        'q14_1': pd.Categorical(acceptance, categories=['Yes', 'No', 'Do not know yet']),
+        'q15_1': pd.Categorical(np.where(acceptance == 'No', 'Pay too low', None), categories=['Pay too low']),
+        'q13_2_a': accepted_wage,
+        'q13_2_b1': accepted_unit,
+        'q13_2_c': choice(rng, [np.nan, 30, 40], [0.3, 0.2, 0.5], n),
+    })
+    return weekly.iloc[rng.permutation(n)].reset_index(drop=True)
+
+
+def write_njui_weekly(weekly, path):
+    # Save a weekly frame as a Stata release like the real ones; Stata value labels are strings, so the numeric
+    # unit codes become labels '1'..'4' as in the survey files
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', pd.errors.ValueLabelTypeMismatch)
+        weekly.to_stata(path, write_index=False)
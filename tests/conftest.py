@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def make_offers(seed, n=2000, subgroups=True, missing=0.0):
+    # Offer table shaped like the outlier-filtered preprocessed tables: two offers per case, race and sex per case,
+    # wage differences rounded to cents (so range and bin edges fall on tied values) and acceptance rising with them
+    rng = np.random.default_rng(seed)
+    n_cases = n // 2
+    df = pd.DataFrame({
+        'case_id': np.repeat(np.arange(n_cases), 2),
+        'offered_wage': rng.lognormal(2, 0.5, 2 * n_cases),
+        'wage_difference': rng.normal(0, 0.5, 2 * n_cases).round(2),
+    })
+    df['acceptance_yn'] = rng.random(len(df)) < 1 / (1 + np.exp(-0.3 - 1.5 * df['wage_difference']))
+    if subgroups:
+        df['sample_race'] = np.repeat(rng.integers(1, 4, n_cases), 2)
+        df['sample_sex'] = np.repeat(rng.integers(1, 3, n_cases), 2)
+    if missing:
+        df.loc[rng.random(len(df)) < missing, 'wage_difference'] = np.nan
+    return df
+
+
+@pytest.fixture(scope='session')
+def offers():
+    return make_offers
+
+
+@pytest.fixture(scope='session')
+def variants():
+    # variant name -> (offers, case id column), as load_variants gives them; the NJUI tables have no race or sex
+    return {
+        'nlsy79/a': (make_offers(0), 'case_id'),
+        'nlsy79/b': (make_offers(1, n=3000), 'case_id'),
+        'njui/c': (make_offers(2, subgroups=False), 'case_id'),
+    }
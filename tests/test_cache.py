@@ -0,0 +1,26 @@
+import pandas as pd
+
+from joboffer import instrument
+from joboffer.cache import read_cached
+
+
+def read_positive(file_path):
+    df = pd.read_csv(file_path)
+    return instrument.filter_rows(df, 'read_positive', {'value > 0': df['value'] > 0})
+
+
+def test_warm_read_replays_the_filter_drops(tmp_path):
+    file_path = tmp_path / 'values.csv'
+    pd.DataFrame({'value': [3, -1, 0, 5, -2]}).to_csv(file_path, index=False)
+
+    # The first read runs without instrumentation; its drops are kept with the cache entry
+    cold = read_cached(read_positive, str(file_path))
+    recorder = instrument.enable()
+    try:
+        warm = read_cached(read_positive, str(file_path))
+    finally:
+        instrument.disable()
+    pd.testing.assert_frame_equal(warm, cold)
+    assert [(r['stage'], r['predicate'], r['rows_dropped'], r['cached']) for r in recorder.records] == [
+        ('read_positive', 'value > 0', 3, True)]
+    assert recorder.summary()[1].to_dict() == {('read_positive', 'value > 0'): 3}
@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from joboffer.cube import MARGIN, AcceptanceCube, grouped_quantiles
+
+EDGES = [-1 + i * 0.25 for i in range(9)]
+
+
+def reference(df):
+    # The pooled pipeline as it was written with pandas: 1.5 IQR filter, then pd.cut and a groupby per interval
+    Q1, Q3 = df['wage_difference'].quantile(0.25), df['wage_difference'].quantile(0.75)
+    IQR = Q3 - Q1
+    df = df[(df['wage_difference'] >= Q1 - 1.5 * IQR) & (df['wage_difference'] <= Q3 + 1.5 * IQR)]
+    bins = pd.cut(df['wage_difference'], bins=EDGES, right=False)
+    grouped = df.groupby(bins, observed=False).agg(
+        total_count=('acceptance_yn', 'size'), accept_count=('acceptance_yn', 'sum'),
+        mean_wage_difference=('wage_difference', 'mean'), mean_offered_wage=('offered_wage', 'mean'))
+    grouped['acceptance_ratio'] = grouped['accept_count'] / grouped['total_count']
+    return grouped.reset_index(names='bin'), df
+
+
+@pytest.fixture(scope='module')
+def stratified(variants, offers):
+    # The variants with race and sex, and one with a few missing wage differences
+    stratified = {name: variant for name, variant in variants.items() if 'sample_race' in variant[0]}
+    stratified['nlsy79/missing'] = (offers(3, missing=0.01), 'case_id')
+    return stratified
+
+
+def test_grouped_quantiles_match_pandas():
+    rng = np.random.default_rng(0)
+    for n in [1, 2, 5, 1001]:
+        values = rng.normal(size=n)
+        values[rng.random(n) < 0.1] = np.nan
+        groups = rng.integers(0, 3, n)
+        result = grouped_quantiles(values, groups, 4, [0.25, 0.75])
+        for group in range(4):
+            expected = pd.Series(values[groups == group]).quantile([0.25, 0.75]).to_numpy()
+            np.testing.assert_array_equal(result[group], expected)
+
+
+def test_pooled_slice_matches_reference(stratified):
+    cube = AcceptanceCube(stratified, EDGES)
+    for variant, (df, _) in stratified.items():
+        expected, kept = reference(df)
+        result = cube.slice(variant)
+        assert list(result['bin']) == list(expected['bin'])
+        pd.testing.assert_frame_equal(result.drop(columns='bin'), expected.drop(columns='bin'), check_dtype=False)
+
+        # A stratum of the pooled cube is the same filtered rows, restricted to the stratum
+        stratum = kept[(kept['sample_race'] == 2) & (kept['sample_sex'] == 1)]
+        counts = pd.cut(stratum['wage_difference'], bins=EDGES, right=False).value_counts(sort=False)
+        np.testing.assert_array_equal(cube.slice(variant, sample_race=2, sample_sex=1)['total_count'], counts.to_numpy())
+
+
+def test_stratum_bounds_match_reference(stratified):
+    cube = AcceptanceCube(stratified, EDGES, outlier_scope='stratum')
+    for variant, (df, _) in stratified.items():
+        for (race, sex), stratum in df.groupby(['sample_race', 'sample_sex']):
+            expected, _ = reference(stratum)
+            result = cube.slice(variant, sample_race=race, sample_sex=sex)
+            pd.testing.assert_frame_equal(result.drop(columns='bin'), expected.drop(columns='bin'), check_dtype=False)
+
+
+@pytest.mark.parametrize('outlier_scope', ['pooled', 'stratum'])
+def test_margins_are_sums_over_strata(stratified, outlier_scope):
+    cube = AcceptanceCube(stratified, EDGES, outlier_scope=outlier_scope)
+    races, sexes = cube.values['sample_race'], cube.values['sample_sex']
+    for variant in stratified:
+        cells = {(race, sex): cube.slice(variant, sample_race=race, sample_sex=sex) for race in races for sex in sexes}
+        for column in ['total_count', 'accept_count']:
+            total = sum(cell[column] for cell in cells.values())
+            np.testing.assert_array_equal(cube.slice(variant)[column], total)
+            np.testing.assert_array_equal(cube.slice(variant, sample_race=MARGIN, sample_sex=MARGIN)[column], total)
+            for race in races:
+                np.testing.assert_array_equal(cube.slice(variant, sample_race=race)[column],
+                                              sum(cells[(race, sex)][column] for sex in sexes))
+            for sex in sexes:
+                np.testing.assert_array_equal(cube.slice(variant, sample_sex=sex)[column],
+                                              sum(cells[(race, sex)][column] for race in races))
+
+        # Means of a margin are the count-weighted means of its strata
+        weighted = sum(cell['mean_offered_wage'].fillna(0) * cell['total_count'] for cell in cells.values())
+        np.testing.assert_allclose(cube.slice(variant)['mean_offered_wage'], weighted / cube.slice(variant)['total_count'])
+
+        # The long table holds every stratum and margin once
+        table = cube.table(variant)
+        assert len(table) == (len(races) + 1) * (len(sexes) + 1) * (len(EDGES) - 1)
+        assert table['total_count'].sum() == 4 * cube.slice(variant)['total_count'].sum()
+
+
+def test_stratum_rows_are_the_counted_rows(stratified):
+    cube = AcceptanceCube(stratified, EDGES)
+    rows = cube.stratum_rows('nlsy79/b', sample_sex=2)
+    counts = np.bincount(rows['bin'][rows['bin'] >= 0], minlength=len(EDGES) - 1)
+    np.testing.assert_array_equal(counts, cube.slice('nlsy79/b', sample_sex=2)['total_count'])
+
+
+def test_invalid_options(offers):
+    variants = {'variant_0': (offers(0, 100), 'case_id')}
+    with pytest.raises(ValueError):
+        AcceptanceCube(variants, EDGES, outlier_scope='per_case')
+    cube = AcceptanceCube(variants, EDGES)
+    with pytest.raises(ValueError):
+        cube.slice('variant_0', sample_race=9)
+    with pytest.raises(ValueError):
+        cube.slice('variant_0', age=1)
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from joboffer.estimation import estimate_models, stack_cells
+
+sm = pytest.importorskip('statsmodels.api')
+
+
+@pytest.fixture(scope='module')
+def fits(variants):
+    return estimate_models(*stack_cells(variants))
+
+
+def reference_fit(df, side, model):
+    # The same cell fitted by statsmodels with standard errors clustered by case
+    if side == 'negative':
+        df = df[df['wage_difference'] < 0]
+    elif side == 'positive':
+        df = df[df['wage_difference'] > 0]
+    X = sm.add_constant(df[['wage_difference']])
+    if model == 'kinked':
+        X['wage_difference_above_zero'] = np.maximum(df['wage_difference'], 0)
+    groups = pd.factorize(df['case_id'])[0]
+    if model == 'logit':
+        return sm.Logit(df['acceptance_yn'].astype(float), X).fit(cov_type='cluster', cov_kwds={'groups': groups}, disp=0)
+    return sm.OLS(df['acceptance_yn'].astype(float), X).fit(cov_type='cluster', cov_kwds={'groups': groups})
+
+
+@pytest.mark.parametrize('model, side', [('lpm', 'negative'), ('lpm', 'positive'), ('logit', 'negative'),
+                                         ('logit', 'positive'), ('kinked', 'both')])
+@pytest.mark.parametrize('subgroup', ['all', 'sample_sex=2', 'sample_race=3, sample_sex=1'])
+def test_matches_statsmodels(variants, fits, model, side, subgroup):
+    for variant, (df, _) in variants.items():
+        if subgroup != 'all' and 'sample_race' not in df:
+            continue
+        for part in subgroup.split(', ') if subgroup != 'all' else []:
+            column, value = part.split('=')
+            df = df[df[column] == int(value)]
+        reference = reference_fit(df, side, model)
+        rows = fits[(fits['variant'] == variant) & (fits['subgroup'] == subgroup)
+                    & (fits['side'] == side) & (fits['model'] == model)]
+        assert rows['converged'].all()
+        assert (rows['n_obs'] == len(df[df['wage_difference'] < 0] if side == 'negative' else
+                                     df[df['wage_difference'] > 0] if side == 'positive' else df)).all()
+        np.testing.assert_allclose(rows['estimate'], reference.params, rtol=1e-6)
+        np.testing.assert_allclose(rows['std_error'], reference.bse, rtol=1e-6)
+
+
+def test_every_cell_is_fitted(variants, fits):
+    # 1 + 3 races + 2 sexes + 6 race-sex cells per variant with subgroups, only 'all' for the others; lpm and logit
+    # on two sides, kinked on both
+    cells = fits.groupby(['variant', 'subgroup', 'side', 'model']).ngroups
+    assert cells == sum(12 if 'sample_race' in df else 1 for df, _ in variants.values()) * 5
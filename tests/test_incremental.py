@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from joboffer.schema import read_table
+from joboffer.synthetic import synthetic_njui_weekly, write_njui_weekly
+from NJUI.incremental import update_preprocessed_tables
+from NJUI.preprocessing_data import OUTPUT_FILE_NAMES, main
+
+
+def set_offer(weekly, row, acceptance, reservation_wage):
+    # An hourly offer of $15 with an hourly reservation wage, so the row reaches the preprocessed tables
+    weekly.loc[row, ['q7a1', 'q13_1_a']] = [reservation_wage, 15.0]
+    weekly.loc[row, ['q7a2', 'q13_1_b1']] = 'Hour'
+    weekly.loc[row, 'q12_1_a'] = 'Yes'
+    weekly.loc[row, 'q14_1'] = acceptance
+
+
+@pytest.fixture(scope='module')
+def releases():
+    # Two weekly releases split at a week: the second holds only the weeks after the first
+    weekly = synthetic_njui_weekly(scale=0.1, seed=0)
+    week = weekly['curyear'].astype(int) * 100 + weekly['curweek'].astype(int)
+    cut = int(week.median())
+    first_week = week.groupby(weekly['caseid']).transform('min')
+    last_week = week.groupby(weekly['caseid']).transform('max')
+
+    # A case with one accepted offer in each release: its rows of the first run are dropped by the second
+    dual_case = weekly.loc[(first_week < cut) & (last_week >= cut), 'caseid'].iloc[0]
+    rows = week[weekly['caseid'] == dual_case].sort_values().index
+    weekly.loc[rows, 'q7a1'] = 12.0
+    weekly.loc[rows, 'q7a2'] = 'Hour'
+    set_offer(weekly, rows[0], 'Yes', 12.0)
+    set_offer(weekly, rows[-1], 'Yes', 12.0)
+
+    # A case first seen in the second release, with an offer in its first week: its previous reservation wage is
+    # its own (entry) reservation wage, not one stored by the first run
+    new_case = weekly.loc[first_week > cut, 'caseid'].iloc[0]
+    set_offer(weekly, week[weekly['caseid'] == new_case].idxmin(), 'No', 10.0)
+
+    return weekly[week < cut], weekly[week >= cut], dual_case, new_case
+
+
+def read_outputs(data_dir):
+    return {option: read_table(os.path.join(data_dir, file_name), 'njui_offers', float_precision='round_trip')
+            for option, file_name in OUTPUT_FILE_NAMES.items()}
+
+
+def test_incremental_updates_match_full_run(releases, tmp_path):
+    first, second, dual_case, new_case = releases
+    incremental_dir, full_dir = tmp_path / 'incremental', tmp_path / 'full'
+    for data_dir in [incremental_dir, full_dir]:
+        data_dir.mkdir()
+        write_njui_weekly(first, data_dir / 'weekly20150101.dta')
+
+    update_preprocessed_tables(str(incremental_dir), use_cache=False)
+    tables = read_outputs(incremental_dir)
+    assert (tables['exclude_dontknow']['caseid'] == dual_case).any()
+    assert not (tables['exclude_dontknow']['caseid'] == new_case).any()
+
+    for data_dir in [incremental_dir, full_dir]:
+        write_njui_weekly(second, data_dir / 'weekly20150201.dta')
+    update_preprocessed_tables(str(incremental_dir), use_cache=False)
+    main(str(full_dir), use_cache=False)
+
+    tables, expected = read_outputs(incremental_dir), read_outputs(full_dir)
+    for option in OUTPUT_FILE_NAMES:
+        assert len(expected[option]) > 0
+        pd.testing.assert_frame_equal(tables[option], expected[option])
+        assert not (tables[option]['caseid'] == dual_case).any()
+    new_rows = tables['exclude_dontknow'][tables['exclude_dontknow']['caseid'] == new_case]
+    np.testing.assert_array_equal(new_rows['previous_wage'].iloc[:1], [10.0])
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+from NJUI.preprocessing_data import (HOURLY_WAGE_COLUMNS, WAGE_UNITS, calculate_hourly_wage,
+                                     generate_hourly_wage_columns, normalize_wage_unit)
+
+
+def row_wise_hourly_wage(row, hours_column, wage_column, unit_column):
+    # The original per-row conversion of calculate_hourly_wage, applied with df.apply(..., axis=1)
+    hours_worked_weekly = row[hours_column]
+    wage = row[wage_column]
+    unit = row[unit_column]
+    if pd.isnull(hours_worked_weekly) or hours_worked_weekly == 0:
+        hours_worked_weekly = 40
+    if unit in [1, 'Year', 'year']:
+        return wage / (hours_worked_weekly * 52)
+    elif unit in [2, 'Month', 'month']:
+        return wage / (hours_worked_weekly * 4)
+    elif unit in [3, 'Week', 'week', ' Week'] or unit in ['every two weeks', 'Every two week']:
+        if unit in ['every two weeks', 'Every two week']:
+            hours_worked_weekly *= 2
+        return wage / hours_worked_weekly
+    elif unit == 4 or unit == 'Hour' or unit == 'hour':
+        return wage
+    return None
+
+
+# Every unit label and code, unknown and missing units, and null, zero and given weekly hours
+UNITS = ['Hour', 'hour', 4, 'Week', 'week', ' Week', 3, 'every two weeks', 'Every two week', 'Month', 'month', 2,
+         'Year', 'year', 1, 'Day', 'HOUR', 7, None]
+HOURS = [np.nan, 0, 30]
+
+
+def wage_frame():
+    units = UNITS * len(HOURS)
+    n = len(units)
+    df = pd.DataFrame({'caseid': np.arange(n)})
+    for i, (hours_column, wage_column, unit_column, _) in enumerate(HOURLY_WAGE_COLUMNS):
+        df[hours_column] = np.repeat(HOURS, len(UNITS))
+        df[wage_column] = 1000.0 + 10 * i + np.arange(n)
+        # Each wage column gets the labels in a different order, as a categorical like read_stata gives it
+        df[unit_column] = pd.Categorical(np.roll(np.array(units, dtype=object), i))
+    df.loc[3, HOURLY_WAGE_COLUMNS[0][1]] = np.nan
+    return df
+
+
+def test_normalize_wage_unit():
+    codes = normalize_wage_unit(pd.Categorical(np.array(UNITS, dtype=object)))
+    expected = ['hour'] * 3 + ['week'] * 4 + ['two_weeks'] * 2 + ['month'] * 3 + ['year'] * 3
+    assert [WAGE_UNITS[code] for code in codes[:15]] == expected
+    # Unrecognized labels (other spellings too) and missing units are -1
+    assert (codes[15:] == -1).all()
+
+
+def test_hourly_wages_match_row_wise():
+    df = wage_frame()
+    result = generate_hourly_wage_columns(df)
+    for hours_column, wage_column, unit_column, output_column in HOURLY_WAGE_COLUMNS:
+        expected = df.apply(row_wise_hourly_wage, axis=1, args=(hours_column, wage_column, unit_column))
+        expected = expected.astype(float)
+        np.testing.assert_array_equal(result[output_column], expected)
+        # Each column alone gives the same wages as all three together
+        single = calculate_hourly_wage(df, hours_column, wage_column, unit_column, output_column)
+        np.testing.assert_array_equal(single[output_column], expected)
+
+    # Null and zero hours are 40, biweekly wages are paid for twice the weekly hours, unknown units are missing
+    wages = result.set_index(df[HOURLY_WAGE_COLUMNS[1][2]].astype(object).fillna('missing'))
+    weekly = wages.loc['week', 'job_offer_wage_hourly'].to_numpy()
+    wage = df.loc[df['job_offer_unit'] == 'week', 'job_offer_wage'].to_numpy()
+    np.testing.assert_allclose(weekly, wage / [40, 40, 30])
+    biweekly = wages.loc['every two weeks', 'job_offer_wage_hourly'].to_numpy()
+    wage = df.loc[df['job_offer_unit'] == 'every two weeks', 'job_offer_wage'].to_numpy()
+    np.testing.assert_allclose(biweekly, wage / [80, 80, 60])
+    assert wages.loc[['Day', 'HOUR', 7, 'missing'], 'job_offer_wage_hourly'].isnull().all()
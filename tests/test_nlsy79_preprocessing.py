@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+
+from job_offer.preprocess_data import HOURS_PER_TIME_UNIT, INVALID_HOURLY_WAGE, adjust_to_hourly, create_final_data
+
+
+def row_wise_adjust_to_hourly(row):
+    # The original per-row conversion, applied with data.apply(..., axis=1)
+    wage = row['best_wage_rejected']
+    time_unit = row['time_unit_of_rejected_wage']
+    if time_unit == 1:
+        return wage
+    elif time_unit == 2:
+        return wage / 8
+    elif time_unit == 3:
+        return wage / (8 * 5)
+    elif time_unit == 5:
+        return wage / (8 * 5 * 4)
+    elif time_unit == 6:
+        return wage / (8 * 5 * 52)
+    else:
+        return -100
+
+
+def row_wise_final_data(processed_stage_2):
+    # The original iterrows builder: an accepted (1982 CPS) row, then a rejected row, per case
+    new_data = []
+    for _, row in processed_stage_2.iterrows():
+        case = {column: row[column] for column in ['case_id', 'sample_id', 'sample_race', 'sample_sex']}
+        new_data.append({**case, 'offered_wage': row['1982_cps_wage'], 'previous_wage': row['previous_wage'],
+                         'acceptance_yn': 'y'})
+        new_data.append({**case, 'offered_wage': row['best_wage_rejected_hr'], 'previous_wage': row['previous_wage'],
+                         'acceptance_yn': 'n'})
+    return pd.DataFrame(new_data)
+
+
+def test_adjust_to_hourly_matches_row_wise():
+    # Every known unit, the unknown codes 0, 4 and 7, a missing unit and a missing wage
+    data = pd.DataFrame({
+        'best_wage_rejected': pd.array([500, 4000, 20000, 85000, 1200, 900, 700, 650, None, 300], dtype='Int32'),
+        'time_unit_of_rejected_wage': pd.array([1, 2, 3, 5, 6, 0, 4, 7, 1, None], dtype='Int8'),
+    })
+    expected = data.astype(float).apply(row_wise_adjust_to_hourly, axis=1)
+    result = adjust_to_hourly(data['best_wage_rejected'], data['time_unit_of_rejected_wage'])
+    np.testing.assert_array_equal(result, expected)
+    assert (result[[5, 6, 7, 9]] == INVALID_HOURLY_WAGE).all()
+
+
+def test_adjust_to_hourly_alternative_hours():
+    # A grid of hours per day gives one row of hourly wages per alternative
+    hours = {unit: np.array([hours, hours if unit == 1 else hours * 10 / 8])
+             for unit, hours in HOURS_PER_TIME_UNIT.items()}
+    result = adjust_to_hourly([800, 800, 800], [1, 2, 9], hours)
+    np.testing.assert_array_equal(result, [[800, 100, INVALID_HOURLY_WAGE], [800, 80, INVALID_HOURLY_WAGE]])
+
+
+def test_create_final_data_matches_row_wise():
+    # Cases out of case id order (the order is kept), a missing CPS wage and an invalid rejected wage
+    processed_stage_2 = pd.DataFrame({
+        'case_id': pd.array([7, 3, 12, 5], dtype='Int32'),
+        'sample_id': pd.array([1, 5, 9, 2], dtype='Int8'),
+        'sample_race': pd.array([3, 2, 1, 3], dtype='Int8'),
+        'sample_sex': pd.array([1, 2, 2, 1], dtype='Int8'),
+        '1982_cps_wage': pd.array([650, None, 420, 900], dtype='Int32'),
+        'previous_wage': [5.0, 4.25, 3.5, 8.0],
+        'best_wage_rejected_hr': [6.0, 4.5, INVALID_HOURLY_WAGE, 7.125],
+    }, index=[10, 4, 8, 2])
+    expected = row_wise_final_data(processed_stage_2.astype(float))
+    expected['acceptance_yn'] = expected['acceptance_yn'] == 'y'
+    result = create_final_data(processed_stage_2)
+    assert list(result.columns) == list(expected.columns)
+    assert list(result['case_id']) == [7, 7, 3, 3, 12, 12, 5, 5]
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+from joboffer.panel import Panel
+from NJUI.preprocessing_data import exclude_dual_job, generate_previous_reservation_wage
+
+
+def row_wise_previous_reservation_wage(df):
+    # The original lag stage: sort, two groupby shifts, then the own wage where the lag is missing
+    df = df.sort_values(by=['caseid', 'curyear', 'curweek'])
+    df['prev_reservation_wage'] = df.groupby('caseid')['reservation_wage'].shift()
+    df['prev_reservation_unit'] = df.groupby('caseid')['reservation_unit'].shift()
+    first_rows_mask1 = df['prev_reservation_wage'].isnull()
+    first_rows_mask2 = df['prev_reservation_unit'].isnull()
+    df.loc[first_rows_mask1, 'prev_reservation_wage'] = df.loc[first_rows_mask1, 'reservation_wage']
+    df.loc[first_rows_mask2, 'prev_reservation_unit'] = df.loc[first_rows_mask2, 'reservation_unit']
+    return df[df['prev_reservation_wage'].notnull()]
+
+
+def row_wise_exclude_dual_job(df_hourly_wage):
+    # The original exclusion: a groupby count of 'Yes' rows and an isin over the cases with two or more
+    filtered_df = df_hourly_wage[df_hourly_wage['previous_wage_hourly'].notnull()
+                                 & df_hourly_wage['job_offer_wage_hourly'].notnull()
+                                 & df_hourly_wage['acceptance_yn'].notnull()]
+    yes_counts = filtered_df[filtered_df['acceptance_yn'] == 'Yes'].groupby('caseid')['acceptance_yn'].count()
+    caseids_with_multiple_yes = yes_counts[yes_counts >= 2].index.tolist()
+    return filtered_df[~filtered_df['caseid'].isin(caseids_with_multiple_yes)]
+
+
+def weekly_frame():
+    # Rows out of order; case 30 crosses a year change, case 20 has one row, and case 10 starts with a missing
+    # wage, so the lag of its second week falls back to that week's own wage
+    rows = [
+        (30, 2010, 1, 14.0, 'Hour'), (10, 2009, 5, 11.0, 'Hour'), (20, 2009, 40, 500.0, 'Week'),
+        (30, 2009, 52, 13.0, 'hour'), (10, 2009, 3, np.nan, None), (10, 2009, 4, 10.0, 'Hour'),
+        (30, 2010, 2, np.nan, 'Hour'), (10, 2009, 6, np.nan, None), (30, 2009, 51, 12.5, 'Month'),
+    ]
+    df = pd.DataFrame(rows, columns=['caseid', 'curyear', 'curweek', 'reservation_wage', 'reservation_unit'],
+                      index=[11, 3, 7, 0, 5, 9, 2, 8, 4])
+    return df.astype({'caseid': np.int32, 'curyear': np.int16, 'curweek': np.int8, 'reservation_unit': 'category'})
+
+
+def test_lag_and_count_stay_within_cases():
+    df = weekly_frame()
+    panel = Panel(df['caseid'], df['curyear'], df['curweek'])
+    sorted_df = panel.sort(df)
+    assert list(panel.case_ids) == [10, 20, 30]
+    assert list(panel.sizes) == [4, 1, 4]
+
+    # The first row of every case has no lag, even where the previous sorted row belongs to another case
+    lag = panel.lag(sorted_df['reservation_wage'])
+    pd.testing.assert_series_equal(lag, sorted_df.groupby('caseid')['reservation_wage'].shift())
+    assert lag[panel.first_rows()].isnull().all()
+
+    hourly = (sorted_df['reservation_unit'] == 'Hour').to_numpy()
+    np.testing.assert_array_equal(panel.count(hourly), sorted_df.groupby('caseid')['reservation_unit']
+                                  .apply(lambda units: (units == 'Hour').sum()))
+    np.testing.assert_array_equal(panel.unsort(panel.sort(df.index.to_numpy())), df.index)
+
+
+def test_previous_reservation_wage_matches_row_wise():
+    df = weekly_frame()
+    expected = row_wise_previous_reservation_wage(df.copy())
+    result = generate_previous_reservation_wage(df)
+    pd.testing.assert_frame_equal(result, expected)
+    # The input frame is left as it was
+    pd.testing.assert_frame_equal(df, weekly_frame())
+
+    # Lags over the full history, kept for some rows only, equal the lags of the full table
+    offers = df.loc[[3, 2, 4]]
+    result = generate_previous_reservation_wage(offers, reservation_history=df)
+    pd.testing.assert_frame_equal(result, expected.loc[expected.index.isin(offers.index)])
+
+
+def test_exclude_dual_job_matches_row_wise():
+    # Case 1 has two accepted offers, one of them at a row without an hourly wage; case 2 has two; case 3 has one
+    df = pd.DataFrame({
+        'caseid': np.array([1, 1, 1, 2, 2, 2, 3, 3, 4], dtype=np.int32),
+        'previous_wage_hourly': [10.0, np.nan, 11.0, 9.0, 9.5, 9.5, 12.0, 12.0, 8.0],
+        'job_offer_wage_hourly': [12.0, 13.0, 12.5, 10.0, 11.0, np.nan, 14.0, 15.0, 9.0],
+        'acceptance_yn': pd.Categorical(['Yes', 'Yes', 'No', 'Yes', 'Yes', 'Yes', 'Yes', None, 'No']),
+    })
+    pd.testing.assert_frame_equal(exclude_dual_job(df), row_wise_exclude_dual_job(df))
+    assert set(exclude_dual_job(df)['caseid']) == {1, 3, 4}
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+from joboffer.quantiles import QuantileSketch
+
+RANK_ERROR = 0.01  # Largest rank error allowed, as a share of the values (the default sketch stays well below it)
+
+
+def chunked_sketch(values, chunks):
+    sketch = QuantileSketch()
+    for chunk in np.array_split(values, chunks):
+        sketch.update(chunk)
+    return sketch
+
+
+def test_small_input_is_exact():
+    values = np.random.default_rng(0).normal(size=500)
+    sketch = chunked_sketch(values, 7)
+    q = np.linspace(0, 1, 41)
+    np.testing.assert_allclose(sketch.quantile(q), pd.Series(values).quantile(q).to_numpy())
+    assert sketch.rank(0.0) == (values < 0).sum()
+
+
+def test_rank_error_within_bound():
+    for seed in range(3):
+        values = np.random.default_rng(seed).standard_t(3, size=200000)
+        sketch = chunked_sketch(values, 37)
+        assert sum(len(level) for level in sketch.levels) < 2 * sketch.size
+
+        probes = np.quantile(values, np.linspace(0, 1, 101))
+        exact = np.searchsorted(np.sort(values), probes)
+        assert np.abs(sketch.rank(probes) - exact).max() <= RANK_ERROR * len(values)
+
+        q = np.linspace(0.01, 0.99, 99)
+        ranks = np.searchsorted(np.sort(values), sketch.quantile(q)) / len(values)
+        assert np.abs(ranks - q).max() <= RANK_ERROR
+
+
+def test_missing_and_infinite_values_are_skipped():
+    sketch = QuantileSketch().update([1.0, np.nan, np.inf, -np.inf, 3.0])
+    assert sketch.count == 2
+    assert sketch.quantile(0.5) == 2.0
+
+
+def test_merged_partitions_within_bound():
+    # Sketches of separate partitions (e.g. chunks of a file), merged, answer like one sketch of all the values
+    values = np.random.default_rng(0).standard_t(3, size=200000)
+    partitions = np.array_split(values, 13)
+    merged = QuantileSketch()
+    for partition in partitions:
+        merged.merge(chunked_sketch(partition, 5))
+    single = chunked_sketch(values, 37)
+    assert merged.count == len(values)
+    assert (merged.min, merged.max) == (values.min(), values.max())
+    assert sum(len(level) for level in merged.levels) < 2 * merged.size
+
+    probes = np.quantile(values, np.linspace(0, 1, 101))
+    exact = np.searchsorted(np.sort(values), probes)
+    for sketch in [merged, single]:
+        assert np.abs(sketch.rank(probes) - exact).max() <= RANK_ERROR * len(values)
+    assert np.abs(merged.rank(probes) - single.rank(probes)).max() <= 2 * RANK_ERROR * len(values)
+
+    # Below the sketch size nothing is compacted, so merged partitions are exact
+    small = np.random.default_rng(1).normal(size=500)
+    sketch = QuantileSketch()
+    for partition in np.array_split(small, 4):
+        sketch.merge(QuantileSketch().update(partition))
+    q = np.linspace(0, 1, 41)
+    np.testing.assert_allclose(sketch.quantile(q), pd.Series(small).quantile(q).to_numpy())
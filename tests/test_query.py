@@ -0,0 +1,83 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from joboffer.query import AcceptanceIndex, make_server
+
+
+@pytest.fixture(scope='module')
+def index(variants):
+    return AcceptanceIndex(variants)
+
+
+def brute_force(df, lower, upper, subgroup, right):
+    for column, value in subgroup.items():
+        df = df[df[column] == value]
+    w = df['wage_difference']
+    in_range = (w > lower) & (w <= upper) if right else (w >= lower) & (w < upper)
+    return int(in_range.sum()), int(df['acceptance_yn'][in_range].sum())
+
+
+def test_ranges_match_brute_force(variants, index):
+    rng = np.random.default_rng(0)
+    for variant, (df, _) in variants.items():
+        for _ in range(300):
+            lower, upper = np.sort(rng.choice(np.arange(-1.5, 1.5, 0.01).round(2), 2))
+            right = bool(rng.integers(2))
+            subgroup = {}
+            if 'sample_sex' in df and rng.random() < 0.5:
+                subgroup['sample_sex'] = int(rng.integers(1, 3))
+            if 'sample_race' in df and rng.random() < 0.5:
+                subgroup['sample_race'] = int(rng.integers(1, 4))
+            result = index.acceptance_range(variant, lower, upper, subgroup, right)
+            assert (result['total_count'], result['accept_count']) == brute_force(df, lower, upper, subgroup, right)
+
+
+def test_consecutive_ranges_match_pd_cut(variants, index):
+    df = variants['nlsy79/a'][0]
+    edges = [-np.inf, -0.5, 0, 0.25, 0.5, np.inf]
+    table = index.acceptance('nlsy79/a', edges, {'sample_sex': 2})
+    df = df[df['sample_sex'] == 2]
+    grouped = df.groupby(pd.cut(df['wage_difference'], edges, right=False), observed=False)['acceptance_yn']
+    np.testing.assert_array_equal(table['total_count'], grouped.size())
+    np.testing.assert_array_equal(table['accept_count'], grouped.sum())
+    np.testing.assert_allclose(table['acceptance_ratio'], grouped.mean())
+
+
+def test_invalid_queries(index):
+    with pytest.raises(ValueError):
+        index.acceptance_range('nope')
+    with pytest.raises(ValueError):
+        index.acceptance_range('njui/c', subgroup={'sample_sex': 2})
+    with pytest.raises(ValueError):
+        index.acceptance_counts('nlsy79/a', [1, 0])
+    # A subgroup value without rows is an empty range
+    assert index.acceptance_range('nlsy79/a', subgroup={'sample_sex': 9})['acceptance_ratio'] is None
+
+
+def test_http_server(variants, index):
+    server = make_server(index, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    try:
+        described = json.load(urllib.request.urlopen(base + '/variants'))
+        assert described['nlsy79/a']['subgroups']['sample_sex'] == [1, 2]
+        assert described['njui/c']['rows'] == len(variants['njui/c'][0])
+
+        records = json.load(urllib.request.urlopen(base + '/acceptance?variant=nlsy79/a&lower=-0.3&upper=0.1&sample_sex=2'))
+        expected = brute_force(variants['nlsy79/a'][0], -0.3, 0.1, {'sample_sex': 2}, False)
+        assert (records[0]['total_count'], records[0]['accept_count']) == expected
+        assert len(json.load(urllib.request.urlopen(base + '/acceptance?variant=njui/c&edges=-1,0,1'))) == 2
+
+        for query, status in [('/acceptance?variant=nope', 400), ('/acceptance?variant=njui/c&edges=1,0', 400), ('/x', 404)]:
+            with pytest.raises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(base + query)
+            assert error.value.code == status
+    finally:
+        server.shutdown()
+        server.server_close()
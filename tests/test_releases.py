@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from joboffer.synthetic import synthetic_njui_weekly, write_njui_weekly
+from NJUI.preprocessing_data import WEEK_KEY_COLUMNS, load_weekly_releases
+
+
+@pytest.fixture(scope='module')
+def release_paths(tmp_path_factory):
+    # An older release of every week and a newer one answering half the cases again with different values:
+    # reservation wages one dollar higher, offers a dollar higher, and one offer withdrawn
+    folder = tmp_path_factory.mktemp('releases')
+    older = synthetic_njui_weekly(scale=0.05, seed=0)
+    cases = older['caseid'].unique()
+    newer = older[older['caseid'].isin(cases[::2])].copy()
+    newer['q7a1'] += 1
+    newer['q13_1_a'] += 1
+    withdrawn = newer['q13_1_a'].first_valid_index()
+    newer.loc[withdrawn, 'q13_1_a'] = np.nan
+
+    paths = [folder / 'weekly20150101.dta', folder / 'weekly20150201.dta']
+    write_njui_weekly(older, paths[0])
+    write_njui_weekly(newer, paths[1])
+    return [str(path) for path in paths], older, newer, newer.loc[withdrawn, WEEK_KEY_COLUMNS]
+
+
+def by_week(df):
+    return df.set_index(WEEK_KEY_COLUMNS).sort_index()
+
+
+def test_newer_release_wins(release_paths):
+    paths, older, newer, withdrawn = release_paths
+    offers, history = load_weekly_releases(paths, use_cache=False, processes=1)
+
+    # Every week once, with the values of the newest release that answered it
+    assert len(history) == len(older)
+    assert not history.duplicated(subset=WEEK_KEY_COLUMNS).any()
+    expected = by_week(older)['q7a1'].astype(float)
+    expected.update(by_week(newer)['q7a1'])
+    np.testing.assert_array_equal(by_week(history)['reservation_wage'].reindex(expected.index), expected)
+
+    # Offers of a week answered again come from the newer release only, so a withdrawn offer is gone
+    expected = pd.concat([older[~older['caseid'].isin(newer['caseid'])], newer])
+    expected = by_week(expected[expected['q13_1_a'].notnull()])['q13_1_a']
+    pd.testing.assert_series_equal(by_week(offers)['job_offer_wage'], expected, check_names=False,
+                                   check_index_type=False)
+    assert tuple(withdrawn) not in by_week(offers).index
+
+    # Offers still link to their history rows
+    assert offers.index.isin(history.index).all()
+
+
+def test_result_does_not_depend_on_workers(release_paths):
+    paths = release_paths[0]
+    offers, history = load_weekly_releases(paths, use_cache=False, processes=1)
+    parallel_offers, parallel_history = load_weekly_releases(paths, use_cache=False, processes=2)
+    pd.testing.assert_frame_equal(parallel_offers, offers)
+    pd.testing.assert_frame_equal(parallel_history, history)